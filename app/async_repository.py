@@ -0,0 +1,168 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from app.db import get_async_session, reads, writes
+from app import models
+from app.repository import Page, RowVersion, DEFAULT_PAGE_SIZE, _keyset, _to_page, _session_detail_statement
+from app.repository import _charging_sessions_version_statement, _telemetry_span_statement, _station_assets_by_stations_statement
+from typing import Optional, List
+
+# Async mirror of the app/repository.py functions used by the async handlers
+# in main.py and app/async_service.py; nothing else is mirrored, so the two
+# query paths cannot drift apart unnoticed. Same semantics: pass the
+# request-scoped AsyncSession as `db` to join its transaction (flush only),
+# or omit it for a short-lived session that commits on its own.
+
+@asynccontextmanager
+async def _session_scope(db: Optional[AsyncSession] = None):
+    if db is not None:
+        yield db
+    else:
+        async with get_async_session() as s:
+            yield s
+
+async def _paginate(s: AsyncSession, statement, key, limit: int, cursor: Optional[int], descending: bool = False) -> Page:
+    rows = (await s.exec(_keyset(statement, key, limit, cursor, descending))).all()
+    return _to_page(rows, key, limit)
+
+# ==========================================
+# STATION MANAGEMENT CONTEXT
+# ==========================================
+
+@reads
+async def get_station_assets_by_stations(station_ids: List[int], db: Optional[AsyncSession] = None) -> List[models.StationAsset]:
+    if not station_ids:
+        return []
+    async with _session_scope(db) as s:
+        return (await s.exec(_station_assets_by_stations_statement(station_ids))).all()
+
+
+# ==========================================
+# CHARGING SESSION CONTEXT
+# ==========================================
+
+@reads
+async def get_charging_session(session_id: int, db: Optional[AsyncSession] = None) -> Optional[models.ChargingSession]:
+    async with _session_scope(db) as s:
+        return await s.get(models.ChargingSession, session_id)
+
+@reads
+async def get_charging_sessions_by_user(user_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[AsyncSession] = None) -> Page:
+    async with _session_scope(db) as s:
+        statement = select(models.ChargingSession).where(models.ChargingSession.user_id == user_id)
+        return await _paginate(s, statement, models.ChargingSession.session_id, limit, cursor, descending=True)
+
+@reads
+async def get_charging_sessions_version(user_id: int, db: Optional[AsyncSession] = None) -> RowVersion:
+    async with _session_scope(db) as s:
+        return RowVersion(*(await s.exec(_charging_sessions_version_statement(user_id))).one())
+
+@reads
+async def get_charging_session_detail(session_id: int, user_id: Optional[int] = None, db: Optional[AsyncSession] = None) -> Optional[models.ChargingSession]:
+    """Session with user, asset and invoice loaded in a single query (see repository.get_charging_session_detail)."""
+    async with _session_scope(db) as s:
+        statement = _session_detail_statement().where(models.ChargingSession.session_id == session_id)
+        if user_id is not None:
+            statement = statement.where(models.ChargingSession.user_id == user_id)
+        return (await s.exec(statement)).first()
+
+@reads
+async def get_active_session_detail(user_id: int, db: Optional[AsyncSession] = None) -> Optional[models.ChargingSession]:
+    """The user's ONGOING session with its relations, in a single query."""
+    async with _session_scope(db) as s:
+        statement = _session_detail_statement().where(
+            models.ChargingSession.user_id == user_id,
+            models.ChargingSession.charging_status == models.ChargingStatus.ONGOING
+        )
+        return (await s.exec(statement)).first()
+
+
+# ==========================================
+# TELEMETRY (Meter Values)
+# ==========================================
+
+@reads
+async def get_latest_meter_batch(session_id: int, db: Optional[AsyncSession] = None) -> Optional[models.MeterBatch]:
+    async with _session_scope(db) as s:
+        statement = (
+            select(models.MeterBatch)
+            .where(models.MeterBatch.session_id == session_id)
+            .order_by(models.MeterBatch.seq.desc())
+            .limit(1)
+        )
+        return (await s.exec(statement)).first()
+
+@writes
+async def append_meter_batch(batch: models.MeterBatch, db: Optional[AsyncSession] = None) -> models.MeterBatch:
+    """
+    Stores one batch and moves the session's running total in the same
+    transaction. Fails when the session is no longer ONGOING or another
+    batch with the same seq won the race.
+    """
+    async with _session_scope(db) as s:
+        result = await s.exec(
+            update(models.ChargingSession)
+            .where(
+                models.ChargingSession.session_id == batch.session_id,
+                models.ChargingSession.charging_status == models.ChargingStatus.ONGOING
+            )
+            .values(metered_kwh=batch.total_kwh, updated_at=datetime.utcnow())
+        )
+        if result.rowcount != 1:
+            raise ValueError("Session tidak ditemukan atau sudah berakhir")
+
+        s.add(batch)
+        try:
+            await s.flush()
+        except IntegrityError:
+            await s.rollback()
+            raise ValueError("Batch meter values bentrok dengan batch lain, kirim ulang")
+
+        if db is None:
+            await s.commit()
+        return batch
+
+
+@writes
+async def create_telemetry_chunks(chunks: List[models.TelemetryChunk], db: Optional[AsyncSession] = None) -> List[models.TelemetryChunk]:
+    async with _session_scope(db) as s:
+        s.add_all(chunks)
+        if db is None:
+            await s.commit()
+        else:
+            await s.flush()
+        return chunks
+
+@reads
+async def get_telemetry_chunks(
+    session_id: int,
+    resolution: int,
+    start_ts: Optional[float] = None,
+    end_ts: Optional[float] = None,
+    db: Optional[AsyncSession] = None
+) -> List[models.TelemetryChunk]:
+    """Chunks of one resolution overlapping [start_ts, end_ts), oldest first."""
+    async with _session_scope(db) as s:
+        statement = select(models.TelemetryChunk).where(
+            models.TelemetryChunk.session_id == session_id,
+            models.TelemetryChunk.resolution == resolution
+        )
+        if end_ts is not None:
+            statement = statement.where(models.TelemetryChunk.start_ts < end_ts)
+        if start_ts is not None:
+            statement = statement.where(models.TelemetryChunk.end_ts > start_ts)
+        statement = statement.order_by(models.TelemetryChunk.start_ts)
+        return (await s.exec(statement)).all()
+
+@reads
+async def get_telemetry_span(
+    session_id: int,
+    resolution: int,
+    start_ts: Optional[float] = None,
+    end_ts: Optional[float] = None,
+    db: Optional[AsyncSession] = None
+) -> tuple:
+    async with _session_scope(db) as s:
+        return tuple((await s.exec(_telemetry_span_statement(session_id, resolution, start_ts, end_ts))).one())
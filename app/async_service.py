@@ -0,0 +1,50 @@
+from typing import List, Optional
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app import async_repository, models, telemetry
+from app.schemas import MeterIngestResult, PowerCurve
+from app.service import _check_curve_span, _check_meter_session, _curve_resolution, _ingest_result, _power_curve
+
+# Async variants of the app/service.py use cases served by async endpoints,
+# built on app/async_repository.py. Validation and result building are the
+# shared pure helpers of the sync service; only the awaited I/O lives here.
+
+async def ingest_meter_values(
+    session_id: int,
+    user_id: int,
+    readings: List[telemetry.MeterReading],
+    db: Optional[AsyncSession] = None
+) -> MeterIngestResult:
+    _check_meter_session(await async_repository.get_charging_session(session_id, db=db), user_id)
+
+    state = telemetry.state_from_batch(await async_repository.get_latest_meter_batch(session_id, db=db))
+    new_state, accepted = telemetry.fold(state, readings)
+    if accepted:
+        await async_repository.append_meter_batch(telemetry.batch_from_state(session_id, new_state, accepted), db=db)
+        await async_repository.create_telemetry_chunks(telemetry.rollup_chunks(session_id, state, accepted), db=db)
+    return _ingest_result(session_id, readings, new_state, accepted)
+
+async def get_power_curve(
+    session_id: int,
+    user_id: int,
+    resolution: str = "1m",
+    start_ts: Optional[float] = None,
+    end_ts: Optional[float] = None,
+    db: Optional[AsyncSession] = None
+) -> PowerCurve:
+    seconds = _curve_resolution(resolution, start_ts, end_ts)
+
+    session = await async_repository.get_charging_session(session_id, db=db)
+    if not session or session.user_id != user_id:
+        raise ValueError("Session tidak ditemukan")
+
+    if start_ts is None or end_ts is None:
+        span = await async_repository.get_telemetry_span(session_id, seconds, start_ts, end_ts, db=db)
+        _check_curve_span(seconds, start_ts, end_ts, span)
+    chunks = await async_repository.get_telemetry_chunks(session_id, seconds, start_ts, end_ts, db=db)
+    return _power_curve(session_id, resolution, chunks, start_ts, end_ts)
+
+async def get_charging_session_details(session_id: int, user_id: Optional[int] = None, db: Optional[AsyncSession] = None) -> models.ChargingSession:
+    session = await async_repository.get_charging_session_detail(session_id, user_id=user_id, db=db)
+    if not session:
+        raise ValueError("Session tidak ditemukan")
+    return session
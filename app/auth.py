@@ -1,8 +1,16 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt, JWTError
 import bcrypt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 # Konfigurasi JWT
@@ -10,6 +18,18 @@ SECRET_KEY = "your-secret-key-change-this-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Konfigurasi bcrypt
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+# The pool starts lazily inside a multi-threaded server: a plain fork() could copy
+# a lock held by another thread (logging, the DB pool) and deadlock the worker.
+HASH_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Cache token terverifikasi
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
 # Security scheme
 security = HTTPBearer()
 
@@ -18,11 +38,140 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         hashed_password = hashed_password.encode('utf-8')
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password)
 
-def get_password_hash(password: str) -> str:
-    salt = bcrypt.gensalt()
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True when the stored hash was made with a different cost factor ($2b$<cost>$...)."""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (AttributeError, IndexError, ValueError):
+        return True
+
+class HashingPool:
+    """
+    Size-limited process pool for bcrypt.
+    Hashing never occupies Starlette's request threadpool, and when more than
+    `queue_limit` jobs are pending new ones are rejected with 503 instead of
+    queueing behind a login storm. size=0 runs jobs on the default executor.
+    """
+    def __init__(self, size: int = HASH_POOL_SIZE, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.size = size
+        self.queue_limit = queue_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.size > 0 and self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.size,
+                        mp_context=multiprocessing.get_context(HASH_POOL_START_METHOD)
+                    )
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._depth >= self.queue_limit:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server sedang sibuk, silakan coba lagi",
+                    headers={"Retry-After": "1"},
+                )
+            self._depth += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            with self._lock:
+                self._depth -= 1
+                self._completed += 1
+
+    def stats(self) -> dict:
+        """Queue depth = jobs submitted and not yet finished (running + waiting)."""
+        with self._lock:
+            return {
+                "size": self.size,
+                "queue_depth": self._depth,
+                "queue_limit": self.queue_limit,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+hashing_pool = HashingPool()
+
+async def hash_password_async(password: str) -> str:
+    return await hashing_pool.run(get_password_hash, password, BCRYPT_ROUNDS)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+class TokenCache:
+    """
+    Bounded LRU of verified JWT payloads, keyed by the SHA-256 digest of the
+    token (raw tokens are never kept). An entry is valid until the token's
+    own `exp` or `ttl` seconds after caching, whichever comes first, so a
+    cached token can never outlive its expiry.
+    """
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            valid_until, payload = entry
+            if time.time() >= valid_until:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(payload)
+
+    def put(self, token: str, payload: dict):
+        if self.maxsize <= 0:
+            return
+        valid_until = time.time() + self.ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            valid_until = min(valid_until, exp)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (valid_until, dict(payload))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+token_cache = TokenCache()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -40,8 +189,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 def decode_access_token(token: str) -> dict:
+    # Mobile clients poll with the same token; skip re-verifying it every time
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(token, payload)
         return payload
     except JWTError:
         raise HTTPException(
@@ -50,7 +204,7 @@ def decode_access_token(token: str) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), request: Request = None) -> dict:
     token = credentials.credentials
     payload = decode_access_token(token)
     
@@ -62,4 +216,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return {"user_id": int(user_id_str), "email": payload.get("email")}
\ No newline at end of file
+    user_id = int(user_id_str)
+    if request is not None:
+        # Read-your-writes routing in app.db keys on the user
+        request.state.user_id = user_id
+    return {"user_id": user_id, "email": payload.get("email")}
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+In-process availability index: the free asset ids of every station, per
+connector standard.
+
+Built from one query on first use (or at startup) and kept current through
+app.events, which already carries every availability write: reserve on
+session start, stop, maintenance, PATCH /station-assets/{id} and bulk
+import. Lookups are set operations under a lock and never touch the
+database. check() compares the index with the database and rebuilds it
+when they disagree.
+"""
+import asyncio
+import heapq
+import logging
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlmodel import Session
+
+from app import events, repository
+from app.db import get_session, on_primary
+
+logger = logging.getLogger(__name__)
+
+def connector_standard(connector_port) -> Optional[str]:
+    """standard_name of a ConnectorPort or its JSON dict from the DB."""
+    if isinstance(connector_port, dict):
+        return connector_port.get("standard_name")
+    return getattr(connector_port, "standard_name", None)
+
+class AvailabilityIndex:
+    def __init__(self):
+        # asset_id -> (station_id, connector standard)
+        self._assets: Dict[int, Tuple[int, Optional[str]]] = {}
+        # (station_id, standard) -> free asset ids; standard None = any connector
+        self._free: Dict[Tuple[int, Optional[str]], Set[int]] = {}
+        self._loaded = False
+        # Changes published while a load() is querying, replayed onto its result
+        self._pending: List[List[events.Change]] = []
+        # Bumped by every applied change, so check() can tell a stale comparison
+        self.version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _set_free(self, asset_id: int, free: bool):
+        station_id, standard = self._assets[asset_id]
+        for key in ((station_id, None), (station_id, standard)):
+            if free:
+                self._free.setdefault(key, set()).add(asset_id)
+            else:
+                bucket = self._free.get(key)
+                if bucket is not None:
+                    bucket.discard(asset_id)
+                    if not bucket:
+                        del self._free[key]
+
+    def _put(self, asset_id: int, station_id: int, standard: Optional[str], free: bool):
+        if asset_id in self._assets:
+            self._set_free(asset_id, False)
+        self._assets[asset_id] = (station_id, standard)
+        self._set_free(asset_id, free)
+
+    def _remove(self, asset_id: int):
+        if asset_id in self._assets:
+            self._set_free(asset_id, False)
+            del self._assets[asset_id]
+
+    def _rows(self, db: Optional[Session]):
+        s = db if db is not None else get_session()
+        try:
+            with on_primary():
+                return repository.get_asset_availability(db=s)
+        finally:
+            if db is None:
+                s.close()
+
+    def load(self, db: Optional[Session] = None):
+        """(Re)builds the index from the station_asset table."""
+        pending: List[events.Change] = []
+        with self._lock:
+            self._pending.append(pending)
+        try:
+            rows = self._rows(db)
+        except BaseException:
+            with self._lock:
+                self._pending.remove(pending)
+            raise
+        with self._lock:
+            self._pending.remove(pending)
+            self._assets.clear()
+            self._free.clear()
+            for asset_id, station_id, port, is_available in rows:
+                self._put(asset_id, station_id, connector_standard(port), bool(is_available))
+            # Changes committed while querying may be missing from `rows`; replaying
+            # one that is already there sets the same values again
+            self._loaded = True
+            self._apply(pending)
+
+    def ensure_loaded(self, db: Optional[Session] = None):
+        if not self._loaded:
+            self.load(db)
+
+    def free_assets(self, station_id: int, connector: Optional[str] = None) -> FrozenSet[int]:
+        with self._lock:
+            return frozenset(self._free.get((station_id, connector), ()))
+
+    def free_ids(self, station_id: Optional[int] = None, after: Optional[int] = None, limit: int = 100) -> List[int]:
+        """Smallest free asset ids above `after`, of one station or of all stations."""
+        with self._lock:
+            if station_id is not None:
+                ids: Iterable[int] = self._free.get((station_id, None), ())
+            else:
+                ids = (a for (_, standard), bucket in self._free.items() if standard is None for a in bucket)
+            if after is not None:
+                ids = (a for a in ids if a > after)
+            return heapq.nsmallest(limit, ids)
+
+    def counts(self, station_ids: Iterable[int], connector: Optional[str] = None) -> Dict[int, int]:
+        """Free assets per station; stations without any are left out."""
+        with self._lock:
+            return {
+                station_id: len(self._free[(station_id, connector)])
+                for station_id in station_ids
+                if (station_id, connector) in self._free
+            }
+
+    def apply(self, changes: List[events.Change]):
+        changes = [c for c in changes if c.entity == "station_asset"]
+        if not changes:
+            return
+        with self._lock:
+            self.version += 1
+            for pending in self._pending:
+                pending.extend(changes)
+            if self._loaded:
+                self._apply(changes)
+
+    def _apply(self, changes: List[events.Change]):
+        for change in changes:
+            if change.op == "delete":
+                self._remove(change.key)
+                continue
+            current = self._assets.get(change.key)
+            station_id = change.data.get("station_id", change.station_id if current is None else current[0])
+            if "connector_port" in change.data:
+                standard = connector_standard(change.data["connector_port"])
+            elif current is not None:
+                standard = current[1]
+            else:
+                station_id = None
+            if station_id is None:
+                # Unknown asset without its columns: rebuild on next use
+                self._loaded = False
+                return
+            if "is_available" in change.data:
+                free = bool(change.data["is_available"])
+            else:
+                free = current is not None and change.key in self._free.get((current[0], None), ())
+            self._put(change.key, station_id, standard, free)
+
+    def check(self, db: Optional[Session] = None) -> Optional[List[str]]:
+        """
+        Compares the index with the database and rebuilds it on any
+        difference. Returns the differences, or None when writes during the
+        comparison made it inconclusive.
+        """
+        with self._lock:
+            if not self._loaded:
+                return []
+            version = self.version
+        rows = self._rows(db)
+        with self._lock:
+            if version != self.version:
+                return None
+            expected = {asset_id: (station_id, connector_standard(port), bool(free)) for asset_id, station_id, port, free in rows}
+            actual = {
+                asset_id: (station_id, standard, asset_id in self._free.get((station_id, None), ()))
+                for asset_id, (station_id, standard) in self._assets.items()
+            }
+        differences = [
+            f"asset {asset_id}: index {actual.get(asset_id)}, database {expected.get(asset_id)}"
+            for asset_id in sorted(expected.keys() | actual.keys())
+            if expected.get(asset_id) != actual.get(asset_id)
+        ]
+        if differences:
+            logger.warning("Availability index out of sync (%d assets), rebuilding", len(differences))
+            self.load(db)
+        return differences
+
+    def clear(self):
+        with self._lock:
+            self._assets.clear()
+            self._free.clear()
+            self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+async def run_periodic_check(index: "AvailabilityIndex", interval_seconds: float):
+    """Background task: index.check() every `interval_seconds`, off the event loop."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(index.check)
+        except Exception:
+            logger.exception("Availability consistency check failed")
+
+asset_index = AvailabilityIndex()
+events.subscribe(asset_index.apply)
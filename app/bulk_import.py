@@ -0,0 +1,271 @@
+"""
+Bulk import of stations and station assets (operator onboarding).
+
+Uploads are NDJSON (one object per line, the same shape as the JSON body of
+POST /stations or POST /station-assets) or CSV with a header row. CSV
+columns use dotted names for nested fields and `;` between list items:
+
+    station_operator,location.latitude,location.longitude,location.address,connector_list
+    PLN,-6.2,106.8,Jl. Sudirman 1,CCS;CHAdeMO
+
+    station_id,model,connector_port.standard_name,connector_port.max_power_supported
+    12,ABB Terra 54,CCS,50
+
+CSV fields may be quoted and contain commas or newlines.
+
+The body is parsed as it streams in, BATCH_SIZE lines at a time. Every row
+is validated against the create schema; rows that fail are reported with
+their line number and skipped, the rest of the batch is inserted with one
+executemany and committed. Neither a bad row, a line over MAX_LINE_BYTES nor
+a batch the database rejects aborts the import: each is reported and the
+next batch goes on, so the result always describes what was committed.
+Memory is bounded by the batch size and the report caps (MAX_REPORTED_ERRORS,
+MAX_REPORTED_IDS).
+"""
+import csv
+import json
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db, repository
+from app.schemas import BulkImportResult, BulkImportRowError, StationAssetCreate, StationCreate
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+MAX_REPORTED_IDS = 1000
+MAX_LINE_BYTES = 64 * 1024
+
+NDJSON = "ndjson"
+CSV = "csv"
+
+def upload_format(content_type: Optional[str]) -> str:
+    """Upload format from the Content-Type header; NDJSON unless it says CSV."""
+    return CSV if content_type and "csv" in content_type.lower() else NDJSON
+
+async def iter_line_batches(
+    chunks: AsyncIterable[bytes],
+    batch_size: Optional[int] = None,
+    fmt: str = NDJSON
+) -> AsyncIterable[List[Optional[bytes]]]:
+    """
+    Splits a streamed body into lists of complete lines (empty lines included,
+    to keep line numbers). A line longer than MAX_LINE_BYTES is dropped and
+    stands as None in its batch. For CSV a batch never ends inside a quoted
+    field, so a record spanning lines reaches csv.reader whole.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    pending = b""
+    skipping = False  # inside an oversized line, discarding up to its newline
+    in_quotes = False
+    batch: List[Optional[bytes]] = []
+    async for chunk in chunks:
+        if skipping:
+            end = chunk.find(b"\n")
+            if end < 0:
+                continue
+            chunk, skipping = chunk[end + 1:], False
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        if len(pending) > MAX_LINE_BYTES:
+            lines.append(None)
+            pending, skipping = b"", True
+        for line in lines:
+            if line is not None and len(line) > MAX_LINE_BYTES:
+                line = None
+            batch.append(line)
+            if fmt == CSV and line is not None and line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if len(batch) >= batch_size and not in_quotes:
+                yield batch
+                batch = []
+    if pending:
+        batch.append(pending)
+    if batch:
+        yield batch
+
+def _nest(flat: Dict[str, str], list_fields: Tuple[str, ...]) -> dict:
+    """CSV row -> nested dict: `a.b` keys become objects, empty cells are left out."""
+    row: dict = {}
+    for key, value in flat.items():
+        if key is None or value is None or value == "":
+            continue
+        value = value.strip()
+        if key in list_fields:
+            value = [item.strip() for item in value.split(";") if item.strip()]
+        target = row
+        *parents, leaf = key.strip().split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+    return row
+
+def _error_message(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in e['loc']) or 'row'}: {e['msg']}" for e in error.errors()
+        )
+    return str(error)
+
+class _Kind(ABC):
+    """What one import target needs: its schema, how to build column values and how to insert them."""
+    schema: Type[BaseModel]
+    list_fields: Tuple[str, ...] = ()
+
+    @abstractmethod
+    def to_row(self, item: BaseModel, now: datetime) -> dict:
+        """Column values of one validated item."""
+
+    def check(self, items: List[Tuple[int, BaseModel]], s) -> List[Tuple[int, str]]:
+        """Row errors that need the database (e.g. unknown references)."""
+        return []
+
+    @abstractmethod
+    def insert(self, rows: List[dict], s) -> List[int]:
+        """Inserts the rows in one executemany; returns their primary keys."""
+
+class _Stations(_Kind):
+    schema = StationCreate
+    list_fields = ("connector_list",)
+
+    def to_row(self, item: StationCreate, now: datetime) -> dict:
+        return {
+            "station_operator": item.station_operator,
+            "location": item.location.model_dump(),
+            "connector_list": item.connector_list,
+            "created_at": now
+        }
+
+    def insert(self, rows, s):
+        return repository.bulk_insert_stations(rows, db=s)
+
+class _StationAssets(_Kind):
+    schema = StationAssetCreate
+
+    def to_row(self, item: StationAssetCreate, now: datetime) -> dict:
+        return {
+            "station_id": item.station_id,
+            "model": item.model,
+            "connector_port": item.connector_port.model_dump(),
+            "maintenance_log": item.maintenance_log.model_dump(mode="json") if item.maintenance_log else None,
+            "is_available": True,
+            "created_at": now
+        }
+
+    def check(self, items, s):
+        known = repository.get_existing_station_ids(list({item.station_id for _, item in items}), db=s)
+        return [(line, "Station tidak ditemukan") for line, item in items if item.station_id not in known]
+
+    def insert(self, rows, s):
+        return repository.bulk_insert_station_assets(rows, db=s)
+
+STATIONS = _Stations()
+STATION_ASSETS = _StationAssets()
+
+class Importer:
+    """
+    One upload. Feed it line batches in order with import_lines(); each
+    batch is validated, inserted and committed in its own transaction.
+    """
+    def __init__(self, kind: _Kind, fmt: str = NDJSON):
+        self.kind = kind
+        self.fmt = fmt
+        self.header: Optional[List[str]] = None
+        self.line_no = 0
+        self.received = 0
+        self.inserted = 0
+        self.inserted_ids: List[int] = []  # first MAX_REPORTED_IDS only
+        self.failed = 0
+        self.errors: List[BulkImportRowError] = []
+        self._started = time.perf_counter()
+
+    def _fail(self, line: int, message: str, rows: int = 1):
+        self.failed += rows
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(BulkImportRowError(line=line, message=message))
+
+    def _texts(self, lines: List[Optional[bytes]]) -> Iterable[str]:
+        """Decoded lines; oversized ones are reported here and read as empty."""
+        for offset, raw in enumerate(lines, start=self.line_no + 1):
+            if raw is None:
+                self.received += 1
+                self._fail(offset, f"Baris lebih dari {MAX_LINE_BYTES} byte")
+                yield ""
+                continue
+            yield raw.decode("utf-8-sig" if offset == 1 else "utf-8", errors="replace")
+
+    def _records(self, lines: List[Optional[bytes]]) -> Iterable[Tuple[int, object]]:
+        """(line number, parsed dict or the parse error) of every non-empty record."""
+        if self.fmt == CSV:
+            # newline-terminated lines, so quoted fields keep their line breaks
+            reader = csv.reader(text + "\n" for text in self._texts(lines))
+            base, first = self.line_no, self.line_no + 1
+            for cells in reader:
+                line, first = first, base + reader.line_num + 1
+                if len(cells) <= 1 and not "".join(cells).strip():
+                    continue
+                if self.header is None:
+                    self.header = [c.strip() for c in cells]
+                    continue
+                if len(cells) != len(self.header):
+                    yield line, ValueError(f"Jumlah kolom {len(cells)}, header {len(self.header)}")
+                    continue
+                yield line, _nest(dict(zip(self.header, cells)), self.kind.list_fields)
+            self.line_no = base + len(lines)
+            return
+
+        for line, text in enumerate(self._texts(lines), start=self.line_no + 1):
+            self.line_no = line
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError as e:
+                yield line, ValueError(f"JSON tidak valid: {e}")
+
+    def import_lines(self, lines: List[Optional[bytes]]):
+        valid: List[Tuple[int, BaseModel]] = []
+        for line, record in self._records(lines):
+            self.received += 1
+            if isinstance(record, Exception):
+                self._fail(line, _error_message(record))
+                continue
+            try:
+                valid.append((line, self.kind.schema.model_validate(record)))
+            except ValidationError as e:
+                self._fail(line, _error_message(e))
+        if not valid:
+            return
+
+        try:
+            with db.UnitOfWork() as uow:
+                rejected = dict(self.kind.check(valid, uow.session))
+                now = datetime.utcnow()
+                rows = [self.kind.to_row(item, now) for line, item in valid if line not in rejected]
+                ids = self.kind.insert(rows, uow.session)
+                uow.commit()
+        except SQLAlchemyError as e:
+            # The batch was rolled back; earlier batches stay committed
+            first, last = valid[0][0], valid[-1][0]
+            self._fail(first, f"Baris {first}-{last} gagal disimpan: {e.__class__.__name__}", rows=len(valid))
+            return
+        for line, message in sorted(rejected.items()):
+            self._fail(line, message)
+        self.inserted += len(ids)
+        self.inserted_ids.extend(ids[:MAX_REPORTED_IDS - len(self.inserted_ids)])
+
+    def result(self) -> BulkImportResult:
+        elapsed = time.perf_counter() - self._started
+        return BulkImportResult(
+            received=self.received,
+            inserted=self.inserted,
+            failed=self.failed,
+            inserted_ids=self.inserted_ids,
+            errors=sorted(self.errors, key=lambda e: e.line),
+            elapsed_seconds=round(elapsed, 3),
+            rows_per_second=round(self.received / elapsed, 1) if elapsed > 0 else 0.0
+        )
@@ -0,0 +1,234 @@
+"""
+Response cache for the public station list and search endpoints (station
+detail is served by app.read_models instead).
+
+Cached bodies are stored under a key that embeds the current version of
+every tag the response depends on (e.g. "stations").
+Invalidation bumps the tag versions; entries built under the old versions
+become unreachable and age out through TTL/LRU. A build that races an
+invalidation therefore stores under the old versions and is never served.
+
+Tags are bumped from app.events, i.e. after any committed write to Station,
+whichever code path made it.
+
+Backends:
+    LRUBackend       in-process, bounded (default)
+    SharedBackend    on a Redis-compatible client (get/set/mget/incr), so
+                     several workers share entries and invalidations;
+                     CACHE_URL=redis://... (needs the `redis` package).
+                     InMemorySharedClient is a local stand-in for tests.
+
+Concurrent misses for the same key are coalesced per process: one caller
+builds, the others wait for its result.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Optional, Protocol, Tuple
+
+from app import events
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+# Seconds a response may be served from the cache, per route
+ROUTE_TTLS: Dict[str, float] = {
+    "stations.list": 30.0,
+    "stations.search": 30.0,
+}
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Optional[bytes]: ...
+    def set(self, key: str, value: bytes, ttl: float): ...
+    def tag_versions(self, tags: List[str]) -> List[int]: ...
+    def bump(self, tags: Iterable[str]): ...
+    def clear(self): ...
+
+class LRUBackend:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def tag_versions(self, tags: List[str]) -> List[int]:
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags: Iterable[str]):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SharedBackend:
+    """Entries and tag versions in a shared key-value store (Redis API subset)."""
+    def __init__(self, client, prefix: str = "tst-api:cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def tag_versions(self, tags: List[str]) -> List[int]:
+        if not tags:
+            return []
+        values = self.client.mget([f"{self.prefix}tag:{tag}" for tag in tags])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump(self, tags: Iterable[str]):
+        for tag in tags:
+            self.client.incr(f"{self.prefix}tag:{tag}")
+
+    def clear(self):
+        # Bumping is enough in production; the fake client can be emptied
+        if hasattr(self.client, "flushdb"):
+            self.client.flushdb()
+
+class InMemorySharedClient:
+    """Local stand-in for a Redis client: the get/set/mget/incr subset SharedBackend uses."""
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._data: Dict[str, Tuple[Optional[float], bytes]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= self._clock():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._live(key)
+            return entry[1] if entry else None
+
+    def set(self, key: str, value: bytes, ex: Optional[int] = None):
+        with self._lock:
+            self._data[key] = (self._clock() + ex if ex else None, value)
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [entry[1] if entry else None for entry in map(self._live, keys)]
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[1]) + 1 if entry else 1
+            self._data[key] = (None, str(value).encode())
+            return value
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+
+def backend_from_url(url: Optional[str]) -> CacheBackend:
+    if not url or url == "memory":
+        return LRUBackend()
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL redis:// butuh package `redis` (pip install redis)")
+        return SharedBackend(redis.Redis.from_url(url))
+    raise ValueError(f"CACHE_URL tidak dikenal: {url}")
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, ttls: Optional[Dict[str, float]] = None):
+        self.backend = backend
+        self.ttls = dict(ROUTE_TTLS if ttls is None else ttls)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses that waited for another caller's build
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, route: str, key: str, tags: List[str]) -> str:
+        versions = self.backend.tag_versions(tags)
+        return f"{route}:{key}:" + ",".join(f"{t}={v}" for t, v in zip(tags, versions))
+
+    def get_or_build(self, route: str, key: str, tags: List[str], build: Callable[[], bytes]) -> Tuple[bytes, bool]:
+        """(body, hit). `build` runs at most once per key at a time in this process; its errors are not cached."""
+        full_key = self._key(route, key, tags)
+        body = self.backend.get(full_key)
+        if body is not None:
+            self.hits += 1
+            return body, True
+
+        with self._lock:
+            future = self._inflight.get(full_key)
+            leader = future is None
+            if leader:
+                future = self._inflight[full_key] = Future()
+        if not leader:
+            self.coalesced += 1
+            return future.result(), True
+
+        self.misses += 1
+        try:
+            body = build()
+            self.backend.set(full_key, body, self.ttls.get(route, 60.0))
+            future.set_result(body)
+            return body, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[full_key]
+
+    def invalidate(self, tags: Iterable[str]):
+        self.backend.bump(tags)
+
+    def apply(self, changes: List[events.Change]):
+        tags = set()
+        for change in changes:
+            # Lists and search carry station fields only; asset changes do not affect them
+            if change.entity == "station":
+                tags.add("stations")
+        if tags:
+            self.invalidate(sorted(tags))
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = self.misses = self.coalesced = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "inflight": len(self._inflight)}
+
+def station_list_tags() -> List[str]:
+    return ["stations"]
+
+response_cache = ResponseCache(backend_from_url(os.getenv("CACHE_URL")))
+events.subscribe(response_cache.apply)
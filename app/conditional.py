@@ -0,0 +1,84 @@
+"""
+Conditional GET: ETag / Last-Modified validators and the 304 short-circuit.
+
+Handlers compute a Validator from something cheap (an aggregate row version
+from the repository, or an already cached body) and call not_modified()
+before loading or serializing the list. On a match they return
+not_modified_response(); otherwise they send headers(validator) with the
+full response.
+
+ETags are weak (W/"..."): the same validator is served for bodies that are
+semantically, not necessarily byte-for-byte, equal.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import NamedTuple, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# Private responses may be revalidated by the client, never stored by a shared cache
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+class Validator(NamedTuple):
+    etag: str
+    last_modified: Optional[datetime] = None
+
+def _etag(data: bytes) -> str:
+    return f'W/"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+def make_validator(*parts, last_modified: Optional[datetime] = None) -> Validator:
+    """Validator from the values the response depends on (row version, page params, user)."""
+    return Validator(_etag("|".join(map(str, parts)).encode()), last_modified)
+
+def body_validator(body: bytes) -> Validator:
+    return Validator(_etag(body))
+
+def _http_date(value: datetime) -> str:
+    # Naive datetimes in this app are UTC (datetime.utcnow)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def not_modified(request: Request, validator: Validator) -> bool:
+    """
+    True when the client's copy is current. If-None-Match wins over
+    If-Modified-Since (RFC 9110 13.2.2); ETags compare weakly.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        current = _opaque(validator.etag)
+        return any(_opaque(tag) == current for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and validator.last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        last_modified = validator.last_modified
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        # HTTP dates have second resolution
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+def headers(validator: Validator, cache_control: Optional[str] = None) -> dict:
+    out = {"ETag": validator.etag}
+    if validator.last_modified is not None:
+        out["Last-Modified"] = _http_date(validator.last_modified)
+    if cache_control:
+        out["Cache-Control"] = cache_control
+    return out
+
+def not_modified_response(validator: Validator, cache_control: Optional[str] = None) -> Response:
+    return Response(status_code=304, headers=headers(validator, cache_control))
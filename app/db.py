@@ -1,6 +1,18 @@
+import asyncio
+import functools
+import itertools
 import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from fastapi import Request
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event, inspect
+from typing import Dict, Hashable, NamedTuple, Optional, Tuple
 
 import os
 from sqlmodel import SQLModel, create_engine
@@ -10,10 +22,128 @@ DATABASE_URL = os.getenv(
     "sqlite:///./ev_charging.db"  # LOCAL fallback
 )
 
+def _async_url(url: str) -> str:
+    """Same database, async driver: aiosqlite for SQLite, asyncpg for Postgres."""
+    for sync_prefix, async_prefix in (
+        ("sqlite://", "sqlite+aiosqlite://"),
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
 connect_args = {}
 if DATABASE_URL.startswith("sqlite"):
     connect_args = {"check_same_thread": False}
 
+# ===== ENGINE PROFILES =====
+class EngineProfile(NamedTuple):
+    """
+    Pool settings (Postgres, and SQLite files, which also get a QueuePool)
+    plus per-connection SQLite pragmas. None = SQLAlchemy's default.
+    """
+    pool_size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    pool_recycle: Optional[int] = None  # seconds; below the server/proxy idle timeout
+    pool_timeout: Optional[float] = None
+    pool_pre_ping: bool = False
+    sqlite_pragmas: Tuple[Tuple[str, object], ...] = ()
+
+# Selected with DB_PROFILE. "default" keeps the plain create_engine() behaviour.
+ENGINE_PROFILES: Dict[str, EngineProfile] = {
+    "default": EngineProfile(),
+    # One API process next to a few workers/CLI jobs
+    "balanced": EngineProfile(
+        pool_size=10, max_overflow=10, pool_recycle=1800, pool_timeout=30, pool_pre_ping=True,
+        sqlite_pragmas=(
+            ("journal_mode", "WAL"),         # readers no longer block the writer
+            ("synchronous", "NORMAL"),       # fsync at checkpoints only; safe with WAL
+            ("busy_timeout", 5000),          # wait for the write lock instead of failing
+            ("cache_size", -64 * 1024),      # KiB when negative: 64 MiB page cache
+            ("mmap_size", 256 * 1024 ** 2),
+            ("temp_store", "MEMORY"),
+        )
+    ),
+    # Many concurrent writers (session start/stop, meter values)
+    "throughput": EngineProfile(
+        pool_size=20, max_overflow=30, pool_recycle=900, pool_timeout=10, pool_pre_ping=True,
+        sqlite_pragmas=(
+            ("journal_mode", "WAL"),
+            ("synchronous", "NORMAL"),
+            ("busy_timeout", 15000),
+            ("cache_size", -256 * 1024),
+            ("mmap_size", 1024 ** 3),
+            ("temp_store", "MEMORY"),
+            ("wal_autocheckpoint", 4000),
+        )
+    ),
+}
+
+DB_PROFILE = os.getenv("DB_PROFILE", "default")
+
+def get_profile(name: Optional[str] = None) -> EngineProfile:
+    name = name or DB_PROFILE
+    try:
+        return ENGINE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"DB_PROFILE tidak dikenal: {name} (pilihan: {', '.join(ENGINE_PROFILES)})")
+
+def _is_memory_sqlite(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(("sqlite:", "sqlite+aiosqlite:")))
+
+def engine_options(url: str, profile: EngineProfile) -> dict:
+    """create_engine / create_async_engine keyword arguments for a profile."""
+    options: dict = {}
+    if _is_memory_sqlite(url):
+        # SingletonThreadPool/StaticPool: no pool sizing
+        return options
+    for name in ("pool_size", "max_overflow", "pool_recycle", "pool_timeout"):
+        value = getattr(profile, name)
+        if value is not None:
+            options[name] = value
+    if profile.pool_pre_ping:
+        options["pool_pre_ping"] = True
+    return options
+
+def apply_sqlite_pragmas(engine, pragmas: Tuple[Tuple[str, object], ...]):
+    """Runs the pragmas on every new DBAPI connection of a (sync or async) SQLite engine."""
+    if not pragmas or engine.dialect.name != "sqlite":
+        return
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+def make_engine(url: str, profile: Optional[EngineProfile] = None, **kwargs):
+    profile = profile or get_profile()
+    options = {"echo": False, "json_serializer": dumps, **engine_options(url, profile), **kwargs}
+    if url.startswith("sqlite"):
+        options.setdefault("connect_args", {"check_same_thread": False})
+    engine = create_engine(url, **options)
+    apply_sqlite_pragmas(engine, profile.sqlite_pragmas)
+    return engine
+
+def pool_stats(bind=None) -> dict:
+    """Checked-in/out connections and overflow of an engine's pool (sync engine by default)."""
+    bind = bind if bind is not None else engine
+    pool = getattr(bind, "sync_engine", bind).pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
 def custom_json_serializer(obj):
     """
     Custom serializer to handle:
@@ -36,15 +166,291 @@ def custom_json_serializer(obj):
 def dumps(obj):
     return json.dumps(obj, default=custom_json_serializer)
 
-engine = create_engine(
-    DATABASE_URL, 
-    echo=False, 
-    connect_args=connect_args,
-    json_serializer=dumps
-)
+engine = make_engine(DATABASE_URL, connect_args=connect_args)
+
+# ===== READ REPLICAS =====
+# READ_REPLICA_URLS: comma-separated replica URLs of DATABASE_URL. Repository
+# functions are tagged @reads or @writes; a RoutingSession sends the queries
+# of @reads functions to one replica (chosen round-robin, kept for the whole
+# session) and everything else to the primary. A session stays on the
+# primary once it has written, for non-GET requests, and for READ_YOUR_WRITES_SECONDS
+# after its user's last committed write (replication lag), so a user always
+# reads their own writes. Stickiness is tracked per process.
+READ_REPLICA_URLS = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+replica_engines: list = [make_engine(url) for url in READ_REPLICA_URLS]
+
+READ = "read"
+WRITE = "write"
+PRIMARY = "primary"  # on_primary(): a read that must not see replica lag
+_route: ContextVar[Optional[str]] = ContextVar("db_route", default=None)
+
+def _tagged(route: str, fn):
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            # A read inside a write (or on_primary) stays on the primary
+            token = _route.set(route) if route != READ or _route.get() is None else None
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                if token is not None:
+                    _route.reset(token)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _route.set(route) if route != READ or _route.get() is None else None
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if token is not None:
+                _route.reset(token)
+    return wrapper
+
+def reads(fn):
+    """Repository read: may be served by a replica."""
+    return _tagged(READ, fn)
+
+def writes(fn):
+    """Repository write: always on the primary, and pins the session there."""
+    return _tagged(WRITE, fn)
+
+@contextmanager
+def on_primary():
+    """Runs @reads functions on the primary, e.g. to fill a shared cache that must not hold replica lag."""
+    token = _route.set(PRIMARY)
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+class StickyWrites:
+    """Last committed write per key (user id); bounded, oldest keys dropped first."""
+    def __init__(self, window: float = READ_YOUR_WRITES_SECONDS, maxsize: int = 100_000):
+        self.window = window
+        self.maxsize = maxsize
+        self._writes: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def note(self, key: Hashable):
+        with self._lock:
+            self._writes[key] = time.monotonic()
+            self._writes.move_to_end(key)
+            while len(self._writes) > self.maxsize:
+                self._writes.popitem(last=False)
+
+    def recent(self, key: Hashable) -> bool:
+        with self._lock:
+            written = self._writes.get(key)
+        return written is not None and time.monotonic() - written < self.window
+
+    def clear(self):
+        with self._lock:
+            self._writes.clear()
+
+sticky_writes = StickyWrites()
+_replica_turn = itertools.count()
+
+class RoutingSession(Session):
+    """
+    Session bound to the primary that sends @reads queries to a replica.
+    `sticky_key` is the user id (or a callable returning it, resolved at the
+    first read, after authentication ran).
+    """
+    def __init__(self, *args, replicas: Optional[list] = None, sticky_key=None, primary_only: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replica_engines if replicas is None else replicas
+        self.sticky_key = sticky_key
+        self.primary_only = primary_only or not self.replicas
+        self.wrote = False
+        self._replica = None
+
+    def _sticky_key(self) -> Optional[Hashable]:
+        return self.sticky_key() if callable(self.sticky_key) else self.sticky_key
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+        if self._flushing or _route.get() == WRITE or getattr(clause, "is_dml", False):
+            self.wrote = True
+            self.primary_only = True
+            return primary
+        if self.primary_only or _route.get() != READ:
+            return primary
+        key = self._sticky_key()
+        if key is not None and sticky_writes.recent(key):
+            self.primary_only = True
+            return primary
+        if self._replica is None:
+            self._replica = self.replicas[next(_replica_turn) % len(self.replicas)]
+        return self._replica
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_write(session):
+    if session.wrote:
+        key = session._sticky_key()
+        if key is not None:
+            sticky_writes.note(key)
+        session.wrote = False
 
 def init_db():
     SQLModel.metadata.create_all(engine)
+    create_missing_columns(engine)
+    create_missing_indexes(engine)
+
+def create_missing_columns(bind):
+    """
+    Additive migration: create_all() never alters existing tables, so new
+    nullable columns are added with ALTER TABLE ... ADD COLUMN.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+
+def create_missing_indexes(bind):
+    """
+    create_all() skips indexes of tables that already exist, so databases
+    created by an older version never receive newly declared indexes.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
 
 def get_session():
-    return Session(engine)
\ No newline at end of file
+    # Plain Session when there is nothing to route
+    return RoutingSession(engine) if replica_engines else Session(engine)
+
+class UnitOfWork:
+    """
+    One Session and one transaction for the whole request.
+    Repository functions receive `uow.session` through their `db` argument,
+    so identity-map hits replace repeated SELECTs and nothing is committed
+    until the handler calls `commit()`. Uncommitted work is rolled back on exit.
+    """
+    def __init__(self, sticky_key=None, primary_only: bool = False):
+        self.session: Session = None
+        self.sticky_key = sticky_key
+        self.primary_only = primary_only
+
+    def __enter__(self) -> "UnitOfWork":
+        # expire_on_commit=False: objects returned by the handler are still
+        # serialized after commit, which must not trigger lazy re-loads.
+        self.session = RoutingSession(
+            engine, expire_on_commit=False, sticky_key=self.sticky_key, primary_only=self.primary_only
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.session.rollback()
+        finally:
+            self.session.close()
+
+    def commit(self):
+        self.session.commit()
+
+    def rollback(self):
+        self.session.rollback()
+
+def _routing_args(request: Optional[Request]) -> dict:
+    if request is None:
+        return {}
+    return {
+        # get_current_user stores the id; read lazily because it runs after this dependency
+        "sticky_key": lambda: getattr(request.state, "user_id", None),
+        "primary_only": request.method not in ("GET", "HEAD")
+    }
+
+def get_uow(request: Request = None):
+    """FastAPI dependency yielding the request-scoped UnitOfWork."""
+    with UnitOfWork(**_routing_args(request)) as uow:
+        yield uow
+
+# ===== ASYNC ENGINE =====
+# Created on first use so the sync-only code paths (CLI tools, tests) never
+# need the async driver installed.
+async_engine = None
+
+def get_async_engine():
+    global async_engine
+    if async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        profile = get_profile()
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            echo=False,
+            json_serializer=dumps,
+            **engine_options(ASYNC_DATABASE_URL, profile)
+        )
+        apply_sqlite_pragmas(async_engine, profile.sqlite_pragmas)
+    return async_engine
+
+async_replica_engines = None
+
+def get_async_replica_engines() -> list:
+    global async_replica_engines
+    if async_replica_engines is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        profile = get_profile()
+        async_replica_engines = []
+        for url in map(_async_url, READ_REPLICA_URLS):
+            replica = create_async_engine(url, echo=False, json_serializer=dumps, **engine_options(url, profile))
+            apply_sqlite_pragmas(replica, profile.sqlite_pragmas)
+            async_replica_engines.append(replica)
+    return async_replica_engines
+
+def get_async_session(sticky_key=None, primary_only: bool = False) -> AsyncSession:
+    # expire_on_commit=False: attribute access after commit would need lazy
+    # IO, which is not possible on an AsyncSession.
+    return AsyncSession(
+        get_async_engine(),
+        expire_on_commit=False,
+        sync_session_class=RoutingSession,
+        replicas=[replica.sync_engine for replica in get_async_replica_engines()],
+        sticky_key=sticky_key,
+        primary_only=primary_only
+    )
+
+class AsyncUnitOfWork:
+    """Async counterpart of UnitOfWork: one AsyncSession and one transaction per request."""
+    def __init__(self, sticky_key=None, primary_only: bool = False):
+        self.session: AsyncSession = None
+        self.sticky_key = sticky_key
+        self.primary_only = primary_only
+
+    async def __aenter__(self) -> "AsyncUnitOfWork":
+        self.session = get_async_session(self.sticky_key, self.primary_only)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.session.rollback()
+        finally:
+            await self.session.close()
+
+    async def commit(self):
+        await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
+
+async def get_async_uow(request: Request = None):
+    """FastAPI dependency yielding the request-scoped AsyncUnitOfWork."""
+    async with AsyncUnitOfWork(**_routing_args(request)) as uow:
+        yield uow
@@ -0,0 +1,96 @@
+"""
+Change notifications for read models and caches.
+
+Changes to tracked tables are collected per Session while it flushes and are
+published to subscribers only after the transaction commits; a rollback
+discards them. Subscribers run in the committing thread, so they must be
+cheap and must not touch the database.
+"""
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app import models
+
+class Change(NamedTuple):
+    entity: str                  # table name, e.g. "station_asset"
+    key: int                     # primary key of the changed row
+    station_id: Optional[int]    # owning station, when known
+    op: str                      # "insert" | "update" | "delete"
+    data: Dict[str, Any] = {}    # changed column values (new values)
+
+# Tables read models and compiled caches depend on
+TRACKED = {
+    models.Station: ("station", "station_id"),
+    models.StationAsset: ("station_asset", "asset_id"),
+    models.TariffPlan: ("tariff_plan", "tariff_id"),
+    models.TariffBand: ("tariff_band", "band_id"),
+}
+
+_PENDING = "pending_changes"
+_subscribers: List[Callable[[List[Change]], None]] = []
+
+def subscribe(fn: Callable[[List[Change]], None]) -> Callable[[List[Change]], None]:
+    """Registers `fn(changes)` to be called after every commit that changed tracked rows."""
+    if fn not in _subscribers:
+        _subscribers.append(fn)
+    return fn
+
+def unsubscribe(fn: Callable[[List[Change]], None]):
+    if fn in _subscribers:
+        _subscribers.remove(fn)
+
+def publish(changes: List[Change]):
+    for fn in list(_subscribers):
+        fn(changes)
+
+def record(session, change: Change):
+    """
+    Records a change the ORM cannot see (bulk UPDATE/DELETE statements).
+    Accepts a Session or an AsyncSession; published on commit like flushed changes.
+    """
+    session.info.setdefault(_PENDING, []).append(change)
+
+def _changed_columns(obj) -> Dict[str, Any]:
+    state = inspect(obj)
+    data = {}
+    for attr in state.mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if history.has_changes():
+            data[attr.key] = getattr(obj, attr.key)
+    return data
+
+def _changes_from_flush(session: Session) -> List[Change]:
+    changes = []
+    for op, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objects:
+            tracked = TRACKED.get(type(obj))
+            if tracked is None:
+                continue
+            entity, pk = tracked
+            data = _changed_columns(obj) if op != "delete" else {}
+            if op == "update" and not data:
+                continue
+            changes.append(Change(entity, getattr(obj, pk), getattr(obj, "station_id", None), op, data))
+    return changes
+
+# Registered on the Session class, so they also cover sqlmodel's Session and
+# the sync Session behind every AsyncSession.
+@event.listens_for(Session, "after_flush")
+def _collect(session, _flush_context):
+    # new/dirty/deleted still hold the pre-flush state here, primary keys are assigned
+    changes = _changes_from_flush(session)
+    if changes:
+        session.info.setdefault(_PENDING, []).extend(changes)
+
+@event.listens_for(Session, "after_commit")
+def _dispatch(session):
+    changes = session.info.pop(_PENDING, None)
+    if changes:
+        publish(changes)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_PENDING, None)
@@ -0,0 +1,169 @@
+"""
+In-process spatial index of station coordinates for nearby search.
+
+Stations are bucketed into a fixed lat/lon grid; a radius query only looks
+at the cells overlapping the circle's bounding box and then filters by
+great-circle distance. The index is loaded from the latitude / longitude
+columns on first use and kept in sync through app.events.
+"""
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlmodel import Session, select
+
+from app import events, models
+from app.db import get_session
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+GEO_CELL_DEGREES = float(os.getenv("GEO_CELL_DEGREES", "0.1"))  # ~11 km
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class StationGeoIndex:
+    def __init__(self, cell_degrees: float = GEO_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        # station_id -> (lat, lon, cell, connector types)
+        self._stations: Dict[int, Tuple[float, float, Tuple[int, int], frozenset]] = {}
+        self._loaded = False
+        # Changes published while a load() is querying, replayed onto its grid
+        self._pending: List[List[events.Change]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def _remove(self, station_id: int):
+        entry = self._stations.pop(station_id, None)
+        if entry is not None:
+            bucket = self._cells.get(entry[2])
+            bucket.discard(station_id)
+            if not bucket:
+                del self._cells[entry[2]]
+
+    def _put(self, station_id: int, lat: Optional[float], lon: Optional[float], connectors):
+        self._remove(station_id)
+        if lat is None or lon is None:
+            return
+        cell = self._cell(lat, lon)
+        self._stations[station_id] = (lat, lon, cell, frozenset(connectors or ()))
+        self._cells.setdefault(cell, set()).add(station_id)
+
+    def load(self, db: Optional[Session] = None):
+        """(Re)builds the index from the coordinate columns; nearby() keeps serving the old grid meanwhile."""
+        pending: List[events.Change] = []
+        with self._lock:
+            self._pending.append(pending)
+        s = db if db is not None else get_session()
+        try:
+            rows = s.exec(select(
+                models.Station.station_id,
+                models.Station.latitude,
+                models.Station.longitude,
+                models.Station.connector_list,
+                models.Station.location
+            )).all()
+        except BaseException:
+            with self._lock:
+                self._pending.remove(pending)
+            raise
+        finally:
+            if db is None:
+                s.close()
+
+        fresh = StationGeoIndex(self.cell_degrees)
+        for station_id, lat, lon, connectors, location in rows:
+            if lat is None or lon is None:
+                # Rows written before the coordinate columns existed
+                lat, lon = models.location_coordinates(location)
+            fresh._put(station_id, lat, lon, connectors)
+        with self._lock:
+            self._pending.remove(pending)
+            self._cells, self._stations = fresh._cells, fresh._stations
+            # Station changes committed while querying may be missing from `rows`
+            self._apply(pending)
+            self._loaded = True
+
+    def ensure_loaded(self, db: Optional[Session] = None):
+        if not self._loaded:
+            self.load(db)
+
+    def nearby(
+        self,
+        lat: float,
+        lon: float,
+        radius_km: float,
+        connector: Optional[str] = None
+    ) -> List[Tuple[int, float]]:
+        """(station_id, distance_km) within `radius_km`, nearest first."""
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        # Longitude degrees shrink towards the poles; clamp to avoid division by ~0
+        dlon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_i, min_j = self._cell(lat - dlat, lon - dlon)
+        max_i, max_j = self._cell(lat + dlat, lon + dlon)
+
+        results = []
+        with self._lock:
+            if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self._cells):
+                candidates = list(self._stations)
+            else:
+                candidates = [
+                    station_id
+                    for i in range(min_i, max_i + 1)
+                    for j in range(min_j, max_j + 1)
+                    for station_id in self._cells.get((i, j), ())
+                ]
+            for station_id in candidates:
+                s_lat, s_lon, _, connectors = self._stations[station_id]
+                if connector and connector not in connectors:
+                    continue
+                distance = haversine_km(lat, lon, s_lat, s_lon)
+                if distance <= radius_km:
+                    results.append((station_id, distance))
+        results.sort(key=lambda r: r[1])
+        return results
+
+    def apply(self, changes: List[events.Change]):
+        changes = [c for c in changes if c.entity == "station"]
+        if not changes:
+            return
+        with self._lock:
+            for pending in self._pending:
+                pending.extend(changes)
+            if self._loaded:
+                self._apply(changes)
+
+    def _apply(self, changes: List[events.Change]):
+        for change in changes:
+            if change.op == "delete":
+                self._remove(change.key)
+                continue
+            current = self._stations.get(change.key)
+            lat = change.data.get("latitude", current[0] if current else None)
+            lon = change.data.get("longitude", current[1] if current else None)
+            connectors = change.data.get("connector_list", current[3] if current else ())
+            self._put(change.key, lat, lon, connectors)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._stations.clear()
+            self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self._stations)
+
+station_index = StationGeoIndex()
+events.subscribe(station_index.apply)
@@ -0,0 +1,165 @@
+"""
+Index audit: runs every read query the application serves requests with
+through EXPLAIN and flags full table scans (and, on SQLite, sorts that need
+a temp b-tree).
+
+    python -m app.index_audit                 # report only
+    python -m app.index_audit --fail-on-scan  # exit 1 on unexpected scans
+
+Queries are captured by actually calling the repository functions inside a
+transaction that is rolled back afterwards, so the audited SQL is exactly
+what the application sends. Queries of app/async_repository.py are audited
+through the statement builders they share with app/repository.py.
+"""
+import argparse
+import sys
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app import db, repository
+
+class AuditedQuery(NamedTuple):
+    name: str
+    call: Callable[[Session], object]
+    # Reason why a scan is expected (e.g. unfiltered listing); None = must use an index
+    allow_scan: Optional[str] = None
+
+AUDITED_QUERIES: List[AuditedQuery] = [
+    # Account Context
+    AuditedQuery("get_user", lambda s: repository.get_user(1, db=s)),
+    AuditedQuery("get_user_by_email", lambda s: repository.get_user_by_email("audit@example.com", db=s)),
+    AuditedQuery("list_users", lambda s: repository.list_users(db=s), "unfiltered listing, bounded by LIMIT"),
+    AuditedQuery("get_vehicle", lambda s: repository.get_vehicle(1, db=s)),
+    AuditedQuery("get_vehicle_by_plate", lambda s: repository.get_vehicle_by_plate("B1234CD", db=s)),
+    AuditedQuery("get_vehicles_by_user", lambda s: repository.get_vehicles_by_user(1, db=s)),
+    # Station Management Context
+    AuditedQuery("get_station", lambda s: repository.get_station(1, db=s)),
+    AuditedQuery("get_station_detail", lambda s: repository.get_station_detail(1, db=s)),
+    AuditedQuery("list_stations", lambda s: repository.list_stations(db=s), "unfiltered listing, bounded by LIMIT"),
+    AuditedQuery(
+        "search_stations_by_operator",
+        lambda s: repository.search_stations_by_operator("PLN", db=s),
+        "ILIKE '%...%' cannot use a b-tree index"
+    ),
+    AuditedQuery("get_stations_by_ids", lambda s: repository.get_stations_by_ids([1, 2, 3], db=s)),
+    AuditedQuery("get_existing_station_ids", lambda s: repository.get_existing_station_ids([1, 2, 3], db=s)),
+    AuditedQuery("get_station_asset", lambda s: repository.get_station_asset(1, db=s)),
+    AuditedQuery(
+        "get_station_assets_by_stations (async)",
+        lambda s: s.exec(repository._station_assets_by_stations_statement([1, 2, 3])).all()
+    ),
+    AuditedQuery("get_station_assets_by_ids", lambda s: repository.get_station_assets_by_ids([1, 2, 3], db=s)),
+    AuditedQuery("get_asset_availability", lambda s: repository.get_asset_availability(db=s), "loaded once into the availability index"),
+    AuditedQuery("list_station_assets(station)", lambda s: repository.list_station_assets(1, db=s)),
+    AuditedQuery("reserve_station_asset", lambda s: repository.reserve_station_asset(1, db=s)),
+    # Charging Session Context
+    AuditedQuery("get_charging_session", lambda s: repository.get_charging_session(1, db=s)),
+    AuditedQuery("get_charging_sessions_by_user", lambda s: repository.get_charging_sessions_by_user(1, db=s)),
+    AuditedQuery("get_charging_sessions_version", lambda s: repository.get_charging_sessions_version(1, db=s)),
+    AuditedQuery("get_active_session_by_user", lambda s: repository.get_active_session_by_user(1, db=s)),
+    AuditedQuery("get_charging_session_detail", lambda s: repository.get_charging_session_detail(1, user_id=1, db=s)),
+    AuditedQuery("get_active_session_detail", lambda s: repository.get_active_session_detail(1, db=s)),
+    AuditedQuery("get_latest_meter_batch", lambda s: repository.get_latest_meter_batch(1, db=s)),
+    AuditedQuery("get_telemetry_chunks", lambda s: repository.get_telemetry_chunks(1, 60, 0.0, 3600.0, db=s)),
+    AuditedQuery("get_telemetry_span", lambda s: repository.get_telemetry_span(1, 60, None, 3600.0, db=s)),
+    AuditedQuery("get_session_telemetry_chunks", lambda s: repository.get_session_telemetry_chunks(1, db=s)),
+    # Billing Context
+    AuditedQuery("get_tariff_catalog", lambda s: repository.get_tariff_catalog(db=s), "compiled once into the TariffBook"),
+    AuditedQuery("list_tariff_plans", lambda s: repository.list_tariff_plans(db=s), "unfiltered listing, bounded by LIMIT"),
+    AuditedQuery("get_invoice", lambda s: repository.get_invoice(1, db=s)),
+    AuditedQuery("get_invoices_by_user", lambda s: repository.get_invoices_by_user(1, db=s)),
+    AuditedQuery("get_invoices_version", lambda s: repository.get_invoices_version(1, db=s)),
+    AuditedQuery("get_invoice_by_session", lambda s: repository.get_invoice_by_session(1, db=s)),
+    AuditedQuery("get_billed_sessions", lambda s: repository.get_billed_sessions(1, 1000, db=s)),
+    AuditedQuery("get_asset_ratings", lambda s: repository.get_asset_ratings(db=s), "loaded once per re-billing run"),
+]
+
+class AuditResult(NamedTuple):
+    name: str
+    statement: str
+    plan: List[str]
+    scans: List[str]
+    allow_scan: Optional[str]
+
+    @property
+    def flagged(self) -> bool:
+        return bool(self.scans) and not self.allow_scan
+
+def _explain(conn, statement: str, parameters) -> List[str]:
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql("EXPLAIN " + statement, parameters).all()
+    return [row[0] for row in rows]
+
+def _scans(dialect: str, plan: List[str]) -> List[str]:
+    if dialect == "sqlite":
+        # A temp b-tree sort reads every matching row before LIMIT applies,
+        # which defeats keyset pagination just like a scan does.
+        return [
+            line for line in plan
+            if (line.startswith("SCAN ") and "CONSTANT ROW" not in line)
+            or line.startswith("USE TEMP B-TREE FOR ORDER BY")
+        ]
+    return [line.strip() for line in plan if "Seq Scan" in line]
+
+def run_audit(bind=None, queries: List[AuditedQuery] = AUDITED_QUERIES) -> List[AuditResult]:
+    bind = bind if bind is not None else db.engine
+    results = []
+    with Session(bind) as s:
+        conn = s.connection()
+        if conn.dialect.name == "postgresql":
+            # Tiny or empty tables are always seq-scanned; this makes the
+            # planner fall back to a scan only when no index is usable.
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+        for query in queries:
+            captured = []
+
+            def capture(_conn, _cursor, statement, parameters, _context, _executemany):
+                captured.append((statement, parameters))
+
+            event.listen(bind, "before_cursor_execute", capture)
+            try:
+                query.call(s)
+            finally:
+                event.remove(bind, "before_cursor_execute", capture)
+
+            for statement, parameters in captured:
+                plan = _explain(conn, statement, parameters)
+                results.append(AuditResult(
+                    query.name, statement, plan,
+                    _scans(conn.dialect.name, plan), query.allow_scan
+                ))
+        s.rollback()
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="EXPLAIN every repository query and flag table scans.")
+    parser.add_argument("--fail-on-scan", action="store_true", help="exit 1 when an unexpected scan is found")
+    parser.add_argument("--verbose", action="store_true", help="print the full plan of every query")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    results = run_audit()
+    for r in results:
+        if r.flagged:
+            label = "SCAN"
+        elif r.scans:
+            label = "ok*"
+        else:
+            label = "ok"
+        print(f"{label:<5} {r.name:<40} {' | '.join(r.plan)}")
+        if r.scans and r.allow_scan:
+            print(f"      allowed: {r.allow_scan}")
+        if args.verbose:
+            print(f"      {' '.join(r.statement.split())}")
+
+    flagged = [r for r in results if r.flagged]
+    print(f"\n{len(results)} statements audited, {len(flagged)} unexpected scan(s)")
+    return 1 if flagged and args.fail_on_scan else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Live charger availability feed, served as Server-Sent Events.
+
+AvailabilityFeed subscribes to app.events, so every committed change of a
+StationAsset's availability or maintenance log is pushed to the clients
+watching its station: session start (reserve) and stop, maintenance logs,
+PATCH /station-assets/{id}, new and deleted assets. Changes are published
+in the committing thread and handed to each subscriber's event loop with
+call_soon_threadsafe; nothing here touches the database.
+
+Backpressure: a subscriber holds at most one pending update per asset and
+a newer state overwrites the older one, because a map only needs the latest
+state. A slow client therefore costs memory bounded by the assets it
+watches. Past MAX_PENDING assets the pending updates are dropped and the
+client gets a `resync` event telling it to refetch the state.
+"""
+import asyncio
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app import events
+from app.db import dumps
+
+MAX_PENDING = 1000
+MAX_STATIONS_PER_STREAM = 50
+HEARTBEAT_SECONDS = 15.0
+RETRY_MILLISECONDS = 3000
+
+# Asset columns the feed forwards
+FIELDS = ("is_available", "maintenance_log")
+
+class Subscription:
+    """One connected client. `station_ids` None means every station."""
+    def __init__(self, station_ids: Optional[Iterable[int]], loop: asyncio.AbstractEventLoop):
+        self.station_ids = frozenset(station_ids) if station_ids else None
+        self.loop = loop
+        self.dropped = 0
+        self._pending: Dict[int, dict] = {}
+        self._resync = False
+        self._wakeup = asyncio.Event()
+
+    def wants(self, station_id: Optional[int]) -> bool:
+        return self.station_ids is None or station_id in self.station_ids
+
+    def offer(self, asset_id: int, update: dict):
+        """Queues an update; must run on the subscriber's loop."""
+        current = self._pending.get(asset_id)
+        if current is not None:
+            current.update(update)
+        else:
+            if len(self._pending) >= MAX_PENDING:
+                self.dropped += len(self._pending)
+                self._pending.clear()
+                self._resync = True
+            self._pending[asset_id] = dict(update)
+        self._wakeup.set()
+
+    async def next(self, timeout: float) -> List[Tuple[str, dict]]:
+        """Pending (event, data) pairs, oldest asset first; [] when `timeout` passes without any."""
+        if not self._pending and not self._resync:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        out: List[Tuple[str, dict]] = []
+        if self._resync:
+            self._resync = False
+            out.append(("resync", {"reason": "client terlalu lambat, ambil ulang status asset"}))
+        for update in self._pending.values():
+            event = "removed" if update.get("deleted") else "asset"
+            out.append((event, update))
+        self._pending.clear()
+        return out
+
+class AvailabilityFeed:
+    def __init__(self):
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, station_ids: Optional[Iterable[int]] = None) -> Subscription:
+        """Call from the event loop that will read the subscription."""
+        subscription = Subscription(station_ids, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def apply(self, changes: List[events.Change]):
+        updates = []
+        for change in changes:
+            if change.entity != "station_asset":
+                continue
+            if change.op == "delete":
+                update = {"deleted": True}
+            else:
+                update = {f: change.data[f] for f in FIELDS if f in change.data}
+                if not update:
+                    continue
+            updates.append((change.key, change.station_id, {"asset_id": change.key, "station_id": change.station_id, **update}))
+        if not updates:
+            return
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            for asset_id, station_id, update in updates:
+                if not subscription.wants(station_id):
+                    continue
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.offer, asset_id, update)
+                except RuntimeError:
+                    # Loop already closed: the client is gone
+                    self.unsubscribe(subscription)
+                    break
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+def format_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {dumps(data)}\n\n".encode()
+
+async def event_stream(
+    feed: AvailabilityFeed,
+    subscription: Subscription,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    snapshot: Optional[List[dict]] = None,
+    heartbeat: float = HEARTBEAT_SECONDS
+) -> AsyncIterator[bytes]:
+    """SSE body: optional snapshot, then updates as they come, a comment line as heartbeat."""
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n\n".encode()
+        if snapshot is not None:
+            yield format_event("snapshot", snapshot)
+        while not await is_disconnected():
+            updates = await subscription.next(heartbeat)
+            if not updates:
+                yield b": ping\n\n"
+                continue
+            for event, data in updates:
+                yield format_event(event, data)
+    finally:
+        feed.unsubscribe(subscription)
+
+availability_feed = AvailabilityFeed()
+events.subscribe(availability_feed.apply)
@@ -1,6 +1,8 @@
 from typing import Optional, List
 from datetime import datetime
-from sqlmodel import SQLModel, Field, Relationship, JSON, Column
+from sqlmodel import SQLModel, Field, Relationship, JSON, Column, LargeBinary
+from sqlalchemy import Index, event, text
+from sqlalchemy.orm import object_session
 from enum import Enum
 
 # ===== ENUMS =====
@@ -32,9 +34,17 @@ class MaintenanceLog(SQLModel):
     date_time: datetime = Field(default_factory=datetime.utcnow)
 
 class Tariff(SQLModel):
-    """Value Object untuk tarif pengisian"""
+    """Value Object untuk tarif pengisian (snapshot tarif yang dipakai di invoice)"""
     cost_per_kwh: float
     cost_per_minute: float
+    tariff_id: Optional[int] = None  # None = tarif default
+    name: Optional[str] = None
+    admin_fee: Optional[float] = None
+    idle_fee_per_minute: Optional[float] = None
+    idle_grace_minutes: Optional[float] = None
+    tax_rate: Optional[float] = None
+    utc_offset_minutes: Optional[int] = None  # zona waktu lokal band time_of_use
+    time_of_use: List[dict] = []
 
 class ChargingReport(SQLModel):
     """Value Object untuk laporan charging"""
@@ -53,7 +63,7 @@ class User(SQLModel, table=True):
     
     user_id: Optional[int] = Field(default=None, primary_key=True)
     name: str
-    email: str
+    email: str = Field(index=True)
     phone: Optional[str] = None
     password_hash: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -68,7 +78,7 @@ class Vehicle(SQLModel, table=True):
     __tablename__ = "vehicle"
     
     vehicle_id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.user_id")
+    user_id: int = Field(foreign_key="user.user_id", index=True)
     nomor_plat: str = Field(unique=True)
     battery_capacity: float  # dalam kWh
     connector_port: ConnectorPort = Field(sa_column=Column(JSON))
@@ -86,20 +96,41 @@ class Station(SQLModel, table=True):
     location: Location = Field(sa_column=Column(JSON))
     connector_list: List[str] = Field(default=[], sa_column=Column(JSON))  # List connector types
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Salinan koordinat dari `location`, diisi otomatis saat insert/update
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     
     # Relationships
     station_assets: List["StationAsset"] = Relationship(back_populates="station")
 
+def location_coordinates(location) -> tuple:
+    """(latitude, longitude) dari Location / dict JSON, atau (None, None)."""
+    if location is None:
+        return None, None
+    if isinstance(location, dict):
+        return location.get("latitude"), location.get("longitude")
+    return getattr(location, "latitude", None), getattr(location, "longitude", None)
+
+@event.listens_for(Station, "before_insert")
+@event.listens_for(Station, "before_update")
+def _sync_station_coordinates(_mapper, _connection, station):
+    station.latitude, station.longitude = location_coordinates(station.location)
+
 class StationAsset(SQLModel, table=True):
     """Entitas StationAsset dari Station Management Context"""
     __tablename__ = "station_asset"
+    __table_args__ = (
+        # Available assets of one station; the single-column indexes keep
+        # asset_id order for the keyset-paginated station/availability lists.
+        Index("ix_station_asset_station_available", "station_id", "is_available"),
+    )
 
     asset_id: Optional[int] = Field(default=None, primary_key=True)
-    station_id: int = Field(foreign_key="station.station_id")
+    station_id: int = Field(foreign_key="station.station_id", index=True)
     model: str
     connector_port: ConnectorPort = Field(sa_column=Column(JSON))
     maintenance_log: Optional[MaintenanceLog] = Field(default=None, sa_column=Column(JSON))
-    is_available: bool = True
+    is_available: bool = Field(default=True, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     # Relationships
@@ -110,6 +141,19 @@ class StationAsset(SQLModel, table=True):
 class ChargingSession(SQLModel, table=True):
     """Entitas ChargingSession - Aggregate Root dari Charging Session Context"""
     __tablename__ = "charging_session"
+    __table_args__ = (
+        # Invariant: at most one ONGOING session per user, enforced by the DB
+        # so concurrent starts cannot both succeed.
+        Index(
+            "uq_charging_session_user_ongoing",
+            "user_id",
+            unique=True,
+            sqlite_where=text("charging_status = 'ONGOING'"),
+            postgresql_where=text("charging_status = 'ONGOING'"),
+        ),
+        # get_charging_sessions_by_user / get_active_session_by_user, ordered by id
+        Index("ix_charging_session_user_id_session_id", "user_id", "session_id"),
+    )
     
     session_id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.user_id")
@@ -118,18 +162,99 @@ class ChargingSession(SQLModel, table=True):
     end_time: Optional[datetime] = None
     duration: Optional[float] = None  # dalam menit
     total_kwh: Optional[float] = None
-    charging_status: ChargingStatus = Field(default=ChargingStatus.NOT_STARTED)
+    charging_status: ChargingStatus = Field(default=ChargingStatus.NOT_STARTED, index=True)
     battery_capacity: Optional[float] = None  # Snapshot dari vehicle
+    metered_kwh: Optional[float] = None  # Total energi dari meter values (lihat MeterBatch)
+    updated_at: Optional[datetime] = None  # Versi baris untuk ETag / Last-Modified, diisi otomatis
     
     # Relationships
     user: Optional[User] = Relationship(back_populates="charging_sessions")
     station_asset: Optional[StationAsset] = Relationship(back_populates="charging_sessions")
     invoice: Optional["Invoice"] = Relationship(back_populates="charging_session")
 
+class MeterBatch(SQLModel, table=True):
+    """Satu batch meter values dari charger, disimpan sebagai array float64 terkompresi"""
+    __tablename__ = "meter_batch"
+    __table_args__ = (
+        # Batches of a session are strictly sequential; a concurrent append
+        # with the same seq fails instead of double-counting energy.
+        Index("uq_meter_batch_session_seq", "session_id", "seq", unique=True),
+    )
+
+    batch_id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="charging_session.session_id")
+    seq: int
+    received_at: datetime = Field(default_factory=datetime.utcnow)
+    first_ts: float  # epoch detik
+    last_ts: float
+    reading_count: int
+    samples: bytes = Field(sa_column=Column(LargeBinary, nullable=False))  # lihat telemetry.pack
+    # Running state setelah batch ini (lihat telemetry.MeterState)
+    last_power_kw: Optional[float] = None
+    first_energy_wh: Optional[float] = None
+    last_energy_wh: Optional[float] = None
+    integrated_kwh: float = 0.0
+    total_kwh: float = 0.0
+
+class TelemetryChunk(SQLModel, table=True):
+    """Rollup daya/energi per bucket (1 detik, 1 menit, 15 menit) untuk satu ChargingSession"""
+    __tablename__ = "telemetry_chunk"
+    __table_args__ = (
+        # Range queries of one session's power curve at one resolution
+        Index("ix_telemetry_chunk_session_resolution_start", "session_id", "resolution", "start_ts"),
+    )
+
+    chunk_id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="charging_session.session_id")
+    resolution: int  # detik per bucket
+    start_ts: float  # epoch detik, awal bucket pertama
+    end_ts: float  # akhir bucket terakhir
+    bucket_count: int
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))  # lihat telemetry.pack_buckets
+
 # ===== BILLING CONTEXT =====
+class TariffPlan(SQLModel, table=True):
+    """Tarif per stasiun / per operator / global (keduanya kosong) dari Billing Context"""
+    __tablename__ = "tariff_plan"
+
+    tariff_id: Optional[int] = Field(default=None, primary_key=True)
+    name: str
+    station_id: Optional[int] = Field(default=None, foreign_key="station.station_id", index=True)
+    station_operator: Optional[str] = Field(default=None, index=True)
+    cost_per_kwh: float
+    cost_per_minute: float
+    admin_fee: float = 0.0
+    idle_fee_per_minute: float = 0.0
+    idle_grace_minutes: float = 0.0
+    tax_rate: float = 0.0  # mis. 0.11 untuk PPN 11%
+    utc_offset_minutes: int = 420  # zona waktu band time-of-use (default WIB)
+    is_active: bool = Field(default=True, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    # Relationships
+    bands: List["TariffBand"] = Relationship(back_populates="tariff")
+
+class TariffBand(SQLModel, table=True):
+    """Band time-of-use: tarif berbeda pada rentang jam tertentu (waktu lokal)"""
+    __tablename__ = "tariff_band"
+
+    band_id: Optional[int] = Field(default=None, primary_key=True)
+    tariff_id: int = Field(foreign_key="tariff_plan.tariff_id", index=True)
+    start_minute: int  # menit sejak 00:00 lokal
+    end_minute: int  # eksklusif; lebih kecil dari start_minute = melewati tengah malam
+    cost_per_kwh: float
+    cost_per_minute: float
+
+    # Relationships
+    tariff: Optional[TariffPlan] = Relationship(back_populates="bands")
+
 class Invoice(SQLModel, table=True):
     """Entitas Invoice dari Billing Context"""
     __tablename__ = "invoice"
+    __table_args__ = (
+        # get_invoices_by_user, ordered by id
+        Index("ix_invoice_user_id_invoice_id", "user_id", "invoice_id"),
+    )
     
     invoice_id: Optional[int] = Field(default=None, primary_key=True)
     session_id: int = Field(foreign_key="charging_session.session_id", unique=True)
@@ -141,7 +266,22 @@ class Invoice(SQLModel, table=True):
     payment_status: PaymentStatus = Field(default=PaymentStatus.PENDING)
     date_time: datetime = Field(default_factory=datetime.utcnow)
     charging_report: Optional[ChargingReport] = Field(default=None, sa_column=Column(JSON))
+    updated_at: Optional[datetime] = None  # Versi baris untuk ETag / Last-Modified, diisi otomatis
     
     # Relationships
     charging_session: Optional[ChargingSession] = Relationship(back_populates="invoice")
-    user: Optional[User] = Relationship(back_populates="invoices")
\ No newline at end of file
+    user: Optional[User] = Relationship(back_populates="invoices")
+
+# Row versions for conditional GET. Bulk UPDATE statements bypass these
+# hooks and set updated_at themselves.
+def _touch(_mapper, _connection, target):
+    target.updated_at = datetime.utcnow()
+
+def _touch_if_modified(_mapper, _connection, target):
+    # before_update also fires for objects that are dirty without net changes
+    if object_session(target).is_modified(target, include_collections=False):
+        target.updated_at = datetime.utcnow()
+
+for _versioned in (ChargingSession, Invoice):
+    event.listen(_versioned, "before_insert", _touch)
+    event.listen(_versioned, "before_update", _touch_if_modified)
@@ -0,0 +1,317 @@
+"""
+Per-request profiling: SQL statement count, DB time, handler time and
+serialization time.
+
+    ProfilingMiddleware   pure ASGI middleware; opens a RequestStats per
+                          request, adds a Server-Timing header and feeds the
+                          histograms served by GET /metrics.
+    TimedRoute            APIRoute that times the endpoint function itself.
+    Engine events         before/after_cursor_execute on every engine (sync,
+                          async, replicas) count statements and DB time of
+                          the current request.
+
+Server-Timing entries overlap: `app` is the whole request up to the
+response start, `handler` the endpoint function, `db` all SQL statements
+(also those run while resolving dependencies), `serialize` the time from
+the handler's return to the response start (response_model validation and
+JSON encoding) plus app.serialization spans inside the handler.
+
+Slow-request profiler (off unless PROFILE_SLOW_MS is set): while requests
+are in flight a sampler thread records the stacks of the threads running
+their handlers every PROFILE_INTERVAL_MS; a request slower than
+PROFILE_SLOW_MS has its samples written to PROFILE_DIR as collapsed stacks
+("frame;frame;frame count"), the input format of flamegraph.pl and
+speedscope. Async handlers share the event-loop thread, so their samples
+can include other requests' coroutines.
+"""
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 = profiler off
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+class RequestStats:
+    __slots__ = ("started", "queries", "db_seconds", "handler_seconds", "handler_done",
+                 "serialize_seconds", "threads", "samples")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.handler_seconds = 0.0
+        self.handler_done: Optional[float] = None
+        self.serialize_seconds = 0.0
+        self.threads: set = set()  # thread idents that ran the handler (for the sampler)
+        self.samples: Counter = Counter()
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def current() -> Optional[RequestStats]:
+    return _current.get()
+
+@contextmanager
+def span(kind: str):
+    """Adds the block's duration to the current request's `serialize` time (the only span kind so far)."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if kind == "serialize":
+            stats.serialize_seconds += time.perf_counter() - start
+
+# ===== SQL HOOKS =====
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.get("profiling_started")
+    if stats is None or not started:
+        return
+    stats.queries += 1
+    stats.db_seconds += time.perf_counter() - started.pop()
+
+# ===== ROUTE TIMING =====
+def _timed(call: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def timed_async(*args, **kwargs):
+            stats = _current.get()
+            if stats is None:
+                return await call(*args, **kwargs)
+            stats.threads.add(threading.get_ident())
+            start = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                stats.handler_done = time.perf_counter()
+                stats.handler_seconds += stats.handler_done - start
+        return timed_async
+
+    @functools.wraps(call)
+    def timed(*args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return call(*args, **kwargs)
+        stats.threads.add(threading.get_ident())
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            stats.threads.discard(threading.get_ident())
+            stats.handler_done = time.perf_counter()
+            stats.handler_seconds += stats.handler_done - start
+    return timed
+
+class TimedRoute(APIRoute):
+    """APIRoute whose endpoint call is timed into the current RequestStats."""
+    def get_route_handler(self):
+        if not getattr(self.dependant.call, "_profiled", False):
+            self.dependant.call = _timed(self.dependant.call)
+            self.dependant.call._profiled = True
+        return super().get_route_handler()
+
+# ===== HISTOGRAMS =====
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50, 100)
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, Prometheus style."""
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def snapshot(self) -> Dict[Tuple[Tuple[str, str], ...], Tuple[List[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self.snapshot().items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+request_seconds = Histogram("http_request_duration_seconds", "Time to response start", LATENCY_BUCKETS)
+handler_seconds = Histogram("http_request_handler_seconds", "Time in the endpoint function", LATENCY_BUCKETS)
+db_seconds = Histogram("http_request_db_seconds", "Time in SQL statements", LATENCY_BUCKETS)
+serialize_seconds = Histogram("http_request_serialize_seconds", "Response validation and encoding", LATENCY_BUCKETS)
+db_queries = Histogram("http_request_db_queries", "SQL statements per request", QUERY_BUCKETS)
+HISTOGRAMS = (request_seconds, handler_seconds, db_seconds, serialize_seconds, db_queries)
+
+# Called with (method, route, stats) after every request, e.g. the query-budget test fixture
+observers: List[Callable[[str, str, RequestStats], None]] = []
+
+def render_gauges(name: str, help_text: str, values: Dict[str, object], **labels: str) -> List[str]:
+    """Numeric entries of a stats dict as one gauge, the key in a `stat` label."""
+    prefix = "".join(f'{k}="{v}",' for k, v in sorted(labels.items()))
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for key, value in sorted(values.items()):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f'{name}{{{prefix}stat="{key}"}} {value}')
+    return lines
+
+# ===== SAMPLING PROFILER =====
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+class Sampler:
+    """Samples the handler threads of in-flight requests while there are any."""
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._active: set = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, stats: RequestStats):
+        with self._lock:
+            self._active.add(stats)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, stats: RequestStats):
+        with self._lock:
+            self._active.discard(stats)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                active = list(self._active)
+            frames = sys._current_frames()
+            for stats in active:
+                for ident in list(stats.threads):
+                    frame = frames.get(ident)
+                    if frame is not None and ident != own:
+                        stats.samples[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+sampler = Sampler()
+
+def dump_profile(stats: RequestStats, method: str, path: str, directory: str = PROFILE_DIR) -> Optional[str]:
+    """Writes the request's samples as collapsed stacks; returns the file path."""
+    if not stats.samples:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    slug = path.strip("/").replace("/", "_") or "root"
+    filename = os.path.join(directory, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{method}-{slug}.folded")
+    with open(filename, "w") as f:
+        for stack, count in stats.samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return filename
+
+# ===== MIDDLEWARE =====
+def server_timing(stats: RequestStats, app_seconds: float) -> str:
+    return ", ".join((
+        f"app;dur={app_seconds * 1000:.2f}",
+        f"handler;dur={stats.handler_seconds * 1000:.2f}",
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries"',
+        f"serialize;dur={stats.serialize_seconds * 1000:.2f}",
+    ))
+
+class ProfilingMiddleware:
+    def __init__(self, app, slow_ms: Optional[float] = None, profile_dir: Optional[str] = None):
+        self.app = app
+        self.slow_ms = PROFILE_SLOW_MS if slow_ms is None else slow_ms
+        self.profile_dir = profile_dir or PROFILE_DIR
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        if self.slow_ms > 0:
+            sampler.add(stats)
+        app_seconds = None
+
+        async def send_with_timing(message):
+            nonlocal app_seconds
+            if message["type"] == "http.response.start" and app_seconds is None:
+                now = time.perf_counter()
+                app_seconds = now - stats.started
+                if stats.handler_done is not None:
+                    stats.serialize_seconds += now - stats.handler_done
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stats, app_seconds).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if self.slow_ms > 0:
+                sampler.remove(stats)
+            if app_seconds is not None:
+                self._observe(scope, stats, app_seconds)
+                if self.slow_ms > 0 and app_seconds * 1000 >= self.slow_ms:
+                    # File I/O off the event loop; the response has already been sent
+                    await run_in_threadpool(dump_profile, stats, scope["method"], scope["path"], self.profile_dir)
+
+    def _observe(self, scope, stats: RequestStats, app_seconds: float):
+        route = scope.get("route")
+        labels = {"method": scope["method"], "route": getattr(route, "path", "unmatched")}
+        request_seconds.observe(app_seconds, **labels)
+        handler_seconds.observe(stats.handler_seconds, **labels)
+        db_seconds.observe(stats.db_seconds, **labels)
+        serialize_seconds.observe(stats.serialize_seconds, **labels)
+        db_queries.observe(stats.queries, **labels)
+        for observer in observers:
+            observer(labels["method"], labels["route"], stats)
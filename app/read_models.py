@@ -0,0 +1,122 @@
+"""
+Precomputed read models for hot public endpoints.
+
+StationDetailReadModel keeps the serialized JSON body of GET /stations/{id}
+per station. Entries are dropped when a committed transaction touches the
+station or one of its assets (see app.events), so a warm hit skips both the
+database and Pydantic validation. It is the only cache in front of that
+endpoint; app.cache.response_cache serves the station lists.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from app import events, service
+from app.db import on_primary
+
+STATION_DETAIL_CACHE_SIZE = int(os.getenv("STATION_DETAIL_CACHE_SIZE", "1024"))
+
+class StationDetailReadModel:
+    def __init__(self, maxsize: int = STATION_DETAIL_CACHE_SIZE):
+        self.maxsize = maxsize
+        # station_id -> (JSON body, asset ids in it)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # asset_id -> station_id of cached entries; bulk UPDATEs only know the asset
+        self._asset_station: Dict[int, int] = {}
+        # station_id -> build in progress; concurrent misses wait for it instead of querying again
+        self._inflight: Dict[int, Future] = {}
+        # Bumped on every invalidation; a build that raced with a commit is not stored
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, station_id: int, db: Optional[Session] = None) -> bytes:
+        """JSON body of the station detail; raises ValueError when the station does not exist."""
+        return self.lookup(station_id, db)[0]
+
+    def lookup(self, station_id: int, db: Optional[Session] = None) -> Tuple[bytes, bool]:
+        """(JSON body, served from the read model) of the station detail; one build per station at a time."""
+        with self._lock:
+            entry = self._entries.get(station_id)
+            if entry is not None:
+                self._entries.move_to_end(station_id)
+                self.hits += 1
+                return entry[0], True
+            future = self._inflight.get(station_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[station_id] = Future()
+                self.misses += 1
+                epoch = self._epoch
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+
+        try:
+            with on_primary():
+                detail = service.get_station_details(station_id, db=db)
+            body = detail.model_dump_json().encode("utf-8")
+        except BaseException as e:
+            with self._lock:
+                self._release(station_id, future)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            # Stored before the in-flight entry goes, so a later miss finds one or the other
+            if self.maxsize > 0 and epoch == self._epoch:
+                asset_ids = [asset.asset_id for asset in detail.station_assets]
+                self._entries[station_id] = (body, asset_ids)
+                self._entries.move_to_end(station_id)
+                for asset_id in asset_ids:
+                    self._asset_station[asset_id] = station_id
+                while len(self._entries) > self.maxsize:
+                    self._evict(next(iter(self._entries)))
+            self._release(station_id, future)
+        future.set_result(body)
+        return body, False
+
+    def _release(self, station_id: int, future: Future):
+        if self._inflight.get(station_id) is future:
+            del self._inflight[station_id]
+
+    def _evict(self, station_id: Optional[int]):
+        if station_id is None:
+            return
+        entry = self._entries.pop(station_id, None)
+        if entry is not None:
+            for asset_id in entry[1]:
+                self._asset_station.pop(asset_id, None)
+
+    def invalidate(self, changes: List[events.Change]):
+        with self._lock:
+            self._epoch += 1
+            # Builds already running read the old state; later misses start a fresh one
+            self._inflight.clear()
+            for change in changes:
+                if change.entity == "station":
+                    self._evict(change.key)
+                elif change.entity == "station_asset":
+                    # The station it was cached under, and the one it belongs to now
+                    self._evict(self._asset_station.get(change.key))
+                    self._evict(change.station_id)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._inflight.clear()
+            self._entries.clear()
+            self._asset_station.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+station_details = StationDetailReadModel()
+events.subscribe(station_details.invalidate)
@@ -0,0 +1,256 @@
+"""
+Bulk re-billing and reconciliation of stopped sessions.
+
+    python -m app.rebilling                                   # dry run, report only
+    python -m app.rebilling --since 2026-01-01 --until 2026-04-01 --report rebill.csv
+    python -m app.rebilling --apply                           # write corrections
+
+Sessions with an invoice are streamed in session_id order, CHUNK_SIZE rows
+at a time, and re-priced with the current TariffBook over whole NumPy
+arrays (price_arrays mirrors CompiledTariff.price). Invoices whose totals
+differ from the stored ones are reported and, with --apply, corrected with
+one bulk UPDATE per chunk, each chunk in its own transaction. Memory stays
+bounded by the chunk size however many sessions are scanned.
+
+Only invoices still PENDING are re-billed unless --include-settled is given;
+correcting a settled invoice means a refund or a top-up, which this job does
+not do.
+"""
+import argparse
+import csv
+import sys
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, TextIO
+
+import numpy as np
+
+from app import db, repository, service, tariffs
+
+CHUNK_SIZE = 10_000
+# Stored totals are rounded to 2 decimals; smaller differences are rounding noise
+TOLERANCE = 0.005
+
+_US_PER_MINUTE = 60_000_000
+_US_PER_DAY = tariffs.MINUTES_PER_DAY * _US_PER_MINUTE
+_UNKNOWN_ASSET = (None, tariffs.DEFAULT_POWER_KW)
+
+def price_arrays(
+    tariff: tariffs.CompiledTariff,
+    kwh: np.ndarray,
+    minutes: np.ndarray,
+    start_time: np.ndarray,
+    max_kw: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    CompiledTariff.price over arrays: one element per session, `start_time`
+    as datetime64 (UTC). Returns the same cost lines as arrays.
+    """
+    kwh = np.asarray(kwh, dtype=np.float64)
+    minutes = np.asarray(minutes, dtype=np.float64)
+    max_kw = np.asarray(max_kw, dtype=np.float64)
+    positive = minutes > 0
+
+    if tariff.bands:
+        # Local minute of day at the start, then the minutes spent in every
+        # segment on every day the session touches
+        local_us = start_time.astype("datetime64[us]").astype(np.int64) + tariff.utc_offset_minutes * _US_PER_MINUTE
+        begin = (local_us % _US_PER_DAY) / _US_PER_MINUTE
+        end = begin + np.where(positive, minutes, 0.0)
+        days = int(np.ceil(end.max() / tariffs.MINUTES_PER_DAY)) if len(end) else 0
+
+        energy_rate = np.zeros_like(minutes)  # time-weighted cost_per_kwh * minutes
+        time_cost = np.zeros_like(minutes)
+        for segment in tariff.segments:
+            spent = np.zeros_like(minutes)
+            for day in range(days):
+                offset = day * tariffs.MINUTES_PER_DAY
+                spent += np.clip(
+                    np.minimum(end, segment.end_minute + offset) - np.maximum(begin, segment.start_minute + offset),
+                    0.0, None
+                )
+            energy_rate += spent * segment.cost_per_kwh
+            time_cost += spent * segment.cost_per_minute
+        share = np.divide(energy_rate, minutes, out=np.full_like(minutes, tariff.cost_per_kwh), where=positive)
+        energy_cost = kwh * share
+    else:
+        energy_cost = kwh * tariff.cost_per_kwh
+        time_cost = np.maximum(minutes, 0.0) * tariff.cost_per_minute
+
+    idle_fee = np.zeros_like(minutes)
+    if tariff.idle_fee_per_minute:
+        rated = max_kw > 0
+        charging_minutes = np.divide(kwh * 60.0, max_kw, out=np.zeros_like(kwh), where=rated)
+        idle_minutes = np.maximum(minutes - charging_minutes - tariff.idle_grace_minutes, 0.0)
+        idle_fee = np.where(rated, idle_minutes * tariff.idle_fee_per_minute, 0.0)
+
+    total_cost = energy_cost + time_cost + idle_fee
+    tax = (total_cost + tariff.admin_fee) * tariff.tax_rate
+    return {
+        "energy_cost": energy_cost,
+        "time_cost": time_cost,
+        "idle_fee": idle_fee,
+        "total_cost": total_cost,
+        "admin_fee": np.full_like(minutes, tariff.admin_fee),
+        "tax": tax,
+        "billing_total": total_cost + tariff.admin_fee + tax
+    }
+
+class Correction(NamedTuple):
+    session_id: int
+    invoice_id: int
+    tariff_id: Optional[int]
+    old_cost_total: float
+    new_cost_total: float
+    old_billing_total: float
+    new_billing_total: float
+
+    @property
+    def delta(self) -> float:
+        return self.new_billing_total - self.old_billing_total
+
+class ReconciliationReport:
+    """Running totals of one run; corrections themselves are streamed, not kept."""
+    def __init__(self):
+        self.scanned = 0
+        self.changed = 0
+        self.applied = 0
+        self.billed_before = 0.0
+        self.billed_after = 0.0
+        self.max_abs_delta = 0.0
+
+    def add_chunk(self, old_billing: np.ndarray, new_billing: np.ndarray, changed: int):
+        self.scanned += len(old_billing)
+        self.changed += changed
+        self.billed_before += float(old_billing.sum())
+        self.billed_after += float(new_billing.sum())
+        if len(old_billing):
+            self.max_abs_delta = max(self.max_abs_delta, float(np.abs(new_billing - old_billing).max()))
+
+    @property
+    def delta(self) -> float:
+        return self.billed_after - self.billed_before
+
+    def summary(self) -> str:
+        return (
+            f"scanned={self.scanned} changed={self.changed} applied={self.applied}\n"
+            f"billing_total before={self.billed_before:.2f} after={self.billed_after:.2f} "
+            f"delta={self.delta:+.2f} max_abs_delta={self.max_abs_delta:.2f}"
+        )
+
+def _reprice(rows: List[repository.BilledSessionRow], ratings: Dict[int, tuple]):
+    """(new cost_total, new billing_total, tariff per row) for one chunk, rounded like the stop transaction."""
+    rated = [ratings.get(r.asset_id, _UNKNOWN_ASSET) for r in rows]
+    stations = np.array([-1 if station_id is None else station_id for station_id, _ in rated], dtype=np.int64)
+    max_kw = np.array([kw for _, kw in rated], dtype=np.float64)
+    kwh = np.array([r.total_kwh or 0.0 for r in rows])
+    start = np.array([r.start_time for r in rows], dtype="datetime64[us]")
+    end = np.array([r.end_time for r in rows], dtype="datetime64[us]")
+    minutes = (end - start).astype(np.int64) / _US_PER_MINUTE
+
+    # Price once per distinct tariff, over all rows that resolve to it
+    unique_stations, station_index = np.unique(stations, return_inverse=True)
+    compiled: List[tariffs.CompiledTariff] = []
+    tariff_of_station = []
+    for station_id in unique_stations:
+        tariff = tariffs.tariff_book.resolve(None if station_id < 0 else int(station_id))
+        if tariff not in compiled:
+            compiled.append(tariff)
+        tariff_of_station.append(compiled.index(tariff))
+    tariff_index = np.asarray(tariff_of_station, dtype=np.int64)[station_index]
+
+    cost_total = np.empty(len(rows))
+    billing_total = np.empty(len(rows))
+    for i, tariff in enumerate(compiled):
+        mask = tariff_index == i
+        lines = price_arrays(tariff, kwh[mask], minutes[mask], start[mask], max_kw[mask])
+        cost_total[mask] = lines["total_cost"]
+        billing_total[mask] = lines["billing_total"]
+    return np.round(cost_total, 2), np.round(billing_total, 2), [compiled[i] for i in tariff_index]
+
+def run(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    chunk_size: int = CHUNK_SIZE,
+    apply: bool = False,
+    include_settled: bool = False,
+    report: Optional[TextIO] = None
+) -> ReconciliationReport:
+    """Streams, re-prices and (with `apply`) corrects invoices; CSV lines go to `report`."""
+    result = ReconciliationReport()
+    writer = csv.writer(report) if report is not None else None
+    if writer is not None:
+        writer.writerow(Correction._fields + ("delta",))
+
+    with db.get_session() as s:
+        service.resolve_tariff(None, db=s)  # compiles the TariffBook when it is stale
+        ratings = {
+            asset_id: (station_id, tariffs.rated_power_kw(port))
+            for asset_id, station_id, port in repository.get_asset_ratings(db=s)
+        }
+
+    cursor = None
+    while True:
+        with db.UnitOfWork() as uow:
+            rows = repository.get_billed_sessions(
+                cursor, chunk_size, since, until, pending_only=not include_settled, db=uow.session
+            )
+            if not rows:
+                break
+            cursor = rows[-1].session_id
+
+            new_cost, new_billing, row_tariffs = _reprice(rows, ratings)
+            old_cost = np.array([r.cost_total for r in rows])
+            old_billing = np.array([r.billing_total for r in rows])
+            changed = np.flatnonzero(
+                (np.abs(new_cost - old_cost) > TOLERANCE) | (np.abs(new_billing - old_billing) > TOLERANCE)
+            )
+            result.add_chunk(old_billing, new_billing, len(changed))
+
+            corrections = []
+            for i in changed:
+                row, tariff = rows[i], row_tariffs[i]
+                correction = Correction(
+                    row.session_id, row.invoice_id, tariff.tariff_id,
+                    row.cost_total, float(new_cost[i]), row.billing_total, float(new_billing[i])
+                )
+                if writer is not None:
+                    writer.writerow(correction + (round(correction.delta, 2),))
+                corrections.append({
+                    "invoice_id": row.invoice_id,
+                    "cost_total": correction.new_cost_total,
+                    "billing_total": correction.new_billing_total,
+                    "tariff": tariff.snapshot().model_dump()
+                })
+
+            if apply and corrections:
+                result.applied += repository.update_invoice_totals(corrections, db=uow.session)
+                uow.commit()
+    return result
+
+def _date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Re-price stopped sessions and reconcile their invoices.")
+    parser.add_argument("--since", type=_date, help="session end time >= (ISO-8601, UTC)")
+    parser.add_argument("--until", type=_date, help="session end time < (ISO-8601, UTC)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--apply", action="store_true", help="write the corrections (default: dry run)")
+    parser.add_argument("--include-settled", action="store_true", help="also re-bill invoices that are no longer PENDING")
+    parser.add_argument("--report", help="CSV file for the per-invoice corrections")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    report = open(args.report, "w", newline="") if args.report else None
+    try:
+        result = run(args.since, args.until, args.chunk_size, args.apply, args.include_settled, report)
+    finally:
+        if report is not None:
+            report.close()
+    print(result.summary())
+    if not args.apply and result.changed:
+        print("dry run: nothing written, rerun with --apply to correct the invoices")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
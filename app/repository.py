@@ -1,128 +1,336 @@
-from sqlmodel import select
-from app.db import get_session as get_db_session
-from app import models
-from typing import Optional, List
-from sqlalchemy.orm import selectinload
+from contextlib import contextmanager
+from datetime import datetime
+from sqlmodel import select, update, delete, Session
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from app.db import get_session as get_db_session, reads, writes
+from app import events, models
+from app.tariffs import TariffCatalog
+from typing import Optional, List, NamedTuple
+from sqlalchemy.orm import selectinload, joinedload, contains_eager
 from typing import Dict, Any
 
+# Every function takes an optional `db` Session. When the caller passes the
+# request-scoped session (see app.db.UnitOfWork) the work joins that
+# transaction and is only flushed; otherwise a short-lived session is opened
+# and committed as before.
+
+@contextmanager
+def _session_scope(db: Optional[Session] = None):
+    if db is not None:
+        yield db
+    else:
+        with get_db_session() as s:
+            yield s
+
+# Keyset pagination: list functions return one Page ordered by primary key.
+# `cursor` is the key of the last row already seen, so every page is an index
+# range scan of at most `limit + 1` rows, however deep the client pages.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class Page(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[int] = None
+
+def _keyset(statement, key, limit: int, cursor: Optional[int], descending: bool = False):
+    if cursor is not None:
+        statement = statement.where(key < cursor if descending else key > cursor)
+    return statement.order_by(key.desc() if descending else key).limit(limit + 1)
+
+def _to_page(rows, key, limit: int) -> Page:
+    if len(rows) <= limit:
+        return Page(list(rows), None)
+    rows = rows[:limit]
+    return Page(list(rows), getattr(rows[-1], key.key))
+
+def _paginate(s: Session, statement, key, limit: int, cursor: Optional[int], descending: bool = False) -> Page:
+    rows = s.exec(_keyset(statement, key, limit, cursor, descending)).all()
+    return _to_page(rows, key, limit)
+
 # ==========================================
 # ACCOUNT CONTEXT (Users & Vehicles)
 # ==========================================
 
-def _save(instance: models.SQLModel) -> models.SQLModel:
+def _save(instance: models.SQLModel, db: Optional[Session] = None) -> models.SQLModel:
     """Generic save (create or update) function."""
+    if db is not None:
+        db.add(instance)
+        db.flush()  # assigns primary keys; commit is left to the unit of work
+        return instance
     with get_db_session() as s:
         s.add(instance)
         s.commit()
         s.refresh(instance)
     return instance
 
-def create_user(user: models.User) -> models.User:
-    return _save(user)
+@writes
+def create_user(user: models.User, db: Optional[Session] = None) -> models.User:
+    return _save(user, db)
 
-def get_user(user_id: int) -> Optional[models.User]:
-    with get_db_session() as s:
+@writes
+def update_user(user: models.User, db: Optional[Session] = None) -> models.User:
+    return _save(user, db)
+
+@reads
+def get_user(user_id: int, db: Optional[Session] = None) -> Optional[models.User]:
+    with _session_scope(db) as s:
         return s.get(models.User, user_id)
 
-def get_user_by_email(email: str) -> Optional[models.User]:
-    with get_db_session() as s:
+@reads
+def get_user_by_email(email: str, db: Optional[Session] = None) -> Optional[models.User]:
+    with _session_scope(db) as s:
         statement = select(models.User).where(models.User.email == email)
         result = s.exec(statement).first()
         return result
 
-def list_users() -> List[models.User]:
-    with get_db_session() as s:
+@reads
+def list_users(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[Session] = None) -> Page:
+    with _session_scope(db) as s:
         statement = select(models.User)
-        return s.exec(statement).all()
+        return _paginate(s, statement, models.User.user_id, limit, cursor)
 
-def create_vehicle(vehicle: models.Vehicle) -> models.Vehicle:
-    return _save(vehicle)
+@writes
+def create_vehicle(vehicle: models.Vehicle, db: Optional[Session] = None) -> models.Vehicle:
+    return _save(vehicle, db)
 
-def get_vehicle(vehicle_id: int) -> Optional[models.Vehicle]:
-    with get_db_session() as s:
+@reads
+def get_vehicle(vehicle_id: int, db: Optional[Session] = None) -> Optional[models.Vehicle]:
+    with _session_scope(db) as s:
         return s.get(models.Vehicle, vehicle_id)
 
-def get_vehicle_by_plate(plate: str) -> Optional[models.Vehicle]:
-    with get_db_session() as s:
+@reads
+def get_vehicle_by_plate(plate: str, db: Optional[Session] = None) -> Optional[models.Vehicle]:
+    with _session_scope(db) as s:
         statement = select(models.Vehicle).where(models.Vehicle.nomor_plat == plate)
         return s.exec(statement).first()
 
-def get_vehicles_by_user(user_id: int) -> List[models.Vehicle]:
-    with get_db_session() as s:
-        statement = select(models.Vehicle).where(models.Vehicle.user_id == user_id) 
-        return s.exec(statement).all()
+@reads
+def get_vehicles_by_user(user_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[Session] = None) -> Page:
+    with _session_scope(db) as s:
+        statement = select(models.Vehicle).where(models.Vehicle.user_id == user_id)
+        return _paginate(s, statement, models.Vehicle.vehicle_id, limit, cursor)
 
 
 # ==========================================
 # STATION MANAGEMENT CONTEXT
 # ==========================================
 
-def create_station(station: models.Station) -> models.Station:
-    return _save(station)
+@writes
+def create_station(station: models.Station, db: Optional[Session] = None) -> models.Station:
+    return _save(station, db)
 
-def get_station(station_id: int):
-    with get_db_session() as s:
+@reads
+def get_station(station_id: int, db: Optional[Session] = None):
+    with _session_scope(db) as s:
         # Menggunakan .get() adalah cara paling efisien untuk mengambil objek berdasarkan primary key.
         station = s.get(models.Station, station_id)
         return station
 
-def list_stations() -> List[models.Station]:
-    with get_db_session() as s:
+@reads
+def get_station_detail(station_id: int, db: Optional[Session] = None) -> Optional[models.Station]:
+    """Station with its assets (ordered by asset_id) as one LEFT OUTER JOIN."""
+    with _session_scope(db) as s:
+        statement = (
+            select(models.Station)
+            .outerjoin(models.Station.station_assets)
+            .options(contains_eager(models.Station.station_assets))
+            .where(models.Station.station_id == station_id)
+            .order_by(models.StationAsset.asset_id)
+        )
+        return s.exec(statement).unique().first()
+
+@reads
+def list_stations(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[Session] = None) -> Page:
+    with _session_scope(db) as s:
         statement = select(models.Station)
-        return s.exec(statement).all()
+        return _paginate(s, statement, models.Station.station_id, limit, cursor)
 
-def search_stations_by_operator(operator_name: str) -> List[models.Station]:
-    with get_db_session() as s:
+@reads
+def search_stations_by_operator(operator_name: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[Session] = None) -> Page:
+    with _session_scope(db) as s:
         # REFACTOR: Menggunakan .ilike() untuk pencarian case-insensitive dan parsial.
         statement = select(models.Station).where(models.Station.station_operator.ilike(f"%{operator_name}%"))
+        return _paginate(s, statement, models.Station.station_id, limit, cursor)
+
+@reads
+def get_stations_by_ids(station_ids: List[int], db: Optional[Session] = None) -> List[models.Station]:
+    if not station_ids:
+        return []
+    with _session_scope(db) as s:
+        statement = select(models.Station).where(models.Station.station_id.in_(station_ids))
         return s.exec(statement).all()
 
 # === Station Assets (Fixed: Changed from ChargerUnit to StationAsset) ===
 
-def create_station_asset(asset: models.StationAsset) -> models.StationAsset:
-    return _save(asset)
+@writes
+def create_station_asset(asset: models.StationAsset, db: Optional[Session] = None) -> models.StationAsset:
+    return _save(asset, db)
 
-def get_station_asset(asset_id: int) -> Optional[models.StationAsset]:
-    with get_db_session() as s:
+@reads
+def get_station_asset(asset_id: int, db: Optional[Session] = None) -> Optional[models.StationAsset]:
+    with _session_scope(db) as s:
         return s.get(models.StationAsset, asset_id)
 
-def update_station_asset(asset: models.StationAsset) -> models.StationAsset:
-    return _save(asset)
+@writes
+def update_station_asset(asset: models.StationAsset, db: Optional[Session] = None) -> models.StationAsset:
+    return _save(asset, db)
 
-def get_station_assets_by_station(station_id: int) -> List[models.StationAsset]:
-    with get_db_session() as s:
+@reads
+def get_station_assets_by_station(station_id: int, db: Optional[Session] = None) -> List[models.StationAsset]:
+    with _session_scope(db) as s:
         statement = select(models.StationAsset).where(models.StationAsset.station_id == station_id)
         return s.exec(statement).all()
 
-def get_available_station_assets(station_id: Optional[int] = None) -> List[models.StationAsset]:
-    with get_db_session() as s:
+@reads
+def get_asset_availability(db: Optional[Session] = None) -> List[tuple]:
+    """(asset_id, station_id, connector_port, is_available) of every asset, for app.availability."""
+    with _session_scope(db) as s:
+        statement = select(
+            models.StationAsset.asset_id,
+            models.StationAsset.station_id,
+            models.StationAsset.connector_port,
+            models.StationAsset.is_available
+        )
+        return s.exec(statement).all()
+
+def _station_assets_by_stations_statement(station_ids: List[int]):
+    # Snapshot of GET /station-assets/stream, run by app/async_repository.py
+    return select(models.StationAsset).where(models.StationAsset.station_id.in_(station_ids))
+
+@reads
+def get_station_assets_by_ids(asset_ids: List[int], db: Optional[Session] = None) -> List[models.StationAsset]:
+    """Assets by primary key, in id order."""
+    if not asset_ids:
+        return []
+    with _session_scope(db) as s:
+        statement = (
+            select(models.StationAsset)
+            .where(models.StationAsset.asset_id.in_(asset_ids))
+            .order_by(models.StationAsset.asset_id)
+        )
+        return s.exec(statement).all()
+
+@reads
+def get_available_station_assets(station_id: Optional[int] = None, db: Optional[Session] = None) -> List[models.StationAsset]:
+    with _session_scope(db) as s:
         statement = select(models.StationAsset).where(models.StationAsset.is_available == True)
         if station_id:
             statement = statement.where(models.StationAsset.station_id == station_id)
         return s.exec(statement).all()
 
+@reads
+def list_station_assets(
+    station_id: Optional[int] = None,
+    available_only: bool = False,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[int] = None,
+    db: Optional[Session] = None
+) -> Page:
+    with _session_scope(db) as s:
+        statement = select(models.StationAsset)
+        if available_only:
+            statement = statement.where(models.StationAsset.is_available == True)
+        if station_id:
+            statement = statement.where(models.StationAsset.station_id == station_id)
+        return _paginate(s, statement, models.StationAsset.asset_id, limit, cursor)
+
+# === Bulk import (app.bulk_import) ===
+# ORM bulk INSERT: one executemany per call, no objects in the identity map.
+# Mapper hooks and flush events do not run for bulk statements, so derived
+# columns are filled here and the changes are recorded for app.events by hand.
+
+def _bulk_insert(s: Session, model, key, rows: List[Dict[str, Any]]) -> List[int]:
+    statement = insert(model).returning(key, sort_by_parameter_order=True)
+    return list(s.execute(statement, rows).scalars().all())
+
+@writes
+def bulk_insert_stations(rows: List[Dict[str, Any]], db: Optional[Session] = None) -> List[int]:
+    """Inserts station rows (column values, JSON columns as dicts); returns ids in row order."""
+    if not rows:
+        return []
+    with _session_scope(db) as s:
+        for row in rows:
+            row["latitude"], row["longitude"] = models.location_coordinates(row["location"])
+        ids = _bulk_insert(s, models.Station, models.Station.station_id, rows)
+        for station_id, row in zip(ids, rows):
+            events.record(s, events.Change("station", station_id, station_id, "insert", row))
+        if db is None:
+            s.commit()
+        return ids
+
+@writes
+def bulk_insert_station_assets(rows: List[Dict[str, Any]], db: Optional[Session] = None) -> List[int]:
+    """Inserts station asset rows; returns ids in row order."""
+    if not rows:
+        return []
+    with _session_scope(db) as s:
+        ids = _bulk_insert(s, models.StationAsset, models.StationAsset.asset_id, rows)
+        for asset_id, row in zip(ids, rows):
+            events.record(s, events.Change("station_asset", asset_id, row["station_id"], "insert", row))
+        if db is None:
+            s.commit()
+        return ids
+
+@reads
+def get_existing_station_ids(station_ids: List[int], db: Optional[Session] = None) -> set:
+    if not station_ids:
+        return set()
+    with _session_scope(db) as s:
+        statement = select(models.Station.station_id).where(models.Station.station_id.in_(station_ids))
+        return set(s.exec(statement).all())
+
 
 # ==========================================
 # CHARGING SESSION CONTEXT
 # ==========================================
 
-def create_charging_session(session: models.ChargingSession) -> models.ChargingSession:
-    return _save(session)
+@writes
+def create_charging_session(session: models.ChargingSession, db: Optional[Session] = None) -> models.ChargingSession:
+    return _save(session, db)
 
-def get_charging_session(session_id: int) -> Optional[models.ChargingSession]:
-    with get_db_session() as s:
+@reads
+def get_charging_session(session_id: int, db: Optional[Session] = None) -> Optional[models.ChargingSession]:
+    with _session_scope(db) as s:
         return s.get(models.ChargingSession, session_id)
 
-def update_charging_session(session: models.ChargingSession) -> models.ChargingSession:
-    return _save(session)
-
-def get_charging_sessions_by_user(user_id: int) -> List[models.ChargingSession]:
-    with get_db_session() as s:
-        statement = select(models.ChargingSession).where(models.ChargingSession.user_id == user_id)  
-        return s.exec(statement).all()
-
-def get_active_session_by_user(user_id: int) -> Optional[models.ChargingSession]:
-    with get_db_session() as s:
+@writes
+def update_charging_session(session: models.ChargingSession, db: Optional[Session] = None) -> models.ChargingSession:
+    return _save(session, db)
+
+@reads
+def get_charging_sessions_by_user(user_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[Session] = None) -> Page:
+    with _session_scope(db) as s:
+        # Newest first; session_id grows with start_time
+        statement = select(models.ChargingSession).where(models.ChargingSession.user_id == user_id)
+        return _paginate(s, statement, models.ChargingSession.session_id, limit, cursor, descending=True)
+
+# === Row versions (conditional GET) ===
+
+class RowVersion(NamedTuple):
+    """Changes whenever a row of the set is added, removed or updated."""
+    count: int
+    max_id: Optional[int]
+    last_modified: Optional[datetime]
+
+def _version_statement(key, updated_at, created_at, where):
+    # One aggregate over the same index the list query uses
+    return select(func.count(), func.max(key), func.max(func.coalesce(updated_at, created_at))).where(where)
+
+def _charging_sessions_version_statement(user_id: int):
+    return _version_statement(
+        models.ChargingSession.session_id, models.ChargingSession.updated_at,
+        models.ChargingSession.start_time, models.ChargingSession.user_id == user_id
+    )
+
+@reads
+def get_charging_sessions_version(user_id: int, db: Optional[Session] = None) -> RowVersion:
+    with _session_scope(db) as s:
+        return RowVersion(*s.exec(_charging_sessions_version_statement(user_id)).one())
+
+@reads
+def get_active_session_by_user(user_id: int, db: Optional[Session] = None) -> Optional[models.ChargingSession]:
+    with _session_scope(db) as s:
         # Check for sessions that are ONGOING
         statement = select(models.ChargingSession).where(
             models.ChargingSession.user_id == user_id,
@@ -130,38 +338,135 @@ def get_active_session_by_user(user_id: int) -> Optional[models.ChargingSession]
         )
         return s.exec(statement).first()
 
+def _session_detail_statement():
+    # Session + user + asset + invoice as one LEFT OUTER JOIN; all three are
+    # many-to-one (invoice is unique per session), so rows are not multiplied.
+    return select(models.ChargingSession).options(
+        joinedload(models.ChargingSession.user),
+        joinedload(models.ChargingSession.station_asset),
+        joinedload(models.ChargingSession.invoice)
+    )
+
+@reads
+def get_charging_session_detail(session_id: int, user_id: Optional[int] = None, db: Optional[Session] = None) -> Optional[models.ChargingSession]:
+    """Session with user, asset and invoice loaded in a single query; `user_id` restricts it to the owner."""
+    with _session_scope(db) as s:
+        statement = _session_detail_statement().where(models.ChargingSession.session_id == session_id)
+        if user_id is not None:
+            statement = statement.where(models.ChargingSession.user_id == user_id)
+        return s.exec(statement).first()
+
+@reads
+def get_active_session_detail(user_id: int, db: Optional[Session] = None) -> Optional[models.ChargingSession]:
+    """The user's ONGOING session with its relations, in a single query."""
+    with _session_scope(db) as s:
+        statement = _session_detail_statement().where(
+            models.ChargingSession.user_id == user_id,
+            models.ChargingSession.charging_status == models.ChargingStatus.ONGOING
+        )
+        return s.exec(statement).first()
+
+@writes
+def reserve_station_asset(asset_id: int, db: Optional[Session] = None) -> bool:
+    """
+    Atomically flips an available asset to unavailable.
+    Single conditional UPDATE: of any number of concurrent callers exactly one
+    gets the row back (RETURNING station_id), without a prior SELECT.
+    """
+    with _session_scope(db) as s:
+        result = s.exec(
+            update(models.StationAsset)
+            .where(
+                models.StationAsset.asset_id == asset_id,
+                models.StationAsset.is_available == True
+            )
+            .values(is_available=False)
+            .returning(models.StationAsset.station_id)
+        )
+        station_id = result.scalar_one_or_none()
+        reserved = station_id is not None
+        if reserved:
+            # Bulk UPDATE bypasses the ORM flush, so announce it explicitly
+            events.record(s, events.Change("station_asset", asset_id, station_id, "update", {"is_available": False}))
+        if db is None:
+            s.commit()
+        return reserved
+
+@writes
+def execute_start_session_transaction(
+    user_id: int,
+    asset_id: int,
+    start_time: datetime,
+    db: Optional[Session] = None
+) -> models.ChargingSession:
+    """Reserves the asset and opens the charging session in a single transaction."""
+    with _session_scope(db) as s:
+        # 1. Reserve Asset (conditional UPDATE, no read-then-write race)
+        if not reserve_station_asset(asset_id, db=s):
+            asset = s.get(models.StationAsset, asset_id)
+            if not asset:
+                raise ValueError("Station Asset tidak ditemukan")
+            raise ValueError("Charger sedang tidak tersedia (Sedang digunakan atau Maintenance)")
+
+        # 2. Create Session
+        # uq_charging_session_user_ongoing rejects a second ONGOING session for
+        # the same user; rolling back also releases the reservation above.
+        session = models.ChargingSession(
+            user_id=user_id,
+            asset_id=asset_id,
+            start_time=start_time,
+            charging_status=models.ChargingStatus.ONGOING
+        )
+        s.add(session)
+        try:
+            s.flush()
+        except IntegrityError:
+            s.rollback()
+            raise ValueError("Anda masih memiliki sesi charging yang aktif")
+
+        if db is None:
+            s.commit()
+            s.refresh(session)
+        return session
+
+@writes
 def execute_stop_session_transaction(
     session: models.ChargingSession,
     asset: models.StationAsset,
     details: Dict[str, Any],
-    tariff: models.Tariff
+    tariff: models.Tariff,
+    db: Optional[Session] = None
 ) -> models.ChargingSession:
     """Executes all database operations for stopping a session in a single transaction."""
-    with get_db_session() as s:
-        # 1. Re-fetch objects (CRITICAL FIX for 500 Errors)
-        # Mengambil ulang data di dalam sesi transaksi aktif untuk mencegah DetachedInstanceError
-        db_session = s.get(models.ChargingSession, session.session_id)
-        db_asset = s.get(models.StationAsset, asset.asset_id)
-
-        if not db_session or not db_asset:
-            raise ValueError("Session or Asset not found during transaction")
-        
-        # 2. Race Condition Check
-        if db_session.charging_status != models.ChargingStatus.ONGOING:
+    with _session_scope(db) as s:
+        # 1. Close Session (conditional UPDATE: of concurrent stops exactly one matches
+        # the ONGOING row; the request's identity map may still hold the pre-stop state)
+        closed = s.exec(
+            update(models.ChargingSession)
+            .where(
+                models.ChargingSession.session_id == session.session_id,
+                models.ChargingSession.charging_status == models.ChargingStatus.ONGOING
+            )
+            .values(
+                end_time=details["end_time"],
+                duration=round(details["duration_minutes"], 2),
+                total_kwh=details["total_kwh"],
+                charging_status=models.ChargingStatus.STOPPED,
+                updated_at=datetime.utcnow()
+            )
+        )
+        if closed.rowcount != 1:
             raise ValueError("Session sudah berakhir")
+        db_session = s.get(models.ChargingSession, session.session_id)
 
-        # 3. Update Session
-        db_session.end_time = details["end_time"]
-        db_session.duration = round(details["duration_minutes"], 2)
-        db_session.total_kwh = details["total_kwh"]
-        db_session.charging_status = models.ChargingStatus.STOPPED
-        s.add(db_session)
-
-        # 4. Release Asset
+        # 2. Release Asset
+        db_asset = s.get(models.StationAsset, asset.asset_id)
+        if not db_asset:
+            raise ValueError("Station Asset tidak ditemukan")
         db_asset.is_available = True
         s.add(db_asset)
 
-        # 5. Create Invoice
+        # 3. Create Invoice
         # Menggunakan tariff.model_dump() untuk memastikan kompatibilitas JSON
         invoice = models.Invoice(
             session_id=db_session.session_id,
@@ -174,32 +479,303 @@ def execute_stop_session_transaction(
             date_time=details["end_time"]
         )
         s.add(invoice)
+        try:
+            s.flush()
+        except IntegrityError:
+            # Invoice.session_id is UNIQUE: another stop already billed this session
+            s.rollback()
+            raise ValueError("Session sudah berakhir")
 
-        s.commit()
-        s.refresh(db_session)
+        if db is None:
+            s.commit()
+            s.refresh(db_session)
         return db_session
 
 
+# ==========================================
+# TELEMETRY (Meter Values)
+# ==========================================
+
+@reads
+def get_latest_meter_batch(session_id: int, db: Optional[Session] = None) -> Optional[models.MeterBatch]:
+    with _session_scope(db) as s:
+        statement = (
+            select(models.MeterBatch)
+            .where(models.MeterBatch.session_id == session_id)
+            .order_by(models.MeterBatch.seq.desc())
+            .limit(1)
+        )
+        return s.exec(statement).first()
+
+@writes
+def append_meter_batch(batch: models.MeterBatch, db: Optional[Session] = None) -> models.MeterBatch:
+    """
+    Stores one batch and moves the session's running total in the same
+    transaction. Fails when the session is no longer ONGOING or another
+    batch with the same seq won the race.
+    """
+    with _session_scope(db) as s:
+        result = s.exec(
+            update(models.ChargingSession)
+            .where(
+                models.ChargingSession.session_id == batch.session_id,
+                models.ChargingSession.charging_status == models.ChargingStatus.ONGOING
+            )
+            .values(metered_kwh=batch.total_kwh, updated_at=datetime.utcnow())
+        )
+        if result.rowcount != 1:
+            raise ValueError("Session tidak ditemukan atau sudah berakhir")
+
+        s.add(batch)
+        try:
+            s.flush()
+        except IntegrityError:
+            s.rollback()
+            raise ValueError("Batch meter values bentrok dengan batch lain, kirim ulang")
+
+        if db is None:
+            s.commit()
+        return batch
+
+
+@writes
+def create_telemetry_chunks(chunks: List[models.TelemetryChunk], db: Optional[Session] = None) -> List[models.TelemetryChunk]:
+    with _session_scope(db) as s:
+        s.add_all(chunks)
+        if db is None:
+            s.commit()
+        else:
+            s.flush()
+        return chunks
+
+@reads
+def get_telemetry_chunks(
+    session_id: int,
+    resolution: int,
+    start_ts: Optional[float] = None,
+    end_ts: Optional[float] = None,
+    db: Optional[Session] = None
+) -> List[models.TelemetryChunk]:
+    """Chunks of one resolution overlapping [start_ts, end_ts), oldest first."""
+    with _session_scope(db) as s:
+        statement = select(models.TelemetryChunk).where(
+            models.TelemetryChunk.session_id == session_id,
+            models.TelemetryChunk.resolution == resolution
+        )
+        if end_ts is not None:
+            statement = statement.where(models.TelemetryChunk.start_ts < end_ts)
+        if start_ts is not None:
+            statement = statement.where(models.TelemetryChunk.end_ts > start_ts)
+        statement = statement.order_by(models.TelemetryChunk.start_ts)
+        return s.exec(statement).all()
+
+def _telemetry_span_statement(session_id: int, resolution: int, start_ts: Optional[float], end_ts: Optional[float]):
+    # Same filter as get_telemetry_chunks, aggregated on the index instead of loading the blobs
+    statement = select(func.min(models.TelemetryChunk.start_ts), func.max(models.TelemetryChunk.end_ts)).where(
+        models.TelemetryChunk.session_id == session_id,
+        models.TelemetryChunk.resolution == resolution
+    )
+    if end_ts is not None:
+        statement = statement.where(models.TelemetryChunk.start_ts < end_ts)
+    if start_ts is not None:
+        statement = statement.where(models.TelemetryChunk.end_ts > start_ts)
+    return statement
+
+@reads
+def get_telemetry_span(
+    session_id: int,
+    resolution: int,
+    start_ts: Optional[float] = None,
+    end_ts: Optional[float] = None,
+    db: Optional[Session] = None
+) -> tuple:
+    """(earliest start_ts, latest end_ts) of the chunks get_telemetry_chunks would return; (None, None) if none."""
+    with _session_scope(db) as s:
+        return tuple(s.exec(_telemetry_span_statement(session_id, resolution, start_ts, end_ts)).one())
+
+@reads
+def get_session_telemetry_chunks(session_id: int, db: Optional[Session] = None) -> List[models.TelemetryChunk]:
+    """All chunks of a session, every resolution, by resolution then oldest first."""
+    with _session_scope(db) as s:
+        statement = (
+            select(models.TelemetryChunk)
+            .where(models.TelemetryChunk.session_id == session_id)
+            .order_by(models.TelemetryChunk.resolution, models.TelemetryChunk.start_ts)
+        )
+        return s.exec(statement).all()
+
+@writes
+def replace_telemetry_chunks(
+    session_id: int,
+    resolution: int,
+    chunks: List[models.TelemetryChunk],
+    db: Optional[Session] = None
+) -> List[models.TelemetryChunk]:
+    """Swaps all chunks of one resolution for `chunks` (compaction)."""
+    with _session_scope(db) as s:
+        s.exec(
+            delete(models.TelemetryChunk).where(
+                models.TelemetryChunk.session_id == session_id,
+                models.TelemetryChunk.resolution == resolution
+            )
+        )
+        s.add_all(chunks)
+        if db is None:
+            s.commit()
+        else:
+            s.flush()
+        return chunks
+
+
 # ==========================================
 # BILLING CONTEXT (Invoices)
 # ==========================================
 
-def create_invoice(invoice: models.Invoice) -> models.Invoice:
-    return _save(invoice)
+# === Tariffs ===
+
+@writes
+def create_tariff_plan(plan: models.TariffPlan, db: Optional[Session] = None) -> models.TariffPlan:
+    return _save(plan, db)
+
+@writes
+def update_tariff_plan(plan: models.TariffPlan, db: Optional[Session] = None) -> models.TariffPlan:
+    return _save(plan, db)
+
+@reads
+def get_tariff_plan(tariff_id: int, db: Optional[Session] = None) -> Optional[models.TariffPlan]:
+    with _session_scope(db) as s:
+        return s.get(models.TariffPlan, tariff_id, options=[selectinload(models.TariffPlan.bands)])
+
+@reads
+def list_tariff_plans(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[Session] = None) -> Page:
+    with _session_scope(db) as s:
+        statement = select(models.TariffPlan).options(selectinload(models.TariffPlan.bands))
+        return _paginate(s, statement, models.TariffPlan.tariff_id, limit, cursor)
+
+@reads
+def get_tariff_catalog(db: Optional[Session] = None) -> TariffCatalog:
+    """Everything the TariffBook compiles from: active plans with bands, station operators."""
+    with _session_scope(db) as s:
+        plans = (
+            select(models.TariffPlan)
+            .where(models.TariffPlan.is_active == True)
+            .options(selectinload(models.TariffPlan.bands))
+        )
+        operators = select(models.Station.station_id, models.Station.station_operator)
+        return TariffCatalog(s.exec(plans).all(), s.exec(operators).all())
 
-def get_invoice(invoice_id: int) -> Optional[models.Invoice]:
-    with get_db_session() as s:
+
+@writes
+def create_invoice(invoice: models.Invoice, db: Optional[Session] = None) -> models.Invoice:
+    return _save(invoice, db)
+
+@reads
+def get_invoice(invoice_id: int, db: Optional[Session] = None) -> Optional[models.Invoice]:
+    with _session_scope(db) as s:
         return s.get(models.Invoice, invoice_id)
 
-def update_invoice(invoice: models.Invoice) -> models.Invoice:
-    return _save(invoice)
+@writes
+def update_invoice(invoice: models.Invoice, db: Optional[Session] = None) -> models.Invoice:
+    return _save(invoice, db)
 
-def get_invoices_by_user(user_id: int) -> List[models.Invoice]:
-    with get_db_session() as s:
+@reads
+def get_invoices_by_user(user_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[int] = None, db: Optional[Session] = None) -> Page:
+    with _session_scope(db) as s:
+        # Newest first; invoice_id grows with date_time
         statement = select(models.Invoice).where(models.Invoice.user_id == user_id)
-        return s.exec(statement).all()
+        return _paginate(s, statement, models.Invoice.invoice_id, limit, cursor, descending=True)
+
+@reads
+def get_invoices_version(user_id: int, db: Optional[Session] = None) -> RowVersion:
+    with _session_scope(db) as s:
+        statement = _version_statement(
+            models.Invoice.invoice_id, models.Invoice.updated_at,
+            models.Invoice.date_time, models.Invoice.user_id == user_id
+        )
+        return RowVersion(*s.exec(statement).one())
 
-def get_invoice_by_session(session_id: int) -> Optional[models.Invoice]:
-    with get_db_session() as s:
+@reads
+def get_invoice_by_session(session_id: int, db: Optional[Session] = None) -> Optional[models.Invoice]:
+    with _session_scope(db) as s:
         statement = select(models.Invoice).where(models.Invoice.session_id == session_id)
-        return s.exec(statement).first()
\ No newline at end of file
+        return s.exec(statement).first()
+
+# === Re-billing (app.rebilling) ===
+
+class BilledSessionRow(NamedTuple):
+    session_id: int
+    asset_id: int
+    start_time: datetime
+    end_time: datetime
+    total_kwh: float
+    invoice_id: int
+    cost_total: float
+    billing_total: float
+
+@reads
+def get_billed_sessions(
+    after_session_id: Optional[int],
+    limit: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    pending_only: bool = True,
+    db: Optional[Session] = None
+) -> List[BilledSessionRow]:
+    """
+    One keyset chunk of stopped sessions with their invoice totals, columns
+    only (no ORM objects), ordered by session_id. `since`/`until` filter on
+    the session's end time.
+    """
+    with _session_scope(db) as s:
+        statement = (
+            select(
+                models.ChargingSession.session_id,
+                models.ChargingSession.asset_id,
+                models.ChargingSession.start_time,
+                models.ChargingSession.end_time,
+                models.ChargingSession.total_kwh,
+                models.Invoice.invoice_id,
+                models.Invoice.cost_total,
+                models.Invoice.billing_total
+            )
+            .join(models.Invoice, models.Invoice.session_id == models.ChargingSession.session_id)
+            .where(models.ChargingSession.charging_status == models.ChargingStatus.STOPPED)
+        )
+        if after_session_id is not None:
+            statement = statement.where(models.ChargingSession.session_id > after_session_id)
+        if since is not None:
+            statement = statement.where(models.ChargingSession.end_time >= since)
+        if until is not None:
+            statement = statement.where(models.ChargingSession.end_time < until)
+        if pending_only:
+            statement = statement.where(models.Invoice.payment_status == models.PaymentStatus.PENDING)
+        statement = statement.order_by(models.ChargingSession.session_id).limit(limit)
+        return [BilledSessionRow(*row) for row in s.exec(statement).all()]
+
+@reads
+def get_asset_ratings(db: Optional[Session] = None) -> List[tuple]:
+    """(asset_id, station_id, connector_port) of every asset; small enough to keep in memory."""
+    with _session_scope(db) as s:
+        statement = select(
+            models.StationAsset.asset_id,
+            models.StationAsset.station_id,
+            models.StationAsset.connector_port
+        )
+        return s.exec(statement).all()
+
+@writes
+def update_invoice_totals(corrections: List[Dict[str, Any]], db: Optional[Session] = None) -> int:
+    """
+    Bulk UPDATE by primary key; every dict holds `invoice_id` and the
+    columns to set. One executemany round trip per call. Also moves
+    `updated_at`, which the ORM hook cannot do for bulk statements.
+    """
+    if not corrections:
+        return 0
+    now = datetime.utcnow()
+    with _session_scope(db) as s:
+        # ORM bulk UPDATE by primary key (executemany)
+        s.execute(update(models.Invoice), [{"updated_at": now, **c} for c in corrections])
+        if db is None:
+            s.commit()
+        return len(corrections)
@@ -1,8 +1,18 @@
 from pydantic import BaseModel, EmailStr, ConfigDict, Field, ValidationError, field_validator
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Generic, TypeVar
 from datetime import datetime
 from enum import Enum
 
+T = TypeVar("T")
+
+# ===== PAGINATION =====
+class Page(BaseModel, Generic[T]):
+    """Satu halaman hasil list (keyset pagination)"""
+    items: List[T]
+    next_cursor: Optional[int] = None  # kirim sebagai ?cursor= untuk halaman berikutnya; null = halaman terakhir
+
+    model_config = ConfigDict(from_attributes=True)
+
 # ===== SHARED / NESTED SCHEMAS =====
 class LocationBase(BaseModel):
     latitude: float
@@ -165,6 +175,34 @@ class StationDetail(StationRead):
             ],
         )
 
+class NearbyStation(StationRead):
+    distance_km: float
+    available_assets: int = 0
+
+    @classmethod
+    def from_orm_station(cls, station, distance_km: float, available_assets: int):
+        read = StationRead.model_validate(station)
+        return cls(**read.model_dump(), distance_km=distance_km, available_assets=available_assets)
+
+class StationAvailability(BaseModel):
+    station_id: int
+    connector: Optional[str] = None  # None = semua konektor
+    available: int
+    available_asset_ids: List[int]
+
+class BulkImportRowError(BaseModel):
+    line: int  # nomor baris di file upload (header CSV = baris 1)
+    message: str
+
+class BulkImportResult(BaseModel):
+    received: int
+    inserted: int
+    failed: int
+    inserted_ids: List[int] = []  # maksimal bulk_import.MAX_REPORTED_IDS pertama; jumlah lengkap di `inserted`
+    errors: List[BulkImportRowError] = []  # maksimal bulk_import.MAX_REPORTED_ERRORS
+    elapsed_seconds: float
+    rows_per_second: float
+
 # ===== CHARGING SESSION SCHEMAS =====
 class ChargingSessionStart(BaseModel):
     asset_id: int
@@ -185,6 +223,40 @@ class ChargingSessionRead(BaseModel):
 class TariffRead(BaseModel):
     cost_per_kwh: float
     cost_per_minute: float
+    tariff_id: Optional[int] = None
+    name: Optional[str] = None
+    admin_fee: Optional[float] = None
+    idle_fee_per_minute: Optional[float] = None
+    idle_grace_minutes: Optional[float] = None
+    tax_rate: Optional[float] = None
+    utc_offset_minutes: Optional[int] = None
+    time_of_use: List[dict] = Field(default_factory=list)
+
+class TariffBandBase(BaseModel):
+    start_minute: int = Field(ge=0, lt=1440, description="Menit sejak 00:00 waktu lokal")
+    end_minute: int = Field(ge=0, le=1440, description="Eksklusif; lebih kecil dari start = melewati tengah malam")
+    cost_per_kwh: float = Field(ge=0)
+    cost_per_minute: float = Field(ge=0)
+    model_config = ConfigDict(from_attributes=True)
+
+class TariffPlanCreate(BaseModel):
+    name: str
+    station_id: Optional[int] = None
+    station_operator: Optional[str] = None
+    cost_per_kwh: float = Field(ge=0)
+    cost_per_minute: float = Field(ge=0)
+    admin_fee: float = Field(0.0, ge=0)
+    idle_fee_per_minute: float = Field(0.0, ge=0)
+    idle_grace_minutes: float = Field(0.0, ge=0)
+    tax_rate: float = Field(0.0, ge=0, le=1)
+    utc_offset_minutes: int = Field(420, ge=-720, le=840)
+    bands: List[TariffBandBase] = Field(default_factory=list)
+
+class TariffPlanRead(TariffPlanCreate):
+    tariff_id: int
+    is_active: bool
+    created_at: datetime
+    model_config = ConfigDict(from_attributes=True)
 
 class InvoiceRead(BaseModel):
     invoice_id: int
@@ -212,6 +284,24 @@ class InvoiceUpdatePayment(BaseModel):
     payment_status: str
     payment_method: str
 
+class MeterIngestResult(BaseModel):
+    session_id: int
+    accepted: int
+    ignored: int  # duplikat / timestamp tidak maju
+    metered_kwh: Optional[float] = None
+
+class PowerCurvePoint(BaseModel):
+    timestamp: float  # epoch detik, awal bucket
+    avg_kw: Optional[float] = None
+    min_kw: Optional[float] = None
+    max_kw: Optional[float] = None
+    energy_wh: Optional[float] = None  # nilai register terakhir di bucket
+
+class PowerCurve(BaseModel):
+    session_id: int
+    resolution: str
+    points: List[PowerCurvePoint]
+
 # ===== COMPOSITE DETAIL SCHEMAS =====
 class ChargingSessionDetail(ChargingSessionRead):
     user: Optional[UserRead] = None
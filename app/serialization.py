@@ -0,0 +1,121 @@
+"""
+Fast JSON bodies for the large list endpoints.
+
+Two modes, chosen with SERIALIZATION_MODE:
+
+    validated   each row goes through its response schema (from_attributes),
+                using a TypeAdapter compiled once at import; the body is
+                written by pydantic-core. Same output as response_model.
+    trusted     (default) rows are turned into plain dicts by the encoders
+                below and written with orjson. Nothing is re-validated:
+                every row was validated by its create schema on the way in
+                (POST handlers, bulk import). The encoders keep the
+                fallbacks of the schemas' `safe_*` validators for rows that
+                predate them, so both modes give the same JSON.
+
+Handlers return the bytes in a Response, which also skips FastAPI's own
+response_model pass; response_model stays on the route for the OpenAPI
+schema.
+"""
+import os
+from typing import Any, Callable, Dict, Optional, Type
+
+import orjson
+from pydantic import BaseModel, TypeAdapter
+
+from app import profiling, schemas
+from app.repository import Page
+
+VALIDATED = "validated"
+TRUSTED = "trusted"
+
+SERIALIZATION_MODE = os.getenv("SERIALIZATION_MODE", TRUSTED)
+
+_MISSING_LOCATION = {"latitude": 0.0, "longitude": 0.0, "address": "Unknown"}
+_TARIFF_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in schemas.TariffRead.model_fields.items()
+}
+
+def _plain(v):
+    # JSON columns hold dicts once loaded, the pydantic object until then
+    return v.model_dump() if isinstance(v, BaseModel) else v
+
+def _location(v) -> dict:
+    # StationRead.safe_location
+    v = _plain(v)
+    if not v:
+        return dict(_MISSING_LOCATION)
+    if "latitude" not in v:
+        v = {**v, **_MISSING_LOCATION}
+    return {"latitude": float(v["latitude"]), "longitude": float(v["longitude"]), "address": v["address"]}
+
+def _tariff(v) -> dict:
+    # InvoiceRead.safe_tariff
+    v = _plain(v)
+    if not v:
+        v = {"cost_per_kwh": 0.0, "cost_per_minute": 0.0}
+    elif "cost_per_kwh" not in v:
+        v = {**v, "cost_per_kwh": 0.0, "cost_per_minute": 0.0}
+    out = {name: v.get(name, default) for name, default in _TARIFF_DEFAULTS.items()}
+    for name in ("cost_per_kwh", "cost_per_minute", "admin_fee", "idle_fee_per_minute", "idle_grace_minutes", "tax_rate"):
+        if out[name] is not None:
+            out[name] = float(out[name])
+    if out["utc_offset_minutes"] is not None:
+        out["utc_offset_minutes"] = int(out["utc_offset_minutes"])
+    return out
+
+def _station(s) -> dict:
+    return {
+        "station_operator": s.station_operator,
+        "location": _location(s.location),
+        "connector_list": s.connector_list,
+        "station_id": s.station_id,
+        "created_at": s.created_at
+    }
+
+def _charging_session(s) -> dict:
+    return {
+        "session_id": s.session_id,
+        "user_id": s.user_id,
+        "asset_id": s.asset_id,
+        "start_time": s.start_time,
+        "end_time": s.end_time,
+        "duration": s.duration,
+        "total_kwh": s.total_kwh,
+        "charging_status": s.charging_status
+    }
+
+def _invoice(i) -> dict:
+    return {
+        "invoice_id": i.invoice_id,
+        "session_id": i.session_id,
+        "cost_total": i.cost_total,
+        "billing_total": i.billing_total,
+        "payment_status": i.payment_status,
+        "payment_method": i.payment_method,
+        "date_time": i.date_time,
+        "tariff": _tariff(i.tariff)
+    }
+
+# Response schema -> trusted row encoder
+ENCODERS: Dict[Type[BaseModel], Callable[[Any], dict]] = {
+    schemas.StationRead: _station,
+    schemas.ChargingSessionRead: _charging_session,
+    schemas.InvoiceRead: _invoice,
+}
+
+# Compiled once; building a TypeAdapter per request costs more than validating a page
+PAGE_ADAPTERS: Dict[Type[BaseModel], TypeAdapter] = {
+    schema: TypeAdapter(schemas.Page[schema]) for schema in ENCODERS
+}
+
+def page_json(schema: Type[BaseModel], page: Page, mode: Optional[str] = None) -> bytes:
+    """JSON body of a schemas.Page[schema] built from a repository Page of ORM rows."""
+    with profiling.span("serialize"):
+        if (mode or SERIALIZATION_MODE) == VALIDATED:
+            adapter = PAGE_ADAPTERS[schema]
+            validated = adapter.validate_python({"items": page.items, "next_cursor": page.next_cursor}, from_attributes=True)
+            return adapter.dump_json(validated)
+        encode = ENCODERS[schema]
+        return orjson.dumps({"items": [encode(row) for row in page.items], "next_cursor": page.next_cursor})
@@ -1,54 +1,101 @@
 from datetime import datetime
-from typing import Optional, Union, Dict, Any
-from app import repository, models
-from app.schemas import StationDetail
-
-# Default Tariff Configuration
-DEFAULT_TARIFF = models.Tariff(
-    cost_per_kwh=2500.0,
-    cost_per_minute=100.0
-)
-
-def get_station_details(station_id: int) -> StationDetail:
-    station = repository.get_station(station_id)
+from typing import Optional, Union, Dict, Any, List
+from sqlmodel import Session
+from app import repository, models, geo, telemetry, tariffs, availability
+from app.db import on_primary
+from app.schemas import StationDetail, NearbyStation, MeterIngestResult, PowerCurve, PowerCurvePoint, TariffPlanCreate
+
+# Default Tariff Configuration (dipakai jika tidak ada TariffPlan yang berlaku)
+DEFAULT_TARIFF = tariffs.DEFAULT_TARIFF
+
+def get_station_details(station_id: int, db: Optional[Session] = None) -> StationDetail:
+    station = repository.get_station_detail(station_id, db=db)
     if not station:
         raise ValueError("Station tidak ditemukan")
 
-    assets = repository.get_station_assets_by_station(station_id)
-    return StationDetail.from_orm_station(station, assets)
+    return StationDetail.from_orm_station(station, station.station_assets)
+
+def find_nearby_stations(
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    connector: Optional[str] = None,
+    available_only: bool = False,
+    limit: int = 20,
+    db: Optional[Session] = None
+) -> List[NearbyStation]:
+    """Stasiun dalam radius, terdekat dulu, dengan jumlah charger yang sedang tersedia."""
+    geo.station_index.ensure_loaded(db)
+    availability.asset_index.ensure_loaded(db)
+    candidates = geo.station_index.nearby(latitude, longitude, radius_km, connector)
+
+    results: List[NearbyStation] = []
+    # Candidates are already distance-ordered; only look up as many as needed
+    chunk = limit if not available_only else max(limit * 2, 50)
+    for start in range(0, len(candidates), chunk):
+        batch = candidates[start:start + chunk]
+        ids = [station_id for station_id, _ in batch]
+        stations = {st.station_id: st for st in repository.get_stations_by_ids(ids, db=db)}
+
+        available = availability.asset_index.counts(ids, connector)
 
-def start_charging_session(user_id: int, asset_id: int) -> models.ChargingSession:
+        for station_id, distance in batch:
+            station = stations.get(station_id)
+            if station is None or (available_only and not available.get(station_id)):
+                continue
+            results.append(NearbyStation.from_orm_station(
+                station, distance_km=round(distance, 3), available_assets=available.get(station_id, 0)
+            ))
+            if len(results) == limit:
+                return results
+    return results
+
+def list_available_station_assets(
+    station_id: Optional[int] = None,
+    limit: int = repository.DEFAULT_PAGE_SIZE,
+    cursor: Optional[int] = None,
+    db: Optional[Session] = None
+) -> repository.Page:
+    """Halaman asset yang tersedia: filter dan paging dari availability index, hanya baris halaman itu dibaca (primary key)."""
+    availability.asset_index.ensure_loaded(db)
+    ids = availability.asset_index.free_ids(station_id or None, after=cursor, limit=limit + 1)
+    page_ids = ids[:limit]
+    return repository.Page(
+        repository.get_station_assets_by_ids(page_ids, db=db),
+        page_ids[-1] if len(ids) > limit else None
+    )
+
+def start_charging_session(user_id: int, asset_id: int, db: Optional[Session] = None) -> models.ChargingSession:
     # 1. Validate User
-    user = repository.get_user(user_id)
+    user = repository.get_user(user_id, db=db)
     if not user:
         raise ValueError("User tidak ditemukan")
-    
-    # 2. Check for existing active session
-    active_session = repository.get_active_session_by_user(user_id)
-    if active_session:
-        raise ValueError("Anda masih memiliki sesi charging yang aktif")
-
-    # 3. Validate Station Asset
-    asset = repository.get_station_asset(asset_id)
-    if not asset:
-        raise ValueError("Station Asset tidak ditemukan")
-    if not asset.is_available:
-        raise ValueError("Charger sedang tidak tersedia (Sedang digunakan atau Maintenance)")
-
-    # 4. Lock Asset
-    asset.is_available = False
-    repository.update_station_asset(asset)
 
-    # 5. Create Session
-    session = models.ChargingSession(
+    # 2-4. Reserve Asset + Create Session atomically.
+    # Availability is checked by the conditional UPDATE itself and "one active
+    # session per user" by a unique index, so no separate read can go stale.
+    return repository.execute_start_session_transaction(
         user_id=user_id,
         asset_id=asset_id,
         start_time=datetime.utcnow(),
-        charging_status=models.ChargingStatus.ONGOING
+        db=db
     )
-    return repository.create_charging_session(session)
 
-def _calculate_session_details(session: models.ChargingSession, asset: models.StationAsset, manual_kwh: Optional[float] = None) -> Dict[str, Any]:
+def resolve_tariff(station_id: Optional[int], db: Optional[Session] = None) -> tariffs.CompiledTariff:
+    """Tarif yang berlaku untuk stasiun; query hanya saat TariffBook perlu di-compile ulang."""
+    book = tariffs.tariff_book
+    if not book.loaded:
+        epoch = book.epoch
+        with on_primary():  # shared by all requests: never compile a lagging replica's plans
+            book.load(repository.get_tariff_catalog(db=db), epoch)
+    return book.resolve(station_id)
+
+def _calculate_session_details(
+    session: models.ChargingSession,
+    asset: models.StationAsset,
+    manual_kwh: Optional[float] = None,
+    tariff: Optional[tariffs.CompiledTariff] = None
+) -> Dict[str, Any]:
     # 1. Get Session
     if not session:
         raise ValueError("Session tidak ditemukan")
@@ -62,23 +109,19 @@ def _calculate_session_details(session: models.ChargingSession, asset: models.St
     duration_hours = duration_seconds / 3600.0
 
     # Refactored: Power is taken directly from the asset model
-    # FIX: Handle connector_port whether it's an Object or a Dict (JSON from DB)
-    max_kw = 7.0
-    if asset and asset.connector_port:
-        cp = asset.connector_port
-        if isinstance(cp, dict):
-            max_kw = cp.get("max_power_supported", 7.0)
-        elif hasattr(cp, "max_power_supported"):
-            max_kw = cp.max_power_supported
+    max_kw = tariffs.rated_power_kw(asset.connector_port if asset else None)
 
     if manual_kwh is not None:
         total_kwh = manual_kwh
+    elif session.metered_kwh is not None:
+        # Running total from ingested meter values (see ingest_meter_values)
+        total_kwh = session.metered_kwh
     else:
         # Simple simulation: Max Power * Duration
         total_kwh = round(max_kw * duration_hours, 3)
 
     # 4. Calculate Cost
-    cost_details = _calculate_billing(total_kwh, duration_minutes)
+    cost_details = _calculate_billing(total_kwh, duration_minutes, tariff, session.start_time, max_kw)
 
     return {
         "end_time": end_time,
@@ -87,43 +130,136 @@ def _calculate_session_details(session: models.ChargingSession, asset: models.St
         **cost_details
     }
 
-def _calculate_billing(kwh: float, minutes: float) -> Dict[str, Any]:
+def _calculate_billing(
+    kwh: float,
+    minutes: float,
+    tariff: Optional[tariffs.CompiledTariff] = None,
+    start_time: Optional[datetime] = None,
+    max_kw: Optional[float] = None
+) -> Dict[str, Any]:
     """Calculates cost and total billing from consumption metrics."""
-    cost_kwh = kwh * DEFAULT_TARIFF.cost_per_kwh
-    cost_time = minutes * DEFAULT_TARIFF.cost_per_minute
-    total_cost = cost_kwh + cost_time
-    
-    admin_fee = 2000.0 # Should be moved to a config file
-    billing_total = total_cost + admin_fee
-    
-    return {
-        "total_cost": total_cost,
-        "billing_total": billing_total
-    }
+    tariff = tariff or tariffs.tariff_book.default
+    return tariff.price(kwh, minutes, start_time, max_kw)
 
-def stop_charging_session(session_id: int, manual_kwh: Optional[float] = None) -> models.ChargingSession:
+def stop_charging_session(session_id: int, manual_kwh: Optional[float] = None, db: Optional[Session] = None) -> models.ChargingSession:
     """Stops a charging session and generates an invoice in a single transaction."""
-    session = repository.get_charging_session(session_id)
+    session = repository.get_charging_session(session_id, db=db)
     if not session or session.charging_status != models.ChargingStatus.ONGOING:
         raise ValueError("Session tidak ditemukan atau sudah berakhir")
 
-    asset = repository.get_station_asset(session.asset_id)
+    asset = repository.get_station_asset(session.asset_id, db=db)
     if asset:
         # Calculate details before entering the transaction
-        details = _calculate_session_details(session, asset, manual_kwh)
+        tariff = resolve_tariff(asset.station_id, db=db)
+        details = _calculate_session_details(session, asset, manual_kwh, tariff)
 
         # Use a transactional function from the repository
-        return repository.execute_stop_session_transaction(
+        stopped = repository.execute_stop_session_transaction(
             session=session,
             asset=asset,
             details=details,
-            tariff=DEFAULT_TARIFF
-        )
+            tariff=tariff.snapshot()
+        , db=db)
+        if session.metered_kwh is not None:
+            # Only sessions that received meter values have chunks to compact
+            compact_telemetry(session_id, db=db)
+        return stopped
     else:
         raise ValueError("Asset terkait sesi ini tidak ditemukan.")
 
-def add_maintenance_log(asset_id: int, error_log: str) -> models.StationAsset:
-    asset = repository.get_station_asset(asset_id)
+def ingest_meter_values(
+    session_id: int,
+    user_id: int,
+    readings: List[telemetry.MeterReading],
+    db: Optional[Session] = None
+) -> MeterIngestResult:
+    """Fold satu batch meter values ke total energi sesi yang sedang berjalan."""
+    _check_meter_session(repository.get_charging_session(session_id, db=db), user_id)
+
+    state = telemetry.state_from_batch(repository.get_latest_meter_batch(session_id, db=db))
+    new_state, accepted = telemetry.fold(state, readings)
+    if accepted:
+        repository.append_meter_batch(telemetry.batch_from_state(session_id, new_state, accepted), db=db)
+        repository.create_telemetry_chunks(telemetry.rollup_chunks(session_id, state, accepted), db=db)
+    return _ingest_result(session_id, readings, new_state, accepted)
+
+# Pure steps shared with app/async_service.py
+def _check_meter_session(session: Optional[models.ChargingSession], user_id: int):
+    if not session or session.user_id != user_id:
+        raise ValueError("Session tidak ditemukan")
+    if session.charging_status != models.ChargingStatus.ONGOING:
+        raise ValueError("Session sudah berakhir")
+
+def _ingest_result(session_id: int, readings: List[telemetry.MeterReading], new_state, accepted) -> MeterIngestResult:
+    return MeterIngestResult(
+        session_id=session_id,
+        accepted=len(accepted),
+        ignored=len(readings) - len(accepted),
+        metered_kwh=new_state.total_kwh if new_state.seq else None
+    )
+
+def get_power_curve(
+    session_id: int,
+    user_id: int,
+    resolution: str = "1m",
+    start_ts: Optional[float] = None,
+    end_ts: Optional[float] = None,
+    db: Optional[Session] = None
+) -> PowerCurve:
+    """Kurva daya sesi pada resolusi 1s / 1m / 15m, dalam rentang [start_ts, end_ts)."""
+    seconds = _curve_resolution(resolution, start_ts, end_ts)
+
+    session = repository.get_charging_session(session_id, db=db)
+    if not session or session.user_id != user_id:
+        raise ValueError("Session tidak ditemukan")
+
+    if start_ts is None or end_ts is None:
+        # Open-ended range: bound it by the stored chunks before loading them
+        _check_curve_span(seconds, start_ts, end_ts, repository.get_telemetry_span(session_id, seconds, start_ts, end_ts, db=db))
+    chunks = repository.get_telemetry_chunks(session_id, seconds, start_ts, end_ts, db=db)
+    return _power_curve(session_id, resolution, chunks, start_ts, end_ts)
+
+def _curve_resolution(resolution: str, start_ts: Optional[float], end_ts: Optional[float]) -> int:
+    seconds = telemetry.RESOLUTIONS.get(resolution)
+    if seconds is None:
+        raise ValueError(f"Resolusi harus salah satu dari: {', '.join(telemetry.RESOLUTIONS)}")
+    if start_ts is not None and end_ts is not None and (end_ts - start_ts) / seconds > telemetry.MAX_CURVE_POINTS:
+        raise ValueError("Rentang terlalu besar untuk resolusi ini, gunakan resolusi yang lebih kasar")
+    return seconds
+
+def _check_curve_span(seconds: int, start_ts: Optional[float], end_ts: Optional[float], span: tuple):
+    first, last = span
+    if first is None:
+        return
+    start = first if start_ts is None else max(first, start_ts)
+    end = last if end_ts is None else min(last, end_ts)
+    if (end - start) / seconds > telemetry.MAX_CURVE_POINTS:
+        raise ValueError("Rentang terlalu besar untuk resolusi ini, gunakan resolusi yang lebih kasar")
+
+def _power_curve(session_id: int, resolution: str, chunks, start_ts: Optional[float], end_ts: Optional[float]) -> PowerCurve:
+    buckets = telemetry.query_buckets(chunks, start_ts, end_ts)
+    if len(buckets) > telemetry.MAX_CURVE_POINTS:
+        raise ValueError("Rentang terlalu besar untuk resolusi ini, gunakan resolusi yang lebih kasar")
+    return PowerCurve(
+        session_id=session_id,
+        resolution=resolution,
+        points=[
+            PowerCurvePoint(timestamp=b.start, avg_kw=b.avg_kw, min_kw=b.power_min, max_kw=b.power_max, energy_wh=b.energy_wh)
+            for b in buckets
+        ]
+    )
+
+def compact_telemetry(session_id: int, db: Optional[Session] = None):
+    """Gabungkan chunk per-batch menjadi chunk per jendela waktu (dipanggil saat sesi selesai)."""
+    by_resolution: Dict[int, List[models.TelemetryChunk]] = {}
+    for chunk in repository.get_session_telemetry_chunks(session_id, db=db):
+        by_resolution.setdefault(chunk.resolution, []).append(chunk)
+    for seconds, chunks in by_resolution.items():
+        if len(chunks) > 1:
+            repository.replace_telemetry_chunks(session_id, seconds, telemetry.compact(session_id, seconds, chunks), db=db)
+
+def add_maintenance_log(asset_id: int, error_log: str, db: Optional[Session] = None) -> models.StationAsset:
+    asset = repository.get_station_asset(asset_id, db=db)
     if not asset:
         raise ValueError("Asset tidak ditemukan")
 
@@ -137,10 +273,10 @@ def add_maintenance_log(asset_id: int, error_log: str) -> models.StationAsset:
     asset.maintenance_log = log
     asset.is_available = False # Force unavailable
     
-    return repository.update_station_asset(asset)
+    return repository.update_station_asset(asset, db=db)
 
-def update_invoice_payment(invoice_id: int, status: str, method: str) -> models.Invoice:
-    invoice = repository.get_invoice(invoice_id)
+def update_invoice_payment(invoice_id: int, status: str, method: str, db: Optional[Session] = None) -> models.Invoice:
+    invoice = repository.get_invoice(invoice_id, db=db)
     if not invoice:
         raise ValueError("Invoice tidak ditemukan")
     
@@ -153,20 +289,34 @@ def update_invoice_payment(invoice_id: int, status: str, method: str) -> models.
     invoice.payment_status = new_status
     invoice.payment_method = method
     
-    return repository.update_invoice(invoice)
+    return repository.update_invoice(invoice, db=db)
 
-def get_charging_session_details(session_id: int):
-    session = repository.get_charging_session(session_id)
+def get_charging_session_details(session_id: int, user_id: Optional[int] = None, db: Optional[Session] = None) -> models.ChargingSession:
+    """Session beserta user, station asset, dan invoice (satu query). `user_id` membatasi ke pemilik sesi."""
+    session = repository.get_charging_session_detail(session_id, user_id=user_id, db=db)
     if not session:
         raise ValueError("Session tidak ditemukan")
+    return session
 
-    user = repository.get_user(session.user_id)
-    asset = repository.get_station_asset(session.asset_id)
-    invoice = repository.get_invoice_by_session(session_id)
+def create_tariff_plan(data: TariffPlanCreate, db: Optional[Session] = None) -> models.TariffPlan:
+    """Buat TariffPlan beserta band time-of-use; band divalidasi dengan meng-compile tarifnya."""
+    if data.station_id is not None and data.station_operator:
+        raise ValueError("Pilih salah satu: station_id atau station_operator")
+    if data.station_id is not None and not repository.get_station(data.station_id, db=db):
+        raise ValueError("Station tidak ditemukan")
 
-    return {
-        **session.__dict__,
-        "user": user,
-        "station_asset": asset,
-        "invoice": invoice
-    }
\ No newline at end of file
+    tariffs.CompiledTariff(
+        data.cost_per_kwh, data.cost_per_minute,
+        bands=[(b.start_minute, b.end_minute, b.cost_per_kwh, b.cost_per_minute) for b in data.bands]
+    )
+
+    plan = models.TariffPlan(**data.model_dump(exclude={"bands"}))
+    plan.bands = [models.TariffBand(**band.model_dump()) for band in data.bands]
+    return repository.create_tariff_plan(plan, db=db)
+
+def deactivate_tariff_plan(tariff_id: int, db: Optional[Session] = None) -> models.TariffPlan:
+    plan = repository.get_tariff_plan(tariff_id, db=db)
+    if not plan:
+        raise ValueError("Tariff tidak ditemukan")
+    plan.is_active = False
+    return repository.update_tariff_plan(plan, db=db)
@@ -0,0 +1,258 @@
+"""
+Tariff engine: per-station / per-operator tariffs with time-of-use bands,
+idle fees and tax, compiled into an in-memory TariffBook.
+
+Resolution order for a station: active plan of the station, then of its
+operator, then the global plan (no station, no operator), then the built-in
+DEFAULT_TARIFF. The book is compiled once from the tariff tables and is
+marked stale by app.events whenever a tariff row changes, so pricing a
+stopped session needs no queries while the book is warm.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app import events, models
+
+MINUTES_PER_DAY = 24 * 60
+DEFAULT_ADMIN_FEE = 2000.0
+
+DEFAULT_POWER_KW = 7.0
+
+def rated_power_kw(connector_port) -> float:
+    """Rated power of a charger; connector_port is a ConnectorPort or its JSON dict from the DB."""
+    if isinstance(connector_port, dict):
+        return connector_port.get("max_power_supported", DEFAULT_POWER_KW)
+    if connector_port is not None and hasattr(connector_port, "max_power_supported"):
+        return connector_port.max_power_supported
+    return DEFAULT_POWER_KW
+
+class Segment(NamedTuple):
+    start_minute: int   # local minute of day, inclusive
+    end_minute: int     # exclusive
+    cost_per_kwh: float
+    cost_per_minute: float
+
+class CompiledTariff:
+    """A tariff plan flattened into day segments that cover 00:00-24:00 without gaps."""
+    def __init__(
+        self,
+        cost_per_kwh: float,
+        cost_per_minute: float,
+        admin_fee: float = 0.0,
+        idle_fee_per_minute: float = 0.0,
+        idle_grace_minutes: float = 0.0,
+        tax_rate: float = 0.0,
+        utc_offset_minutes: int = 0,
+        bands: List[Tuple[int, int, float, float]] = (),
+        tariff_id: Optional[int] = None,
+        name: Optional[str] = None
+    ):
+        self.cost_per_kwh = cost_per_kwh
+        self.cost_per_minute = cost_per_minute
+        self.admin_fee = admin_fee
+        self.idle_fee_per_minute = idle_fee_per_minute
+        self.idle_grace_minutes = idle_grace_minutes
+        self.tax_rate = tax_rate
+        self.utc_offset_minutes = utc_offset_minutes
+        self.tariff_id = tariff_id
+        self.name = name
+        self.bands = list(bands)
+        self.segments = self._segments(self.bands)
+
+    def _segments(self, bands) -> List[Segment]:
+        # Split midnight-crossing bands, then fill the gaps with the base rate
+        pieces = []
+        for start, end, kwh_rate, minute_rate in bands:
+            if start == end:
+                # Would otherwise read as a 24-hour band crossing midnight
+                raise ValueError("Band time-of-use tidak boleh kosong (start_minute sama dengan end_minute)")
+            if start < end:
+                pieces.append(Segment(start, end, kwh_rate, minute_rate))
+            else:
+                pieces.append(Segment(start, MINUTES_PER_DAY, kwh_rate, minute_rate))
+                if end > 0:
+                    pieces.append(Segment(0, end, kwh_rate, minute_rate))
+        pieces.sort()
+
+        segments, cursor = [], 0
+        for piece in pieces:
+            if piece.start_minute < cursor:
+                raise ValueError("Band time-of-use tidak boleh tumpang tindih")
+            if piece.start_minute > cursor:
+                segments.append(Segment(cursor, piece.start_minute, self.cost_per_kwh, self.cost_per_minute))
+            segments.append(piece)
+            cursor = piece.end_minute
+        if cursor < MINUTES_PER_DAY:
+            segments.append(Segment(cursor, MINUTES_PER_DAY, self.cost_per_kwh, self.cost_per_minute))
+        return segments
+
+    @classmethod
+    def from_plan(cls, plan: models.TariffPlan, bands: List[models.TariffBand]) -> "CompiledTariff":
+        return cls(
+            cost_per_kwh=plan.cost_per_kwh,
+            cost_per_minute=plan.cost_per_minute,
+            admin_fee=plan.admin_fee,
+            idle_fee_per_minute=plan.idle_fee_per_minute,
+            idle_grace_minutes=plan.idle_grace_minutes,
+            tax_rate=plan.tax_rate,
+            utc_offset_minutes=plan.utc_offset_minutes,
+            bands=[(b.start_minute, b.end_minute, b.cost_per_kwh, b.cost_per_minute) for b in bands],
+            tariff_id=plan.tariff_id,
+            name=plan.name
+        )
+
+    def time_split(self, start_time: Optional[datetime], minutes: float) -> List[Tuple[Segment, float]]:
+        """(segment, minutes spent in it) for a session starting at `start_time` (UTC)."""
+        if start_time is None or not self.bands or minutes <= 0:
+            return [(self._flat(), max(minutes, 0.0))]
+
+        local = start_time + timedelta(minutes=self.utc_offset_minutes)
+        minute_of_day = local.hour * 60 + local.minute + local.second / 60.0 + local.microsecond / 60e6
+        remaining = minutes
+        split: Dict[Segment, float] = {}
+        while remaining > 1e-9:
+            segment = next(s for s in self.segments if s.start_minute <= minute_of_day < s.end_minute)
+            spent = min(remaining, segment.end_minute - minute_of_day)
+            split[segment] = split.get(segment, 0.0) + spent
+            remaining -= spent
+            minute_of_day = (minute_of_day + spent) % MINUTES_PER_DAY
+        return list(split.items())
+
+    def _flat(self) -> Segment:
+        return Segment(0, MINUTES_PER_DAY, self.cost_per_kwh, self.cost_per_minute)
+
+    def price(
+        self,
+        kwh: float,
+        minutes: float,
+        start_time: Optional[datetime] = None,
+        max_kw: Optional[float] = None
+    ) -> Dict[str, float]:
+        """
+        Cost lines of one session. Energy is spread over the time-of-use
+        segments in proportion to the time spent in each. Idle minutes are
+        the plugged-in minutes beyond what the delivered energy needed at
+        the charger's rated power, minus the grace period.
+        """
+        energy_cost = time_cost = 0.0
+        for segment, spent in self.time_split(start_time, minutes):
+            share = spent / minutes if minutes > 0 else 1.0
+            energy_cost += kwh * share * segment.cost_per_kwh
+            time_cost += spent * segment.cost_per_minute
+
+        idle_fee = 0.0
+        if self.idle_fee_per_minute and max_kw:
+            charging_minutes = kwh / max_kw * 60.0
+            idle_minutes = max(0.0, minutes - charging_minutes - self.idle_grace_minutes)
+            idle_fee = idle_minutes * self.idle_fee_per_minute
+
+        total_cost = energy_cost + time_cost + idle_fee
+        tax = (total_cost + self.admin_fee) * self.tax_rate
+        return {
+            "energy_cost": energy_cost,
+            "time_cost": time_cost,
+            "idle_fee": idle_fee,
+            "total_cost": total_cost,
+            "admin_fee": self.admin_fee,
+            "tax": tax,
+            "billing_total": total_cost + self.admin_fee + tax
+        }
+
+    def snapshot(self) -> models.Tariff:
+        """Tariff value object stored on the invoice."""
+        return models.Tariff(
+            cost_per_kwh=self.cost_per_kwh,
+            cost_per_minute=self.cost_per_minute,
+            tariff_id=self.tariff_id,
+            name=self.name,
+            admin_fee=self.admin_fee,
+            idle_fee_per_minute=self.idle_fee_per_minute,
+            idle_grace_minutes=self.idle_grace_minutes,
+            tax_rate=self.tax_rate,
+            utc_offset_minutes=self.utc_offset_minutes,
+            time_of_use=[
+                {"start_minute": s, "end_minute": e, "cost_per_kwh": k, "cost_per_minute": m}
+                for s, e, k, m in self.bands
+            ]
+        )
+
+class TariffCatalog(NamedTuple):
+    plans: List[models.TariffPlan]       # active plans, bands loaded
+    station_operators: List[Tuple[int, str]]
+
+class TariffBook:
+    """Compiled tariffs keyed by scope; lookups never touch the database."""
+    def __init__(self, default: CompiledTariff):
+        self.default = default
+        self._global: Optional[CompiledTariff] = None
+        self._by_station: Dict[int, CompiledTariff] = {}
+        self._by_operator: Dict[str, CompiledTariff] = {}
+        self._station_operator: Dict[int, str] = {}
+        self._loaded = False
+        # Bumped on every tariff or station change; a catalog read before the change is not trusted
+        self.epoch = 0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, catalog: TariffCatalog, epoch: Optional[int] = None):
+        """Compiles `catalog`; pass the `epoch` read before querying it to detect concurrent changes."""
+        by_station, by_operator, global_plan = {}, {}, None
+        # Later plans (higher id) win within the same scope
+        for plan in sorted(catalog.plans, key=lambda p: p.tariff_id or 0):
+            compiled = CompiledTariff.from_plan(plan, list(plan.bands or []))
+            if plan.station_id is not None:
+                by_station[plan.station_id] = compiled
+            elif plan.station_operator:
+                by_operator[plan.station_operator.lower()] = compiled
+            else:
+                global_plan = compiled
+        with self._lock:
+            self._by_station = by_station
+            self._by_operator = by_operator
+            self._global = global_plan
+            self._station_operator = {sid: op for sid, op in catalog.station_operators}
+            self._loaded = epoch is None or epoch == self.epoch
+
+    def resolve(self, station_id: Optional[int]) -> CompiledTariff:
+        with self._lock:
+            tariff = self._by_station.get(station_id)
+            if tariff is None:
+                operator = self._station_operator.get(station_id)
+                if operator:
+                    tariff = self._by_operator.get(operator.lower())
+            return tariff or self._global or self.default
+
+    def apply(self, changes: List[events.Change]):
+        with self._lock:
+            for change in changes:
+                if change.entity in ("tariff_plan", "tariff_band"):
+                    self.epoch += 1
+                    self._loaded = False
+                elif change.entity == "station":
+                    # A load() querying right now may have missed this station's operator
+                    self.epoch += 1
+                    if not self._loaded:
+                        continue
+                    if change.op == "delete":
+                        self._station_operator.pop(change.key, None)
+                    elif "station_operator" in change.data:
+                        self._station_operator[change.key] = change.data["station_operator"]
+
+    def clear(self):
+        with self._lock:
+            self._by_station, self._by_operator, self._global = {}, {}, None
+            self._station_operator = {}
+            self._loaded = False
+
+DEFAULT_TARIFF = models.Tariff(cost_per_kwh=2500.0, cost_per_minute=100.0)
+
+tariff_book = TariffBook(CompiledTariff(
+    cost_per_kwh=DEFAULT_TARIFF.cost_per_kwh,
+    cost_per_minute=DEFAULT_TARIFF.cost_per_minute,
+    admin_fee=DEFAULT_ADMIN_FEE
+))
+events.subscribe(tariff_book.apply)
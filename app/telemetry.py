@@ -0,0 +1,294 @@
+"""
+Meter-value ingestion: parsing, packing and energy accounting.
+
+Chargers post batches of readings as NDJSON, one object per line:
+
+    {"timestamp": 1718000000.5, "energy_wh": 15230.0, "power_kw": 22.1}
+
+`timestamp` is epoch seconds or an ISO-8601 string (UTC when naive); each
+reading needs `energy_wh` (cumulative register) and/or `power_kw`. Batches
+are stored as one packed float64 array per batch (see models.MeterBatch)
+and folded into a running energy total, so billing never revisits single
+readings.
+"""
+import json
+import math
+import sys
+from array import array
+from datetime import datetime, timezone
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from app import models
+
+FIELDS_PER_READING = 3  # timestamp, power_kw, energy_wh
+MAX_READINGS_PER_BATCH = 100_000
+
+class MeterReading(NamedTuple):
+    timestamp: float                # epoch seconds
+    power_kw: Optional[float]
+    energy_wh: Optional[float]
+
+class MeterState(NamedTuple):
+    """Running accounting state of a session, stored with every batch."""
+    seq: int = 0
+    last_ts: Optional[float] = None
+    last_power_kw: Optional[float] = None
+    first_energy_wh: Optional[float] = None
+    last_energy_wh: Optional[float] = None
+    integrated_kwh: float = 0.0
+
+    @property
+    def total_kwh(self) -> float:
+        # The energy register is authoritative; power integration is the
+        # fallback for chargers that only report power.
+        if self.first_energy_wh is not None:
+            return round((self.last_energy_wh - self.first_energy_wh) / 1000.0, 4)
+        return round(self.integrated_kwh, 4)
+
+def _timestamp(value) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    raise ValueError("timestamp harus epoch detik atau ISO-8601")
+
+def _optional_float(value) -> Optional[float]:
+    if value is None:
+        return None
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError("nilai meter harus angka positif")
+    return number
+
+def parse_ndjson(body: bytes) -> List[MeterReading]:
+    """Parses an NDJSON body; raises ValueError naming the first bad line."""
+    readings = []
+    for line_no, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            reading = MeterReading(
+                _timestamp(obj["timestamp"]),
+                _optional_float(obj.get("power_kw")),
+                _optional_float(obj.get("energy_wh"))
+            )
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise ValueError(f"Baris {line_no} tidak valid: {e}")
+        if reading.power_kw is None and reading.energy_wh is None:
+            raise ValueError(f"Baris {line_no} tidak valid: butuh energy_wh atau power_kw")
+        readings.append(reading)
+        if len(readings) > MAX_READINGS_PER_BATCH:
+            raise ValueError(f"Maksimal {MAX_READINGS_PER_BATCH} reading per batch")
+    return readings
+
+def fold(state: MeterState, readings: Iterable[MeterReading]) -> Tuple[MeterState, List[MeterReading]]:
+    """
+    Applies readings in timestamp order. Readings at or before the last
+    accepted timestamp (resends, duplicates) are dropped. Returns the new
+    state and the accepted readings.
+    """
+    last_ts = state.last_ts
+    last_power = state.last_power_kw
+    first_wh = state.first_energy_wh
+    last_wh = state.last_energy_wh
+    integrated = state.integrated_kwh
+    accepted = []
+
+    for r in sorted(readings, key=lambda r: r.timestamp):
+        if last_ts is not None and r.timestamp <= last_ts:
+            continue
+        if r.power_kw is not None:
+            if last_power is not None and last_ts is not None:
+                # Trapezoid between consecutive power samples
+                integrated += (last_power + r.power_kw) / 2.0 * (r.timestamp - last_ts) / 3600.0
+            last_power = r.power_kw
+        if r.energy_wh is not None:
+            if first_wh is None:
+                first_wh = r.energy_wh
+            # A register never runs backwards; ignore glitches instead of crediting energy
+            last_wh = max(r.energy_wh, last_wh if last_wh is not None else r.energy_wh)
+        last_ts = r.timestamp
+        accepted.append(r)
+
+    return MeterState(state.seq + (1 if accepted else 0), last_ts, last_power, first_wh, last_wh, integrated), accepted
+
+def pack(readings: List[MeterReading]) -> bytes:
+    """Readings as a flat little-endian float64 array; missing values are NaN."""
+    values = array("d")
+    nan = math.nan
+    for r in readings:
+        values.append(r.timestamp)
+        values.append(nan if r.power_kw is None else r.power_kw)
+        values.append(nan if r.energy_wh is None else r.energy_wh)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+def unpack(blob: bytes) -> List[MeterReading]:
+    values = array("d")
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return [
+        MeterReading(
+            values[i],
+            None if math.isnan(values[i + 1]) else values[i + 1],
+            None if math.isnan(values[i + 2]) else values[i + 2]
+        )
+        for i in range(0, len(values), FIELDS_PER_READING)
+    ]
+
+def state_from_batch(batch: Optional[models.MeterBatch]) -> MeterState:
+    if batch is None:
+        return MeterState()
+    return MeterState(
+        batch.seq, batch.last_ts, batch.last_power_kw,
+        batch.first_energy_wh, batch.last_energy_wh, batch.integrated_kwh
+    )
+
+def batch_from_state(session_id: int, state: MeterState, readings: List[MeterReading]) -> models.MeterBatch:
+    return models.MeterBatch(
+        session_id=session_id,
+        seq=state.seq,
+        first_ts=readings[0].timestamp,
+        last_ts=readings[-1].timestamp,
+        reading_count=len(readings),
+        samples=pack(readings),
+        last_power_kw=state.last_power_kw,
+        first_energy_wh=state.first_energy_wh,
+        last_energy_wh=state.last_energy_wh,
+        integrated_kwh=state.integrated_kwh,
+        total_kwh=state.total_kwh
+    )
+
+# ===== ROLLUPS (downsampled power curves) =====
+# Every ingested batch is rolled up into 1 s, 1 min and 15 min buckets and
+# stored as packed chunks (models.TelemetryChunk). Bucket aggregates are
+# mergeable, so a bucket split across two batches is simply merged at read
+# time; ingestion keeps no per-session state in memory.
+
+RESOLUTIONS = {"1s": 1, "1m": 60, "15m": 900}
+# Span covered by one chunk after compaction, per resolution (seconds)
+CHUNK_SPAN = {1: 3600, 60: 86400, 900: 30 * 86400}
+BUCKET_FIELDS = 6  # start, count, power_sum, power_min, power_max, energy_wh
+MAX_CURVE_POINTS = 20_000
+
+class Bucket(NamedTuple):
+    start: float
+    count: int                 # power samples in the bucket
+    power_sum: float
+    power_min: Optional[float]
+    power_max: Optional[float]
+    energy_wh: Optional[float]  # last register value in the bucket
+
+    @property
+    def avg_kw(self) -> Optional[float]:
+        return self.power_sum / self.count if self.count else None
+
+    def merge(self, other: "Bucket") -> "Bucket":
+        return Bucket(
+            self.start,
+            self.count + other.count,
+            self.power_sum + other.power_sum,
+            _pick(min, self.power_min, other.power_min),
+            _pick(max, self.power_max, other.power_max),
+            _pick(max, self.energy_wh, other.energy_wh)
+        )
+
+def _pick(fn, a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return fn(a, b)
+
+def _power_samples(state: MeterState, readings: List[MeterReading]):
+    """(timestamp, kW or None, Wh or None); power derived from register deltas when not reported."""
+    prev_ts, prev_wh = state.last_ts, state.last_energy_wh
+    for r in readings:
+        power = r.power_kw
+        if power is None and r.energy_wh is not None and prev_wh is not None and prev_ts is not None:
+            power = max(r.energy_wh - prev_wh, 0.0) / (r.timestamp - prev_ts) * 3.6
+        if r.energy_wh is not None:
+            prev_wh = r.energy_wh
+        prev_ts = r.timestamp
+        yield r.timestamp, power, r.energy_wh
+
+def rollup(state: MeterState, readings: List[MeterReading], resolution: int) -> List[Bucket]:
+    """Buckets for readings accepted by fold(); `state` is the state before that fold."""
+    buckets: "dict[float, Bucket]" = {}
+    for ts, power, wh in _power_samples(state, readings):
+        start = float(math.floor(ts / resolution) * resolution)
+        sample = Bucket(start, 0 if power is None else 1, power or 0.0, power, power, wh)
+        current = buckets.get(start)
+        buckets[start] = sample if current is None else current.merge(sample)
+    return [buckets[k] for k in sorted(buckets)]
+
+def merge_buckets(buckets: Iterable[Bucket]) -> List[Bucket]:
+    merged: "dict[float, Bucket]" = {}
+    for b in buckets:
+        current = merged.get(b.start)
+        merged[b.start] = b if current is None else current.merge(b)
+    return [merged[k] for k in sorted(merged)]
+
+def pack_buckets(buckets: List[Bucket]) -> bytes:
+    values = array("d")
+    nan = math.nan
+    for b in buckets:
+        values.extend((
+            b.start, float(b.count), b.power_sum,
+            nan if b.power_min is None else b.power_min,
+            nan if b.power_max is None else b.power_max,
+            nan if b.energy_wh is None else b.energy_wh
+        ))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+def unpack_buckets(blob: bytes) -> List[Bucket]:
+    values = array("d")
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    optional = lambda v: None if math.isnan(v) else v
+    return [
+        Bucket(values[i], int(values[i + 1]), values[i + 2],
+               optional(values[i + 3]), optional(values[i + 4]), optional(values[i + 5]))
+        for i in range(0, len(values), BUCKET_FIELDS)
+    ]
+
+def chunk_from_buckets(session_id: int, resolution: int, buckets: List[Bucket]) -> models.TelemetryChunk:
+    return models.TelemetryChunk(
+        session_id=session_id,
+        resolution=resolution,
+        start_ts=buckets[0].start,
+        end_ts=buckets[-1].start + resolution,
+        bucket_count=len(buckets),
+        data=pack_buckets(buckets)
+    )
+
+def rollup_chunks(session_id: int, state: MeterState, readings: List[MeterReading]) -> List[models.TelemetryChunk]:
+    """One chunk per resolution for a freshly accepted batch."""
+    return [
+        chunk_from_buckets(session_id, resolution, rollup(state, readings, resolution))
+        for resolution in RESOLUTIONS.values()
+    ] if readings else []
+
+def compact(session_id: int, resolution: int, chunks: List[models.TelemetryChunk]) -> List[models.TelemetryChunk]:
+    """Merges per-batch chunks into one chunk per CHUNK_SPAN window."""
+    windows: "dict[int, List[Bucket]]" = {}
+    span = CHUNK_SPAN[resolution]
+    for bucket in merge_buckets(b for c in chunks for b in unpack_buckets(c.data)):
+        windows.setdefault(int(bucket.start // span), []).append(bucket)
+    return [chunk_from_buckets(session_id, resolution, windows[w]) for w in sorted(windows)]
+
+def query_buckets(chunks: List[models.TelemetryChunk], start_ts: Optional[float], end_ts: Optional[float]) -> List[Bucket]:
+    buckets = merge_buckets(b for c in chunks for b in unpack_buckets(c.data))
+    return [
+        b for b in buckets
+        if (start_ts is None or b.start >= start_ts) and (end_ts is None or b.start < end_ts)
+    ]
@@ -0,0 +1,57 @@
+"""
+Per-request authentication overhead of get_current_user, with and without
+the verified-token cache.
+
+    python -m benchmarks.bench_auth [--requests 20000] [--tokens 100]
+
+Simulates polling clients: a small set of tokens presented over and over.
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app import auth
+
+def _run(credentials, n_requests: int) -> float:
+    async def loop():
+        start = time.perf_counter()
+        for i in range(n_requests):
+            await auth.get_current_user(credentials[i % len(credentials)])
+        return time.perf_counter() - start
+
+    return asyncio.run(loop())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=100, help="distinct tokens (clients)")
+    args = parser.parse_args(argv)
+
+    credentials = [
+        HTTPAuthorizationCredentials(
+            scheme="Bearer",
+            credentials=auth.create_access_token({"sub": i, "email": f"user{i}@example.com"})
+        )
+        for i in range(args.tokens)
+    ]
+
+    original = auth.token_cache
+    try:
+        auth.token_cache = auth.TokenCache(maxsize=0)
+        uncached = _run(credentials, args.requests)
+
+        auth.token_cache = auth.TokenCache()
+        cached = _run(credentials, args.requests)
+    finally:
+        auth.token_cache = original
+
+    per_uncached = uncached / args.requests * 1e6
+    per_cached = cached / args.requests * 1e6
+    print(f"requests={args.requests} tokens={args.tokens}")
+    print(f"without cache: {per_uncached:8.2f} us/request")
+    print(f"with cache:    {per_cached:8.2f} us/request  ({per_uncached / per_cached:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
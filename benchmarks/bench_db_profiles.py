@@ -0,0 +1,65 @@
+"""
+Concurrent write throughput per engine profile (DB_PROFILE in app.db).
+
+    python -m benchmarks.bench_db_profiles [--threads 8] [--writes 300] [--profiles default,balanced,throughput]
+
+Each profile gets a fresh SQLite file (or DATABASE_URL with
+--use-database-url, tables are created if missing). --threads workers each
+create --writes stations through repository.create_station, i.e. the
+_save path with one commit per write, and the run reports writes per second
+and writes that failed (e.g. "database is locked").
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from app import db, models, repository
+
+def _run(threads: int, writes: int):
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker(n: int):
+        barrier.wait()
+        for i in range(writes):
+            try:
+                repository.create_station(models.Station(
+                    station_operator=f"Bench {n}",
+                    location=models.Location(latitude=-6.2, longitude=106.8, address=f"Jl. {n}/{i}"),
+                    connector_list=["CCS"]
+                ))
+            except Exception as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return (threads * writes - len(errors)) / elapsed, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=300, help="writes per thread")
+    parser.add_argument("--profiles", default=",".join(db.ENGINE_PROFILES))
+    parser.add_argument("--use-database-url", action="store_true")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    for name in args.profiles.split(","):
+        url = db.DATABASE_URL if args.use_database_url else f"sqlite:///{os.path.join(directory, name + '.db')}"
+        db.engine = db.make_engine(url, db.get_profile(name))
+        db.init_db()
+        rate, errors = _run(args.threads, args.writes)
+        print(f"{name:<12} {rate:>8.0f} writes/s  {len(errors):>5} failed  {db.pool_stats()}")
+        if errors:
+            print(f"             first error: {errors[0]!r:.120}")
+        db.engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Station import throughput: bulk import vs one create_station per row.
+
+    python -m benchmarks.bench_import [--rows 20000] [--single-rows 2000]
+
+Runs against a throw-away SQLite file (or DATABASE_URL when --use-database-url
+is given) and reports rows per second for both paths.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlmodel import create_engine
+
+from app import bulk_import, db, models, repository
+
+def _lines(n: int, rng: random.Random):
+    for i in range(n):
+        yield json.dumps({
+            "station_operator": rng.choice(["PLN", "Shell", "Pertamina"]),
+            "location": {"latitude": rng.uniform(-6.6, -6.0), "longitude": rng.uniform(106.5, 107.2), "address": f"Jl. {i}"},
+            "connector_list": ["CCS", "CHAdeMO"][: rng.randint(1, 2)]
+        }).encode()
+
+def _bulk(n: int, rng: random.Random) -> float:
+    async def body():
+        # 64 KiB chunks, like a streamed upload
+        data = b"\n".join(_lines(n, rng))
+        for i in range(0, len(data), 65536):
+            yield data[i:i + 65536]
+
+    async def run():
+        importer = bulk_import.Importer(bulk_import.STATIONS)
+        async for lines in bulk_import.iter_line_batches(body()):
+            importer.import_lines(lines)
+        return importer.result()
+
+    result = asyncio.run(run())
+    assert result.inserted == n, result.errors[:3]
+    return result.rows_per_second
+
+def _single(n: int, rng: random.Random) -> float:
+    stations = [json.loads(line) for line in _lines(n, rng)]
+    start = time.perf_counter()
+    for s in stations:
+        repository.create_station(models.Station(
+            station_operator=s["station_operator"],
+            location=models.Location(**s["location"]),
+            connector_list=s["connector_list"]
+        ))
+    return n / (time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--single-rows", type=int, default=2000, help="rows for the one-by-one baseline")
+    parser.add_argument("--use-database-url", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not args.use_database_url:
+        path = os.path.join(tempfile.mkdtemp(), "bench_import.db")
+        db.engine = create_engine(f"sqlite:///{path}", json_serializer=db.dumps)
+    db.init_db()
+
+    rng = random.Random(42)
+    bulk = _bulk(args.rows, rng)
+    single = _single(args.single_rows, rng)
+    print(f"bulk import  {args.rows:>7} rows  {bulk:>10.0f} rows/s")
+    print(f"create_station {args.single_rows:>5} rows  {single:>10.0f} rows/s  ({bulk / single:.0f}x slower)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Charging lifecycle load test: register, login, start, stop, invoice and pay,
+driven concurrently through the full HTTP stack against a real database.
+
+    python -m benchmarks.bench_lifecycle [--users 50] [--concurrency 10] [--cycles 3]
+                                         [--output results.json] [--compare baseline.json]
+
+By default the app runs in this process (httpx ASGI transport) on a
+throw-away SQLite file; --use-database-url runs it on DATABASE_URL (e.g.
+Postgres) and --base-url drives an already running server instead.
+Stations and assets are seeded through the bulk import endpoints, one asset
+per virtual user, so flows do not compete for chargers.
+
+Every virtual user registers, logs in, then runs --cycles times:
+start, active session, stop, invoice list, pay. Per endpoint the report
+has the request count, errors, requests per second over the whole run and
+p50/p95/p99 latency. --output stores it as JSON together with the commit
+and parameters; --compare prints the change against such a file and, with
+--fail-on-regression, exits 1 when p95 or throughput got worse than
+--threshold.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+PASSWORD = "bench-password"
+
+# Report order; names are METHOD + route template
+ENDPOINTS = [
+    "POST /auth/register",
+    "POST /auth/login",
+    "POST /charging-sessions/start",
+    "GET /charging-sessions/me/active",
+    "POST /charging-sessions/{id}/stop",
+    "GET /invoices/me",
+    "PATCH /invoices/{id}/payment",
+]
+
+class FlowError(Exception):
+    pass
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.failed_flows = 0
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.errors[name] += 1
+            raise FlowError(f"{name}: {e!r}")
+        self.latencies[name].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+            raise FlowError(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+        return response
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(recorder: Recorder, wall_seconds: float) -> dict:
+    endpoints = {}
+    names = [n for n in ENDPOINTS if n in recorder.latencies or n in recorder.errors]
+    names += sorted(set(recorder.latencies) - set(names))
+    for name in names:
+        values = sorted(recorder.latencies.get(name, []))
+        endpoints[name] = {
+            "requests": len(values),
+            "errors": recorder.errors.get(name, 0),
+            "rps": round(len(values) / wall_seconds, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    every = sorted(v for values in recorder.latencies.values() for v in values)
+    total = {
+        "requests": len(every),
+        "errors": sum(recorder.errors.values()),
+        "failed_flows": recorder.failed_flows,
+        "rps": round(len(every) / wall_seconds, 2),
+        "p50_ms": round(percentile(every, 50) * 1000, 2),
+        "p95_ms": round(percentile(every, 95) * 1000, 2),
+        "p99_ms": round(percentile(every, 99) * 1000, 2),
+        "wall_seconds": round(wall_seconds, 3),
+    }
+    return {"endpoints": endpoints, "total": total}
+
+async def _seed(client: httpx.AsyncClient, n_assets: int, per_station: int, run_id: str) -> List[int]:
+    """Seeds stations and assets through the import endpoints; returns the asset ids."""
+    email = f"seed-{run_id}@example.com"
+    (await client.post("/auth/register", json={"name": "Seeder", "email": email, "password": PASSWORD})).raise_for_status()
+    login = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    login.raise_for_status()
+    token = login.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"}
+
+    n_stations = math.ceil(n_assets / per_station)
+    stations = "\n".join(json.dumps({
+        "station_operator": "Bench",
+        "location": {"latitude": -6.2 + i * 1e-4, "longitude": 106.8, "address": f"Bench {run_id} {i}"},
+        "connector_list": ["CCS"]
+    }) for i in range(n_stations))
+    imported = await client.post("/stations/import", content=stations, headers=headers)
+    imported.raise_for_status()
+    station_ids = imported.json()["inserted_ids"]
+
+    assets = "\n".join(json.dumps({
+        "station_id": station_ids[i // per_station],
+        "model": "Bench 50",
+        "connector_port": {"standard_name": "CCS", "max_power_supported": 50}
+    }) for i in range(n_assets))
+    result = (await client.post("/station-assets/import", content=assets, headers=headers)).json()
+    if result["inserted"] != n_assets:
+        raise SystemExit(f"Seeding failed: {result['errors'][:3]}")
+    return result["inserted_ids"]
+
+async def _user_flow(client: httpx.AsyncClient, recorder: Recorder, email: str, asset_id: int, cycles: int):
+    r = recorder.request
+    await r(client, "POST /auth/register", "POST", "/auth/register", json={"name": "Bench", "email": email, "password": PASSWORD})
+    login = await r(client, "POST /auth/login", "POST", "/auth/login", json={"email": email, "password": PASSWORD})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    for _ in range(cycles):
+        started = await r(client, "POST /charging-sessions/start", "POST", "/charging-sessions/start", json={"asset_id": asset_id}, headers=headers)
+        session_id = started.json()["session_id"]
+        await r(client, "GET /charging-sessions/me/active", "GET", "/charging-sessions/me/active", headers=headers)
+        await r(client, "POST /charging-sessions/{id}/stop", "POST", f"/charging-sessions/{session_id}/stop", params={"kwh_consumed": 12.5}, headers=headers)
+        invoices = await r(client, "GET /invoices/me", "GET", "/invoices/me", params={"limit": 1}, headers=headers)
+        invoice_id = invoices.json()["items"][0]["invoice_id"]
+        await r(client, "PATCH /invoices/{id}/payment", "PATCH", f"/invoices/{invoice_id}/payment",
+                json={"payment_status": "Completed", "payment_method": "e-wallet"}, headers=headers)
+
+async def run(client: httpx.AsyncClient, users: int, concurrency: int, cycles: int, per_station: int = 10) -> dict:
+    run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    asset_ids = await _seed(client, users, per_station, run_id)
+    recorder = Recorder()
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with gate:
+            try:
+                await _user_flow(client, recorder, f"user{i}-{run_id}@example.com", asset_ids[i], cycles)
+            except FlowError as e:
+                recorder.failed_flows += 1
+                if recorder.failed_flows <= 3:
+                    print(f"flow {i} failed: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(users)))
+    return summarize(recorder, time.perf_counter() - start)
+
+def _in_process_client(args) -> httpx.AsyncClient:
+    import main  # also registers the tables for init_db()
+    from app import auth, db
+    if not args.use_database_url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_lifecycle.db')}"
+        db.ASYNC_DATABASE_URL = db._async_url(url)
+        db.async_engine = None
+    else:
+        url = db.DATABASE_URL
+    db.DB_PROFILE = args.profile
+    db.engine = db.make_engine(url, db.get_profile(args.profile))
+    db.init_db()
+    # Login cost is a deployment choice; keep it from dominating the numbers
+    auth.BCRYPT_ROUNDS = args.bcrypt_rounds
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=60)
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(report: dict):
+    print(f"{'endpoint':<36} {'reqs':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, s in report["endpoints"].items():
+        print(f"{name:<36} {s['requests']:>6} {s['errors']:>5} {s['rps']:>8.1f} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}")
+    t = report["total"]
+    print(f"{'total':<36} {t['requests']:>6} {t['errors']:>5} {t['rps']:>8.1f} {t['p50_ms']:>8.1f} {t['p95_ms']:>8.1f} {t['p99_ms']:>8.1f}"
+          f"  ({t['failed_flows']} failed flows, {t['wall_seconds']} s)")
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """Prints the change per endpoint; returns the regressions (p95 up or req/s down by more than `threshold`)."""
+    regressions = []
+    print(f"\nvs {baseline.get('meta', {}).get('commit') or 'baseline'}")
+    rows = list(report["endpoints"].items()) + [("total", report["total"])]
+    for name, current in rows:
+        before = baseline["total"] if name == "total" else baseline["endpoints"].get(name)
+        if not before or not before["p95_ms"] or not before["rps"]:
+            continue
+        p95 = current["p95_ms"] / before["p95_ms"] - 1
+        rps = current["rps"] / before["rps"] - 1
+        flag = ""
+        if p95 > threshold or rps < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<36} p95 {p95:+7.1%}   req/s {rps:+7.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--cycles", type=int, default=3, help="start..pay cycles per user")
+    parser.add_argument("--base-url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--use-database-url", action="store_true", help="in-process app on DATABASE_URL")
+    parser.add_argument("--profile", default="balanced", help="DB_PROFILE of the in-process app")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="bcrypt cost of the in-process app")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+        target = args.base_url
+    else:
+        client = _in_process_client(args)
+        from app import db
+        target = f"in-process ({db.engine.dialect.name}, profile {args.profile})"
+
+    async def go():
+        async with client:
+            return await run(client, args.users, args.concurrency, args.cycles)
+
+    report = asyncio.run(go())
+    report["meta"] = {
+        "commit": _commit(),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "target": target,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "cycles": args.cycles,
+        "bcrypt_rounds": None if args.base_url else args.bcrypt_rounds,
+    }
+    print(f"{target}: {args.users} users, concurrency {args.concurrency}, {args.cycles} cycles")
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+    return report
+
+if __name__ == "__main__":
+    main()
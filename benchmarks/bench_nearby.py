@@ -0,0 +1,48 @@
+"""
+Nearby-search latency of the in-process station geo index.
+
+    python -m benchmarks.bench_nearby [--stations 50000] [--queries 2000] [--radius 5]
+
+Stations are spread uniformly over a Jabodetabek-sized box; every query
+picks a random point inside it.
+"""
+import argparse
+import random
+import time
+
+from app import events, geo
+
+BOX = (-6.6, -6.0, 106.5, 107.2)  # min_lat, max_lat, min_lon, max_lon
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stations", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--radius", type=float, default=5.0, help="km")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(42)
+    min_lat, max_lat, min_lon, max_lon = BOX
+    index = geo.StationGeoIndex()
+    index._loaded = True
+    index.apply([
+        events.Change("station", i, i, "insert", {
+            "latitude": rng.uniform(min_lat, max_lat),
+            "longitude": rng.uniform(min_lon, max_lon),
+            "connector_list": ["CCS"],
+        })
+        for i in range(args.stations)
+    ])
+
+    points = [(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)) for _ in range(args.queries)]
+    found = 0
+    start = time.perf_counter()
+    for lat, lon in points:
+        found += len(index.nearby(lat, lon, args.radius))
+    elapsed = time.perf_counter() - start
+
+    print(f"stations={args.stations} queries={args.queries} radius={args.radius} km")
+    print(f"avg {elapsed / args.queries * 1e3:.3f} ms/query, {found / args.queries:.0f} stations/result")
+
+if __name__ == "__main__":
+    main()
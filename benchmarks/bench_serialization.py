@@ -0,0 +1,102 @@
+"""
+/stations serialization: per-item model_validate vs the compiled TypeAdapter
+vs the trusted orjson path (app.serialization).
+
+    python -m benchmarks.bench_serialization [--rows 10000] [--repeat 5]
+
+Seeds a throw-away SQLite file with --rows stations, then times
+  1. encoding all rows as one page with each encoder (no database time), and
+  2. walking GET /stations page by page (limit 200) through the app with the
+     response cache off, once per serialization mode.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlmodel import create_engine
+
+from app import cache, db, repository, schemas, serialization
+
+def _seed(n: int, rng: random.Random):
+    now = datetime.utcnow()
+    rows = [{
+        "station_operator": rng.choice(["PLN", "Shell", "Pertamina"]),
+        "location": {"latitude": rng.uniform(-6.6, -6.0), "longitude": rng.uniform(106.5, 107.2), "address": f"Jl. {i}"},
+        "connector_list": ["CCS", "CHAdeMO"][: rng.randint(1, 2)],
+        "created_at": now
+    } for i in range(n)]
+    with db.UnitOfWork() as uow:
+        repository.bulk_insert_stations(rows, db=uow.session)
+        uow.commit()
+
+def _model_validate(page: repository.Page) -> bytes:
+    # What GET /stations did before app.serialization
+    return schemas.Page[schemas.StationRead](
+        items=[schemas.StationRead.model_validate(s) for s in page.items],
+        next_cursor=page.next_cursor
+    ).model_dump_json().encode()
+
+ENCODERS = {
+    "model_validate": _model_validate,
+    "validated": lambda page: serialization.page_json(schemas.StationRead, page, serialization.VALIDATED),
+    "trusted": lambda page: serialization.page_json(schemas.StationRead, page, serialization.TRUSTED),
+}
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _walk(client: TestClient) -> int:
+    cursor, rows = None, 0
+    while True:
+        params = {"limit": repository.MAX_PAGE_SIZE}
+        if cursor is not None:
+            params["cursor"] = cursor
+        body = client.get("/stations", params=params).json()
+        rows += len(body["items"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(), "bench_serialization.db")
+    db.engine = create_engine(f"sqlite:///{path}", json_serializer=db.dumps)
+    db.init_db()
+    _seed(args.rows, random.Random(42))
+
+    with db.UnitOfWork() as uow:
+        page = repository.list_stations(limit=args.rows, db=uow.session)
+        print(f"encode {len(page.items)} rows (best of {args.repeat})")
+        baseline = None
+        for name, encode in ENCODERS.items():
+            seconds = _best(lambda: encode(page), args.repeat)
+            baseline = baseline or seconds
+            print(f"  {name:<15} {seconds * 1000:>8.1f} ms  {baseline / seconds:>5.1f}x")
+
+    import main as app_main
+    # Every page is a cache miss, so the handler and its serializer run each time
+    cache.response_cache.ttls = {}
+    cache.response_cache.backend = cache.LRUBackend(max_entries=0)
+    print(f"GET /stations, all pages of {repository.MAX_PAGE_SIZE}")
+    with TestClient(app_main.app) as client:
+        for mode in (serialization.VALIDATED, serialization.TRUSTED):
+            serialization.SERIALIZATION_MODE = mode
+            rows = _walk(client)
+            seconds = _best(lambda: _walk(client), args.repeat)
+            print(f"  {mode:<15} {seconds * 1000:>8.1f} ms  {rows / seconds:>10.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
+import asyncio
 import os
 from fastapi import FastAPI, HTTPException, Depends, status, Request, Query
-from fastapi.responses import HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from fastapi.templating import Jinja2Templates
@@ -9,9 +11,12 @@ from fastapi.openapi.utils import get_openapi
 from datetime import timedelta
 from typing import List, Optional
 from app import db, repository, models, schemas, service
+from app import async_repository, async_service, availability, bulk_import, cache, conditional, live, profiling, read_models, serialization, telemetry
 from app.auth import (
-    get_password_hash,
-    verify_password,
+    hash_password_async,
+    verify_password_async,
+    password_needs_rehash,
+    hashing_pool,
     create_access_token,
     get_current_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
@@ -22,12 +27,41 @@ app = FastAPI(
     description="Platform Manajemen Pengisian Baterai Kendaraan Listrik",
     version="2.0.0",
     docs_url=None, # Menonaktifkan docs default untuk custom UI
-    redoc_url=None # Menonaktifkan redoc default
+    redoc_url=None, # Menonaktifkan redoc default
+    default_response_class=ORJSONResponse # response_model tetap divalidasi, encoding JSON pakai orjson
 )
+# Harus sebelum route pertama didaftarkan: endpoint dibungkus timer handler
+app.router.route_class = profiling.TimedRoute
+# Server-Timing per request + histogram untuk /metrics
+app.add_middleware(profiling.ProfilingMiddleware)
+
+def page_params(
+    limit: int = Query(repository.DEFAULT_PAGE_SIZE, ge=1, le=repository.MAX_PAGE_SIZE, description="Jumlah item per halaman"),
+    cursor: Optional[int] = Query(None, description="Nilai next_cursor dari halaman sebelumnya")
+) -> dict:
+    """Query params keyset pagination untuk semua endpoint list"""
+    return {"limit": limit, "cursor": cursor}
 
 @app.on_event("startup")
 def on_startup():
     db.init_db()
+    availability.asset_index.load()
+
+@app.on_event("startup")
+async def start_availability_check():
+    # Periodic index-vs-database comparison; 0 disables it
+    interval = float(os.getenv("AVAILABILITY_CHECK_SECONDS", "300"))
+    if interval > 0:
+        app.state.availability_check = asyncio.create_task(
+            availability.run_periodic_check(availability.asset_index, interval)
+        )
+
+@app.on_event("shutdown")
+def on_shutdown():
+    hashing_pool.shutdown()
+    check = getattr(app.state, "availability_check", None)
+    if check is not None:
+        check.cancel()
 
 # Setup templates dan static files (jika ada)
 try:
@@ -67,9 +101,30 @@ def root():
         ]
     }
 
+@app.get("/health/db", tags=["Root"])
+def database_health():
+    """Profil engine (DB_PROFILE) dan statistik connection pool sync/async"""
+    return {
+        "profile": db.DB_PROFILE,
+        "pool": db.pool_stats(db.engine),
+        # Async engine dibuat saat pertama dipakai
+        "async_pool": db.pool_stats(db.async_engine) if db.async_engine is not None else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Root"])
+def metrics():
+    """Histogram per route (latency, handler, DB, serialisasi, jumlah query) format Prometheus"""
+    lines = []
+    for histogram in profiling.HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(profiling.render_gauges("db_pool", "Connection pool engine sync", db.pool_stats(db.engine)))
+    lines.extend(profiling.render_gauges("response_cache", "Statistik response cache", cache.response_cache.stats()))
+    lines.extend(profiling.render_gauges("password_hashing_pool", "Statistik pool hashing password", hashing_pool.stats()))
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 # ===== AUTHENTICATION ENDPOINTS (Account Context) =====
 @app.post("/auth/register", response_model=schemas.UserRead, tags=["1. Authentication"])
-def register(user: schemas.UserRegister):
+async def register(user: schemas.UserRegister, uow: db.UnitOfWork = Depends(db.get_uow)):
     """
     Registrasi user baru
     
@@ -77,38 +132,46 @@ def register(user: schemas.UserRegister):
     - Email harus unique
     - Password akan di-hash sebelum disimpan
     """
-    existing_user = repository.get_user_by_email(user.email)
+    # Handler async: bcrypt berjalan di hashing pool, query DB di threadpool
+    existing_user = await run_in_threadpool(repository.get_user_by_email, user.email, db=uow.session)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email sudah terdaftar"
         )
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password_async(user.password)
     new_user = models.User(
         name=user.name,
         email=user.email,
         phone=user.phone,
         password_hash=hashed_password
     )
-    created = repository.create_user(new_user)
+    created = await run_in_threadpool(repository.create_user, new_user, db=uow.session)
+    await run_in_threadpool(uow.commit)
     return created
 
 @app.post("/auth/login", response_model=schemas.Token, tags=["1. Authentication"])
-def login(credentials: schemas.UserLogin):
+async def login(credentials: schemas.UserLogin, uow: db.UnitOfWork = Depends(db.get_uow)):
     """
     Untuk login dan mendapatkan JWT access token
     
     Token ini digunakan untuk mengakses endpoint yang memerlukan autentikasi.
     """
-    user = repository.get_user_by_email(credentials.email)
+    user = await run_in_threadpool(repository.get_user_by_email, credentials.email, db=uow.session)
     
-    if not user or not verify_password(credentials.password, user.password_hash):
+    if not user or not await verify_password_async(credentials.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email atau password salah",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Cost factor berubah (BCRYPT_ROUNDS): hash ulang selagi password plaintext tersedia
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = await hash_password_async(credentials.password)
+        await run_in_threadpool(repository.update_user, user, db=uow.session)
+        await run_in_threadpool(uow.commit)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -119,37 +182,41 @@ def login(credentials: schemas.UserLogin):
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/auth/me", response_model=schemas.UserRead, tags=["1. Authentication"])
-def get_me(current_user: dict = Depends(get_current_user)):
+def get_me(current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
     """Get informasi user yang sedang login"""
-    user = repository.get_user(current_user["user_id"])
+    user = repository.get_user(current_user["user_id"], db=uow.session)
     if not user:
         raise HTTPException(status_code=404, detail="User tidak ditemukan")
     return user
 
 # ===== USER ENDPOINTS (Account Context) =====
-@app.get("/users", response_model=List[schemas.UserRead], tags=["2. Users (Account Context)"])
-def list_users(current_user: dict = Depends(get_current_user)):
+@app.get("/users", response_model=schemas.Page[schemas.UserRead], tags=["2. Users (Account Context)"])
+def list_users(
+    page: dict = Depends(page_params),
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
+):
     """List semua users"""
-    return repository.list_users()
+    return repository.list_users(**page, db=uow.session)
 
 @app.get("/users/{user_id}", response_model=schemas.UserRead, tags=["2. Users (Account Context)"])
-def get_user(user_id: int, current_user: dict = Depends(get_current_user)):
+def get_user(user_id: int, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
     """Get detail user berdasarkan ID"""
-    user = repository.get_user(user_id)
+    user = repository.get_user(user_id, db=uow.session)
     if not user:
         raise HTTPException(status_code=404, detail="User tidak ditemukan")
     return user
 
 # ===== VEHICLE ENDPOINTS (Account Context) =====
 @app.post("/vehicles", response_model=schemas.VehicleRead, tags=["2. Users (Account Context)"])
-def create_vehicle(vehicle: schemas.VehicleCreate, current_user: dict = Depends(get_current_user)):
+def create_vehicle(vehicle: schemas.VehicleCreate, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
     """
     Daftarkan kendaraan baru untuk user yang sedang login
     
     Vehicle diperlukan untuk tracking battery capacity saat charging
     """
     # Check duplicate plate number
-    existing = repository.get_vehicle_by_plate(vehicle.nomor_plat)
+    existing = repository.get_vehicle_by_plate(vehicle.nomor_plat, db=uow.session)
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -162,18 +229,23 @@ def create_vehicle(vehicle: schemas.VehicleCreate, current_user: dict = Depends(
         battery_capacity=vehicle.battery_capacity,
         connector_port=models.ConnectorPort(**vehicle.connector_port.model_dump())
     )
-    created = repository.create_vehicle(new_vehicle)
+    created = repository.create_vehicle(new_vehicle, db=uow.session)
+    uow.commit()
     return created
 
-@app.get("/vehicles/me", response_model=List[schemas.VehicleRead], tags=["2. Users (Account Context)"])
-def get_my_vehicles(current_user: dict = Depends(get_current_user)):
+@app.get("/vehicles/me", response_model=schemas.Page[schemas.VehicleRead], tags=["2. Users (Account Context)"])
+def get_my_vehicles(
+    page: dict = Depends(page_params),
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
+):
     """Get semua kendaraan milik user yang sedang login"""
-    return repository.get_vehicles_by_user(current_user["user_id"])
+    return repository.get_vehicles_by_user(current_user["user_id"], **page, db=uow.session)
 
 @app.get("/vehicles/{vehicle_id}", response_model=schemas.VehicleRead, tags=["2. Users (Account Context)"])
-def get_vehicle(vehicle_id: int, current_user: dict = Depends(get_current_user)):
+def get_vehicle(vehicle_id: int, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
     """Get detail kendaraan berdasarkan ID"""
-    vehicle = repository.get_vehicle(vehicle_id)
+    vehicle = repository.get_vehicle(vehicle_id, db=uow.session)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle tidak ditemukan")
     
@@ -188,7 +260,7 @@ def get_vehicle(vehicle_id: int, current_user: dict = Depends(get_current_user))
 
 # ===== STATION ENDPOINTS (Station Management Context) =====
 @app.post("/stations", response_model=schemas.StationRead, tags=["3. Stations (Station Management)"])
-def create_station(station: schemas.StationCreate, current_user: dict = Depends(get_current_user)):
+def create_station(station: schemas.StationCreate, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
     """
     Buat stasiun charging baru
     
@@ -199,17 +271,71 @@ def create_station(station: schemas.StationCreate, current_user: dict = Depends(
         location=models.Location(**station.location.model_dump()),
         connector_list=station.connector_list
     )
-    created = repository.create_station(new_station)
+    created = repository.create_station(new_station, db=uow.session)
+    uow.commit()
     return created
 
-@app.get("/stations", response_model=List[schemas.StationRead], tags=["3. Stations (Station Management)"])
-def list_stations():
+async def _bulk_import(request: Request, kind) -> schemas.BulkImportResult:
+    importer = bulk_import.Importer(kind, bulk_import.upload_format(request.headers.get("content-type")))
+    # Row, line and batch failures land in the result; it always reports what was committed
+    async for lines in bulk_import.iter_line_batches(request.stream(), fmt=importer.fmt):
+        # Validation and the executemany are blocking; one batch per threadpool call
+        await run_in_threadpool(importer.import_lines, lines)
+    return importer.result()
+
+@app.post("/stations/import", response_model=schemas.BulkImportResult, tags=["3. Stations (Station Management)"])
+async def import_stations(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Import stasiun massal dari upload NDJSON atau CSV (`Content-Type: text/csv`)
+
+    Baris yang tidak valid dilaporkan beserta nomor barisnya tanpa membatalkan baris lain.
+    Kolom CSV memakai nama bertitik untuk field bersarang (mis. `location.latitude`)
+    dan `;` sebagai pemisah `connector_list`.
+    """
+    return await _bulk_import(request, bulk_import.STATIONS)
+
+def _json_response(body: bytes, headers: Optional[dict] = None) -> Response:
+    """Pre-serialized JSON body (app.serialization); bypasses the response_model pass."""
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _cached_response(request: Request, route: str, key: str, tags: List[str], build) -> Response:
+    """
+    Serves a public read from the response cache; `build` returns the JSON body as bytes.
+    The ETag is a hash of the cached body, so If-None-Match answers 304 without sending it.
+    """
+    # Cached bodies are shared by every client: build them from the primary, not a lagging replica
+    with db.on_primary():
+        body, hit = cache.response_cache.get_or_build(route, key, tags, build)
+    return _shared_body_response(request, body, hit)
+
+def _shared_body_response(request: Request, body: bytes, hit: bool) -> Response:
+    """JSON response of a body shared by every client, with ETag / 304 and X-Cache."""
+    validator = conditional.body_validator(body)
+    if conditional.not_modified(request, validator):
+        response = conditional.not_modified_response(validator)
+    else:
+        response = Response(content=body, media_type="application/json", headers=conditional.headers(validator))
+    response.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return response
+
+def _station_page_json(page: repository.Page) -> bytes:
+    return serialization.page_json(schemas.StationRead, page)
+
+@app.get("/stations", response_model=schemas.Page[schemas.StationRead], tags=["3. Stations (Station Management)"])
+def list_stations(request: Request, page: dict = Depends(page_params), uow: db.UnitOfWork = Depends(db.get_uow)):
     """List semua stasiun charging (public endpoint)"""
-    return repository.list_stations()
+    return _cached_response(
+        request,
+        "stations.list", f"{page['limit']}:{page['cursor']}", cache.station_list_tags(),
+        lambda: _station_page_json(repository.list_stations(**page, db=uow.session))
+    )
 
-@app.get("/stations/search", response_model=List[schemas.StationRead], tags=["3. Stations (Station Management)"])
+@app.get("/stations/search", response_model=schemas.Page[schemas.StationRead], tags=["3. Stations (Station Management)"])
 def search_stations_by_operator(
-    operator: str = Query(..., description="Nama operator stasiun yang dicari (case-insensitive)")
+    request: Request,
+    operator: str = Query(..., description="Nama operator stasiun yang dicari (case-insensitive)"),
+    page: dict = Depends(page_params),
+    uow: db.UnitOfWork = Depends(db.get_uow)
 ):
     """
     Cari stasiun berdasarkan nama operator (case-insensitive).
@@ -217,26 +343,58 @@ def search_stations_by_operator(
     """
     # REFACTOR: Logika pencarian ada di repository, endpoint tetap bersih.
     # Kita asumsikan implementasi di repository menangani pencarian case-insensitive.
-    return repository.search_stations_by_operator(operator_name=operator)
+    return _cached_response(
+        request,
+        "stations.search", f"{operator.lower()}:{page['limit']}:{page['cursor']}", cache.station_list_tags(),
+        lambda: _station_page_json(repository.search_stations_by_operator(operator_name=operator, **page, db=uow.session))
+    )
+
+@app.get("/stations/nearby", response_model=List[schemas.NearbyStation], tags=["3. Stations (Station Management)"])
+def find_nearby_stations(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude posisi user"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude posisi user"),
+    radius: float = Query(5.0, gt=0, le=200, description="Radius pencarian dalam km"),
+    connector: Optional[str] = Query(None, description="Filter tipe konektor (mis. CCS)"),
+    available_only: bool = Query(False, description="Hanya stasiun dengan charger tersedia"),
+    limit: int = Query(20, ge=1, le=100),
+    uow: db.UnitOfWork = Depends(db.get_uow)
+):
+    """Cari stasiun terdekat (terdekat dulu) beserta jumlah charger yang tersedia"""
+    return service.find_nearby_stations(lat, lon, radius, connector, available_only, limit, db=uow.session)
+
+@app.get("/stations/{station_id}/availability", response_model=schemas.StationAvailability, tags=["3. Stations (Station Management)"])
+def get_station_availability(
+    station_id: int,
+    connector: Optional[str] = Query(None, description="Tipe konektor (mis. CCS); kosong = semua"),
+    uow: db.UnitOfWork = Depends(db.get_uow)
+):
+    """Charger yang sedang tersedia di stasiun, dijawab dari index in-memory tanpa query"""
+    availability.asset_index.ensure_loaded(uow.session)
+    free = sorted(availability.asset_index.free_assets(station_id, connector))
+    return schemas.StationAvailability(
+        station_id=station_id, connector=connector, available=len(free), available_asset_ids=free
+    )
 
 @app.get("/stations/{station_id}", response_model=schemas.StationDetail, tags=["3. Stations (Station Management)"])
-def get_station(station_id: int):
+def get_station(station_id: int, request: Request, uow: db.UnitOfWork = Depends(db.get_uow)):
     """Get detail stasiun beserta asset-assetnya"""
-    station = repository.get_station(station_id)
-    if not station:
-        raise HTTPException(status_code=404, detail="Station tidak ditemukan")
-    return service.get_station_details(station_id)
+    # Read model: JSON siap kirim, di-invalidate saat station/asset berubah
+    try:
+        body, hit = read_models.station_details.lookup(station_id, db=uow.session)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return _shared_body_response(request, body, hit)
 
 # ===== STATION ASSET ENDPOINTS (Station Management Context) =====
 @app.post("/station-assets", response_model=schemas.StationAssetRead, tags=["3. Stations (Station Management)"])
-def create_station_asset(asset: schemas.StationAssetCreate, current_user: dict = Depends(get_current_user)):
+def create_station_asset(asset: schemas.StationAssetCreate, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
     """
     Tambah asset (charger unit) ke stasiun
     
     Station Asset merepresentasikan mesin fisik charger
     """
     # Validate station exists
-    station = repository.get_station(asset.station_id)
+    station = repository.get_station(asset.station_id, db=uow.session)
     if not station:
         raise HTTPException(status_code=404, detail="Station tidak ditemukan")
     
@@ -246,27 +404,71 @@ def create_station_asset(asset: schemas.StationAssetCreate, current_user: dict =
         connector_port=models.ConnectorPort(**asset.connector_port.model_dump()),
         maintenance_log=models.MaintenanceLog(**asset.maintenance_log.model_dump()) if asset.maintenance_log else None
     )
-    created = repository.create_station_asset(new_asset)
+    created = repository.create_station_asset(new_asset, db=uow.session)
+    uow.commit()
     return created
 
-@app.get("/station-assets", response_model=List[schemas.StationAssetRead], tags=["3. Stations (Station Management)"])
+@app.post("/station-assets/import", response_model=schemas.BulkImportResult, tags=["3. Stations (Station Management)"])
+async def import_station_assets(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Import asset massal dari upload NDJSON atau CSV (`Content-Type: text/csv`)
+
+    Asset dengan `station_id` yang tidak ada dilaporkan sebagai error baris.
+    """
+    return await _bulk_import(request, bulk_import.STATION_ASSETS)
+
+@app.get("/station-assets", response_model=schemas.Page[schemas.StationAssetRead], tags=["3. Stations (Station Management)"])
 def list_station_assets(
     station_id: Optional[int] = Query(None, description="Filter by station ID"),
-    available_only: bool = Query(False, description="Show only available assets")
+    available_only: bool = Query(False, description="Show only available assets"),
+    page: dict = Depends(page_params),
+    uow: db.UnitOfWork = Depends(db.get_uow)
 ):
     """List station assets dengan filter optional"""
     if available_only:
-        return repository.get_available_station_assets(station_id)
-    elif station_id:
-        return repository.get_station_assets_by_station(station_id)
-    else:
-        # Return all (implement if needed)
-        raise HTTPException(status_code=400, detail="Provide station_id or set available_only=true")
+        # Polling peta: asset tersedia dari availability index, tanpa filter is_available di database
+        return service.list_available_station_assets(station_id, **page, db=uow.session)
+    return repository.list_station_assets(station_id, **page, db=uow.session)
+
+@app.get("/station-assets/stream", tags=["3. Stations (Station Management)"])
+async def stream_station_assets(
+    request: Request,
+    station_id: Optional[List[int]] = Query(None, description="Stasiun yang dipantau (boleh berulang); kosong = semua")
+):
+    """
+    Server-Sent Events: perubahan ketersediaan dan maintenance asset secara live
+
+    Event `snapshot` (status awal asset stasiun yang dipantau), lalu `asset`
+    setiap kali `is_available` / `maintenance_log` berubah, `removed` untuk
+    asset yang dihapus, dan `resync` jika client tertinggal dan harus
+    mengambil ulang status lewat `GET /station-assets`.
+    """
+    if station_id and len(station_id) > live.MAX_STATIONS_PER_STREAM:
+        raise HTTPException(status_code=400, detail=f"Maksimal {live.MAX_STATIONS_PER_STREAM} stasiun per stream")
+
+    # Subscribe before reading the snapshot so no change falls in between
+    subscription = live.availability_feed.subscribe(station_id)
+    snapshot = None
+    if station_id:
+        try:
+            # Short-lived session: the stream itself must not hold a connection
+            async with db.AsyncUnitOfWork() as uow:
+                assets = await async_repository.get_station_assets_by_stations(station_id, db=uow.session)
+                snapshot = [schemas.StationAssetRead.from_orm_asset(a).model_dump(mode="json") for a in assets]
+        except Exception:
+            live.availability_feed.unsubscribe(subscription)
+            raise
+
+    return StreamingResponse(
+        live.event_stream(live.availability_feed, subscription, request.is_disconnected, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/station-assets/{asset_id}", response_model=schemas.StationAssetRead, tags=["3. Stations (Station Management)"])
-def get_station_asset(asset_id: int):
+def get_station_asset(asset_id: int, uow: db.UnitOfWork = Depends(db.get_uow)):
     """Get detail station asset"""
-    asset = repository.get_station_asset(asset_id)
+    asset = repository.get_station_asset(asset_id, db=uow.session)
     if not asset:
         raise HTTPException(status_code=404, detail="Station asset tidak ditemukan")
     return asset
@@ -275,10 +477,11 @@ def get_station_asset(asset_id: int):
 def update_station_asset(
     asset_id: int,
     update: schemas.StationAssetUpdate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
 ):
     """Update station asset (availability, maintenance log)"""
-    asset = repository.get_station_asset(asset_id)
+    asset = repository.get_station_asset(asset_id, db=uow.session)
     if not asset:
         raise HTTPException(status_code=404, detail="Station asset tidak ditemukan")
     
@@ -287,18 +490,21 @@ def update_station_asset(
     if update.maintenance_log is not None:
         asset.maintenance_log = models.MaintenanceLog(**update.maintenance_log.dict())
     
-    updated = repository.update_station_asset(asset)
+    updated = repository.update_station_asset(asset, db=uow.session)
+    uow.commit()
     return updated
 
 @app.post("/station-assets/{asset_id}/maintenance", response_model=schemas.StationAssetRead, tags=["3. Stations (Station Management)"])
 def add_maintenance_log(
     asset_id: int,
     error_log: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
 ):
     """Tambahkan maintenance log dan set asset menjadi unavailable"""
     try:
-        updated = service.add_maintenance_log(asset_id, error_log)
+        updated = service.add_maintenance_log(asset_id, error_log, db=uow.session)
+        uow.commit()
         return updated
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -307,7 +513,8 @@ def add_maintenance_log(
 @app.post("/charging-sessions/start", response_model=schemas.ChargingSessionRead, tags=["4. Charging Sessions"])
 def start_charging_session(
     req: schemas.ChargingSessionStart,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
 ):
     """
     Mulai sesi charging baru
@@ -320,8 +527,10 @@ def start_charging_session(
     try:
         session = service.start_charging_session(
             user_id=current_user["user_id"],
-            asset_id=req.asset_id
+            asset_id=req.asset_id,
+            db=uow.session
         )
+        uow.commit()
         return session
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -330,7 +539,8 @@ def start_charging_session(
 def stop_charging_session(
     session_id: int,
     kwh_consumed: Optional[float] = Query(None, description="Actual kWh consumed (optional)"),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
 ):
     """
     Hentikan sesi charging
@@ -339,8 +549,9 @@ def stop_charging_session(
     - Membuat invoice otomatis
     - Station asset dikembalikan ke status available
     """
-    # Validate ownership
-    session = repository.get_charging_session(session_id)
+    # Validate ownership (the service re-reads the session from the same
+    # unit of work, so the second lookup is served by the identity map)
+    session = repository.get_charging_session(session_id, db=uow.session)
     if not session:
         raise HTTPException(status_code=404, detail="Session tidak ditemukan")
     if session.user_id != current_user["user_id"]:
@@ -350,52 +561,129 @@ def stop_charging_session(
         )
     
     try:
-        stopped_session = service.stop_charging_session(session_id, kwh_consumed)
+        stopped_session = service.stop_charging_session(session_id, kwh_consumed, db=uow.session)
+        uow.commit()
         return stopped_session
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/charging-sessions/me", response_model=List[schemas.ChargingSessionRead], tags=["4. Charging Sessions"])
-def get_my_sessions(current_user: dict = Depends(get_current_user)):
-    """Get semua charging sessions milik user yang sedang login"""
-    return repository.get_charging_sessions_by_user(current_user["user_id"])
+@app.post("/charging-sessions/{session_id}/meter-values", response_model=schemas.MeterIngestResult, tags=["4. Charging Sessions"])
+async def ingest_meter_values(
+    session_id: int,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    uow: db.AsyncUnitOfWork = Depends(db.get_async_uow)
+):
+    """
+    Kirim batch meter values (NDJSON, satu reading per baris) untuk sesi yang sedang berjalan
+
+    Contoh baris: `{"timestamp": 1718000000.5, "energy_wh": 15230.0, "power_kw": 22.1}`.
+    Total energi ini yang dipakai saat stop jika `kwh_consumed` tidak diisi.
+    """
+    try:
+        # Parsing large batches is CPU-bound; keep it off the event loop
+        readings = await run_in_threadpool(telemetry.parse_ndjson, await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    try:
+        result = await async_service.ingest_meter_values(session_id, current_user["user_id"], readings, db=uow.session)
+        await uow.commit()
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/charging-sessions/{session_id}/power-curve", response_model=schemas.PowerCurve, tags=["4. Charging Sessions"])
+async def get_power_curve(
+    session_id: int,
+    resolution: str = Query("1m", description="Resolusi bucket: 1s, 1m, atau 15m"),
+    start: Optional[float] = Query(None, description="Awal rentang (epoch detik)"),
+    end: Optional[float] = Query(None, description="Akhir rentang (epoch detik, eksklusif)"),
+    current_user: dict = Depends(get_current_user),
+    uow: db.AsyncUnitOfWork = Depends(db.get_async_uow)
+):
+    """Kurva daya (rata-rata/min/max kW dan energi) dari meter values sesi"""
+    try:
+        return await async_service.get_power_curve(session_id, current_user["user_id"], resolution, start, end, db=uow.session)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/charging-sessions/me", response_model=schemas.Page[schemas.ChargingSessionRead], tags=["4. Charging Sessions"])
+async def get_my_sessions(
+    request: Request,
+    page: dict = Depends(page_params),
+    current_user: dict = Depends(get_current_user),
+    uow: db.AsyncUnitOfWork = Depends(db.get_async_uow)
+):
+    """
+    Get semua charging sessions milik user yang sedang login (terbaru dulu)
+
+    Mendukung conditional GET: kirim ulang `ETag` sebagai `If-None-Match`
+    (atau `Last-Modified` sebagai `If-Modified-Since`) untuk mendapat 304 bila tidak berubah.
+    """
+    user_id = current_user["user_id"]
+    version = await async_repository.get_charging_sessions_version(user_id, db=uow.session)
+    validator = conditional.make_validator(
+        "charging-sessions", user_id, page["limit"], page["cursor"], *version, last_modified=version.last_modified
+    )
+    if conditional.not_modified(request, validator):
+        return conditional.not_modified_response(validator, conditional.PRIVATE_CACHE_CONTROL)
+    sessions = await async_repository.get_charging_sessions_by_user(user_id, **page, db=uow.session)
+    return _json_response(
+        serialization.page_json(schemas.ChargingSessionRead, sessions),
+        conditional.headers(validator, conditional.PRIVATE_CACHE_CONTROL)
+    )
 
 @app.get("/charging-sessions/me/active", response_model=schemas.ChargingSessionDetail, tags=["4. Charging Sessions"])
-def get_my_active_session(current_user: dict = Depends(get_current_user)):
+async def get_my_active_session(current_user: dict = Depends(get_current_user), uow: db.AsyncUnitOfWork = Depends(db.get_async_uow)):
     """Get sesi charging aktif user (jika ada)"""
-    session = repository.get_active_session_by_user(current_user["user_id"])
+    # Endpoint polling: async engine, satu query (session + relasi)
+    session = await async_repository.get_active_session_detail(current_user["user_id"], db=uow.session)
     if not session:
         raise HTTPException(status_code=404, detail="Tidak ada sesi aktif")
-    
-    # Redirect to the full detail endpoint for consistency
-    return get_charging_session(session.session_id, current_user)
+    return session
 
 @app.get("/charging-sessions/{session_id}", response_model=schemas.ChargingSessionDetail, tags=["4. Charging Sessions"])
-def get_charging_session(session_id: int, current_user: dict = Depends(get_current_user)):
-    """Get detail charging session beserta relasi-nya"""
-    session = repository.get_charging_session(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session tidak ditemukan")
-    
-    # Check ownership
-    if session.user_id != current_user["user_id"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Anda tidak berhak melihat session ini"
+async def get_charging_session(session_id: int, current_user: dict = Depends(get_current_user), uow: db.AsyncUnitOfWork = Depends(db.get_async_uow)):
+    """Get detail charging session beserta relasi-nya (hanya milik user yang login)"""
+    try:
+        # Ownership ada di dalam query: sesi milik user lain = tidak ditemukan
+        return await async_service.get_charging_session_details(
+            session_id, user_id=current_user["user_id"], db=uow.session
         )
-    
-    return service.get_charging_session_details(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 # ===== INVOICE ENDPOINTS (Billing Context) =====
-@app.get("/invoices/me", response_model=List[schemas.InvoiceRead], tags=["5. Invoices (Billing Context)"])
-def get_my_invoices(current_user: dict = Depends(get_current_user)):
-    """Get semua invoice milik user yang sedang login"""
-    return repository.get_invoices_by_user(current_user["user_id"])
+@app.get("/invoices/me", response_model=schemas.Page[schemas.InvoiceRead], tags=["5. Invoices (Billing Context)"])
+def get_my_invoices(
+    request: Request,
+    page: dict = Depends(page_params),
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
+):
+    """
+    Get semua invoice milik user yang sedang login (terbaru dulu)
+
+    Mendukung conditional GET (`If-None-Match` / `If-Modified-Since` -> 304).
+    """
+    user_id = current_user["user_id"]
+    version = repository.get_invoices_version(user_id, db=uow.session)
+    validator = conditional.make_validator(
+        "invoices", user_id, page["limit"], page["cursor"], *version, last_modified=version.last_modified
+    )
+    if conditional.not_modified(request, validator):
+        return conditional.not_modified_response(validator, conditional.PRIVATE_CACHE_CONTROL)
+    invoices = repository.get_invoices_by_user(user_id, **page, db=uow.session)
+    return _json_response(
+        serialization.page_json(schemas.InvoiceRead, invoices),
+        conditional.headers(validator, conditional.PRIVATE_CACHE_CONTROL)
+    )
 
 @app.get("/invoices/{invoice_id}", response_model=schemas.InvoiceRead, tags=["5. Invoices (Billing Context)"])
-def get_invoice(invoice_id: int, current_user: dict = Depends(get_current_user)):
+def get_invoice(invoice_id: int, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
     """Get detail invoice"""
-    invoice = repository.get_invoice(invoice_id)
+    invoice = repository.get_invoice(invoice_id, db=uow.session)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice tidak ditemukan")
     
@@ -412,14 +700,15 @@ def get_invoice(invoice_id: int, current_user: dict = Depends(get_current_user))
 def update_invoice_payment(
     invoice_id: int,
     payment_update: schemas.InvoiceUpdatePayment,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    uow: db.UnitOfWork = Depends(db.get_uow)
 ):
     """
     Update status pembayaran invoice
     
     Untuk simulasi pembayaran (dalam production akan terintegrasi dengan payment gateway)
     """
-    invoice = repository.get_invoice(invoice_id)
+    invoice = repository.get_invoice(invoice_id, db=uow.session)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice tidak ditemukan")
     
@@ -434,8 +723,40 @@ def update_invoice_payment(
         updated = service.update_invoice_payment(
             invoice_id,
             payment_update.payment_status,
-            payment_update.payment_method
+            payment_update.payment_method,
+            db=uow.session
         )
+        uow.commit()
+        return updated
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+# ===== TARIFF ENDPOINTS (Billing Context) =====
+@app.post("/tariffs", response_model=schemas.TariffPlanRead, tags=["6. Tariffs (Billing Context)"])
+def create_tariff(plan: schemas.TariffPlanCreate, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
+    """
+    Buat tarif baru untuk satu stasiun, satu operator, atau global (tanpa station_id/operator)
+
+    Urutan prioritas saat billing: stasiun > operator > global > tarif default.
+    Band time-of-use memakai waktu lokal (`utc_offset_minutes`).
+    """
+    try:
+        created = service.create_tariff_plan(plan, db=uow.session)
+        uow.commit()
+        return created
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/tariffs", response_model=schemas.Page[schemas.TariffPlanRead], tags=["6. Tariffs (Billing Context)"])
+def list_tariffs(page: dict = Depends(page_params), uow: db.UnitOfWork = Depends(db.get_uow)):
+    """List semua tarif (public endpoint)"""
+    return repository.list_tariff_plans(**page, db=uow.session)
+
+@app.delete("/tariffs/{tariff_id}", response_model=schemas.TariffPlanRead, tags=["6. Tariffs (Billing Context)"])
+def deactivate_tariff(tariff_id: int, current_user: dict = Depends(get_current_user), uow: db.UnitOfWork = Depends(db.get_uow)):
+    """Nonaktifkan tarif (invoice lama tetap menyimpan snapshot tarifnya)"""
+    try:
+        updated = service.deactivate_tariff_plan(tariff_id, db=uow.session)
+        uow.commit()
         return updated
     except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=str(e))
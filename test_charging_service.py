@@ -6,7 +6,7 @@ from datetime import datetime, timedelta
 import json
 from datetime import datetime
 from unittest.mock import patch, MagicMock
-from app import service, models, auth, repository,db
+from app import service, models, auth, repository,db, read_models, geo, tariffs, availability, cache
 from app.schemas import (
     UserRegister, UserLogin, Token, TokenData,
     VehicleCreate, StationCreate, StationAssetCreate,
@@ -22,17 +22,12 @@ from app.schemas import (
 @patch("app.service.repository")
 def test_start_charging_success(mock_repo):
     mock_repo.get_user.return_value = MagicMock(id=1)
-    mock_repo.get_active_session_by_user.return_value = None
-
-    asset = MagicMock()
-    asset.is_available = True
-    asset.connector_port = MagicMock(max_power_supported=7.0)
-
-    mock_repo.get_station_asset.return_value = asset
-    mock_repo.create_charging_session.return_value = MagicMock(id=1)
+    mock_repo.execute_start_session_transaction.return_value = MagicMock(id=1)
 
     result = service.start_charging_session(1, 1)
     assert result.id == 1
+    kwargs = mock_repo.execute_start_session_transaction.call_args.kwargs
+    assert kwargs["user_id"] == 1 and kwargs["asset_id"] == 1
 
 
 @patch("app.service.repository")
@@ -45,7 +40,9 @@ def test_start_charging_user_not_found(mock_repo):
 @patch("app.service.repository")
 def test_start_charging_active_session_exists(mock_repo):
     mock_repo.get_user.return_value = MagicMock()
-    mock_repo.get_active_session_by_user.return_value = MagicMock()
+    mock_repo.execute_start_session_transaction.side_effect = ValueError(
+        "Anda masih memiliki sesi charging yang aktif"
+    )
     with pytest.raises(ValueError):
         service.start_charging_session(1, 1)
 
@@ -53,10 +50,9 @@ def test_start_charging_active_session_exists(mock_repo):
 @patch("app.service.repository")
 def test_start_charging_asset_not_available(mock_repo):
     mock_repo.get_user.return_value = MagicMock()
-    mock_repo.get_active_session_by_user.return_value = None
-
-    asset = MagicMock(is_available=False)
-    mock_repo.get_station_asset.return_value = asset
+    mock_repo.execute_start_session_transaction.side_effect = ValueError(
+        "Charger sedang tidak tersedia (Sedang digunakan atau Maintenance)"
+    )
 
     with pytest.raises(ValueError):
         service.start_charging_session(1, 1)
@@ -79,7 +75,8 @@ def test_calculate_session_details_manual_kwh():
 def test_calculate_session_details_connector_port_as_dict():
     session = MagicMock(
         charging_status=models.ChargingStatus.ONGOING,
-        start_time=datetime.utcnow() - timedelta(hours=1)
+        start_time=datetime.utcnow() - timedelta(hours=1),
+        metered_kwh=None
     )
     asset = MagicMock()
     # Simulate connector_port as dict (JSON from DB) to hit isinstance(cp, dict)
@@ -88,6 +85,18 @@ def test_calculate_session_details_connector_port_as_dict():
     result = service._calculate_session_details(session, asset)
     assert result["total_kwh"] == 11.0
 
+def test_calculate_session_details_prefers_metered_kwh():
+    session = MagicMock(
+        charging_status=models.ChargingStatus.ONGOING,
+        start_time=datetime.utcnow() - timedelta(hours=1),
+        metered_kwh=4.2
+    )
+    asset = MagicMock()
+    asset.connector_port = {"max_power_supported": 11.0}
+
+    assert service._calculate_session_details(session, asset)["total_kwh"] == 4.2
+    assert service._calculate_session_details(session, asset, manual_kwh=5)["total_kwh"] == 5
+
 def test_calculate_billing_positive():
     result = service._calculate_billing(5, 30)
     assert result["billing_total"] > result["total_cost"]
@@ -255,7 +264,7 @@ def test_station_schema():
 
 @patch("app.service.repository")
 def test_get_station_details_station_not_found(mock_repo):
-    mock_repo.get_station.return_value = None
+    mock_repo.get_station_detail.return_value = None
 
     with pytest.raises(ValueError, match="Station tidak ditemukan"):
         service.get_station_details(999)
@@ -373,8 +382,9 @@ def test_repository_get_user(mock_session):
 @patch("app.service.repository")
 def test_start_charging_asset_not_found(mock_repo):
     mock_repo.get_user.return_value = MagicMock()
-    mock_repo.get_active_session_by_user.return_value = None
-    mock_repo.get_station_asset.return_value = None 
+    mock_repo.execute_start_session_transaction.side_effect = ValueError(
+        "Station Asset tidak ditemukan"
+    )
 
     with pytest.raises(ValueError, match="Asset tidak ditemukan"):
         service.start_charging_session(user_id=1, asset_id=999)
@@ -411,7 +421,7 @@ def test_stop_charging_asset_not_found(mock_repo):
 
 @patch("app.service.repository")
 def test_get_station_details_station_not_found(mock_repo):
-    mock_repo.get_station.return_value = None
+    mock_repo.get_station_detail.return_value = None
 
     with pytest.raises(ValueError, match="Station tidak ditemukan"):
         service.get_station_details(999)
@@ -449,8 +459,8 @@ def test_get_station_details_success(mock_repo):
 
     assets = [asset1]
 
-    mock_repo.get_station.return_value = station
-    mock_repo.get_station_assets_by_station.return_value = assets
+    station.station_assets = assets
+    mock_repo.get_station_detail.return_value = station
 
     result = service.get_station_details(1)
 
@@ -487,8 +497,8 @@ def test_get_station_details_defensive_coding(mock_repo):
 
     assets = [asset_bad]
 
-    mock_repo.get_station.return_value = station
-    mock_repo.get_station_assets_by_station.return_value = assets
+    station.station_assets = assets
+    mock_repo.get_station_detail.return_value = station
 
     result = service.get_station_details(99)
 
@@ -535,7 +545,7 @@ def test_list_users(mock_session):
     mock_s.exec.return_value.all.return_value = []
 
     result = repository.list_users()
-    assert result == []
+    assert result.items == []
 
 
 @patch("app.repository.get_db_session")
@@ -545,7 +555,7 @@ def test_search_station_by_operator(mock_session):
     mock_s.exec.return_value.all.return_value = ["station"]
 
     result = repository.search_stations_by_operator("PLN")
-    assert result == ["station"]
+    assert result.items == ["station"]
 
 
 @patch("app.repository.get_db_session")
@@ -598,7 +608,8 @@ def test_execute_stop_session_transaction(mock_session):
 
     db_asset = MagicMock(asset_id=2)
 
-    # Configure s.get to return db_session then db_asset
+    # Conditional UPDATE matched the ONGOING row; s.get returns db_session then db_asset
+    mock_s.exec.return_value.rowcount = 1
     mock_s.get.side_effect = [db_session, db_asset]
 
 
@@ -674,10 +685,14 @@ def test_dumps_with_datetime():
 # init_db
 # =====================================================
 
+@patch("app.db.create_missing_indexes")
+@patch("app.db.create_missing_columns")
 @patch("app.db.SQLModel.metadata.create_all")
-def test_init_db(mock_create_all):
+def test_init_db(mock_create_all, mock_create_columns, mock_create_indexes):
     db.init_db()
     mock_create_all.assert_called_once_with(db.engine)
+    mock_create_columns.assert_called_once_with(db.engine)
+    mock_create_indexes.assert_called_once_with(db.engine)
 
 
 # =====================================================
@@ -704,6 +719,8 @@ class MockSession:
         self.refresh = MagicMock()
         self.get = MagicMock()
         self.exec = MagicMock()
+        self.flush = MagicMock()
+        self.rollback = MagicMock()
 
     def __enter__(self):
         return self
@@ -768,7 +785,7 @@ def test_list_users(mock_get_session):
     mock_get_session.return_value = session
 
     result = repository.list_users()
-    assert result == []
+    assert result.items == []
 
 
 # =====================================================
@@ -787,7 +804,7 @@ def test_vehicle_functions(mock_get_session):
     repository.create_vehicle(vehicle)
     assert repository.get_vehicle(1) == vehicle
     assert repository.get_vehicle_by_plate("B1234") == vehicle
-    assert repository.get_vehicles_by_user(1) == [vehicle]
+    assert repository.get_vehicles_by_user(1).items == [vehicle]
 
 
 # =====================================================
@@ -804,8 +821,8 @@ def test_station_functions(mock_get_session):
 
     repository.create_station(station)
     assert repository.get_station(1) == station
-    assert repository.list_stations() == [station]
-    assert repository.search_stations_by_operator("PLN") == [station]
+    assert repository.list_stations().items == [station]
+    assert repository.search_stations_by_operator("PLN").items == [station]
 
 
 # =====================================================
@@ -845,49 +862,27 @@ def test_charging_session_functions(mock_get_session):
     repository.update_charging_session(charging_session)
 
     assert repository.get_charging_session(1) == charging_session
-    assert repository.get_charging_sessions_by_user(1) == [charging_session]
+    assert repository.get_charging_sessions_by_user(1).items == [charging_session]
     assert repository.get_active_session_by_user(1) == charging_session
 
 @patch("app.service.repository")
 def test_get_charging_session_details_not_found(mock_repo):
-    mock_repo.get_charging_session.return_value = None
+    mock_repo.get_charging_session_detail.return_value = None
 
     with pytest.raises(ValueError, match="Session tidak ditemukan"):
         service.get_charging_session_details(999)
 
-@patch("app.service.repository")
-def test_get_charging_session_details_invoice_none(mock_repo):
-    session = MagicMock()
-    session.id = 10
-    session.user_id = 1
-    session.asset_id = 2
-
-    mock_repo.get_charging_session.return_value = session
-    mock_repo.get_user.return_value = MagicMock()
-    mock_repo.get_station_asset.return_value = MagicMock()
-    mock_repo.get_invoice_by_session.return_value = None  # 🔥 INI KUNCINYA
-
-    result = service.get_charging_session_details(10)
-
-    assert result["invoice"] is None
-
 @patch("app.service.repository")
 def test_get_charging_session_details_success(mock_repo):
     session = MagicMock()
-    session.id = 10
-    session.user_id = 1
-    session.asset_id = 2
-
-    mock_repo.get_charging_session.return_value = session
-    mock_repo.get_user.return_value = MagicMock()
-    mock_repo.get_station_asset.return_value = MagicMock()
-    mock_repo.get_invoice_by_session.return_value = MagicMock()
+    mock_repo.get_charging_session_detail.return_value = session
 
-    result = service.get_charging_session_details(10)
+    result = service.get_charging_session_details(10, user_id=1)
 
-    assert "user" in result
-    assert "station_asset" in result
-    assert "invoice" in result
+    assert result is session
+    mock_repo.get_charging_session_detail.assert_called_once_with(10, user_id=1, db=None)
+    mock_repo.get_user.assert_not_called()
+    mock_repo.get_invoice_by_session.assert_not_called()
 
 # =====================================================
 # STOP SESSION TRANSACTION
@@ -904,7 +899,8 @@ def test_execute_stop_session_transaction(mock_get_session):
     db_asset = MagicMock()
     db_asset.asset_id = 1
 
-    # Side effect untuk s.get: session lalu asset
+    # Conditional UPDATE matched the ONGOING row; s.get: session lalu asset
+    session_db.exec.return_value.rowcount = 1
     session_db.get.side_effect = [db_session, db_asset]
     mock_get_session.return_value = session_db
 
@@ -926,38 +922,45 @@ def test_execute_stop_session_transaction(mock_get_session):
     session_db.refresh.assert_called_once_with(db_session)
 
 
+_STOP_DETAILS = {
+    "end_time": datetime(2025, 1, 1, 11, 0),
+    "duration_minutes": 60,
+    "total_kwh": 10,
+    "total_cost": 5000,
+    "billing_total": 5500,
+}
+
 @patch("app.repository.get_db_session")
 def test_execute_stop_session_transaction_not_found(mock_get_session):
     session_db = mock_session()
     mock_get_session.return_value = session_db
 
-    # Simulate re-fetch returning None (first call for session returns None)
-    session_db.get.side_effect = [None, MagicMock()]
+    # Session closed, but the asset is gone
+    session_db.exec.return_value.rowcount = 1
+    session_db.get.side_effect = [MagicMock(), None]
 
     session = MagicMock(session_id=1)
     asset = MagicMock(asset_id=1)
     
-    with pytest.raises(ValueError, match="Session or Asset not found during transaction"):
-        repository.execute_stop_session_transaction(session, asset, {}, MagicMock())
+    with pytest.raises(ValueError, match="Station Asset tidak ditemukan"):
+        repository.execute_stop_session_transaction(session, asset, _STOP_DETAILS, MagicMock())
+    session_db.commit.assert_not_called()
 
 @patch("app.repository.get_db_session")
 def test_execute_stop_session_transaction_already_stopped(mock_get_session):
     session_db = mock_session()
     mock_get_session.return_value = session_db
 
-    # Simulate re-fetch returning objects, but session is already STOPPED
-    db_session = MagicMock()
-    db_session.charging_status = models.ChargingStatus.STOPPED
-    db_asset = MagicMock()
-    
-    # side_effect for s.get calls: first for session, second for asset
-    session_db.get.side_effect = [db_session, db_asset]
+    # Another stop already closed it: the conditional UPDATE matches no ONGOING row
+    session_db.exec.return_value.rowcount = 0
 
     session = MagicMock(session_id=1)
     asset = MagicMock(asset_id=1)
     
     with pytest.raises(ValueError, match="Session sudah berakhir"):
-        repository.execute_stop_session_transaction(session, asset, {}, MagicMock())
+        repository.execute_stop_session_transaction(session, asset, _STOP_DETAILS, MagicMock())
+    session_db.get.assert_not_called()
+    session_db.add.assert_not_called()
 
 # =====================================================
 # INVOICE
@@ -976,5 +979,2241 @@ def test_invoice_functions(mock_get_session):
     repository.update_invoice(invoice)
 
     assert repository.get_invoice(1) == invoice
-    assert repository.get_invoices_by_user(1) == [invoice]
+    assert repository.get_invoices_by_user(1).items == [invoice]
     assert repository.get_invoice_by_session(1) == invoice
+
+
+# =====================================================
+# UNIT OF WORK (request-scoped session)
+# =====================================================
+
+from sqlmodel import SQLModel, Session, create_engine
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path, monkeypatch):
+    """Real SQLite file database swapped in for app.db.engine."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        connect_args={"check_same_thread": False},
+        json_serializer=db.dumps
+    )
+    monkeypatch.setattr(db, "engine", engine)
+    db.init_db()
+    read_models.station_details.clear()
+    geo.station_index.clear()
+    tariffs.tariff_book.clear()
+    availability.asset_index.clear()
+    cache.response_cache.clear()
+    yield engine
+    engine.dispose()
+    read_models.station_details.clear()
+    geo.station_index.clear()
+    tariffs.tariff_book.clear()
+    availability.asset_index.clear()
+    cache.response_cache.clear()
+
+
+def _new_user(email="uow@mail.com"):
+    return models.User(name="UoW", email=email, password_hash="x")
+
+
+def test_save_with_session_flushes_without_commit():
+    s = MagicMock()
+    obj = MagicMock()
+
+    result = repository._save(obj, db=s)
+
+    s.add.assert_called_once_with(obj)
+    s.flush.assert_called_once()
+    s.commit.assert_not_called()
+    assert result == obj
+
+
+def test_unit_of_work_rolls_back_without_commit(sqlite_engine):
+    with db.UnitOfWork() as uow:
+        repository.create_user(_new_user(), db=uow.session)
+
+    assert repository.get_user_by_email("uow@mail.com") is None
+
+
+def test_unit_of_work_commit_persists_and_shares_identity_map(sqlite_engine):
+    with db.UnitOfWork() as uow:
+        user = repository.create_user(_new_user(), db=uow.session)
+        assert user.user_id is not None
+        # Same session: served from the identity map, same instance
+        assert repository.get_user(user.user_id, db=uow.session) is user
+        uow.commit()
+        # expire_on_commit=False keeps attributes readable after commit
+        assert user.email == "uow@mail.com"
+
+    assert repository.get_user_by_email("uow@mail.com").user_id == user.user_id
+
+
+def test_get_uow_dependency_yields_unit_of_work(sqlite_engine):
+    gen = db.get_uow()
+    uow = next(gen)
+    assert isinstance(uow, db.UnitOfWork)
+    assert isinstance(uow.session, Session)
+    with pytest.raises(StopIteration):
+        next(gen)
+
+
+def test_execute_stop_session_transaction_with_uow_flushes():
+    s = MagicMock()
+    db_session = MagicMock(charging_status=models.ChargingStatus.ONGOING, session_id=1, user_id=1)
+    s.exec.return_value.rowcount = 1
+    s.get.side_effect = [db_session, MagicMock()]
+    details = {
+        "end_time": datetime.utcnow(),
+        "duration_minutes": 1,
+        "total_kwh": 1,
+        "total_cost": 1,
+        "billing_total": 1,
+    }
+
+    result = repository.execute_stop_session_transaction(
+        MagicMock(session_id=1), MagicMock(asset_id=1), details, MagicMock(), db=s
+    )
+
+    assert result == db_session
+    s.flush.assert_called_once()
+    s.commit.assert_not_called()
+
+
+@patch("app.service.repository")
+def test_service_passes_unit_of_work_session(mock_repo):
+    s = MagicMock()
+    mock_repo.get_invoice.return_value = MagicMock()
+
+    service.update_invoice_payment(1, "Completed", "cash", db=s)
+
+    mock_repo.get_invoice.assert_called_once_with(1, db=s)
+    mock_repo.update_invoice.assert_called_once()
+    assert mock_repo.update_invoice.call_args.kwargs["db"] is s
+
+
+# =====================================================
+# ATOMIC ASSET RESERVATION (real SQLite)
+# =====================================================
+
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func
+from sqlmodel import select
+
+
+def _seed_assets(n_assets=1, n_users=1):
+    with db.get_session() as s:
+        station = models.Station(
+            station_operator="PLN",
+            location=models.Location(latitude=0, longitude=0, address="A"),
+            connector_list=["CCS"]
+        )
+        s.add(station)
+        s.flush()
+        assets = [
+            models.StationAsset(
+                station_id=station.station_id, model=f"M{i}",
+                connector_port=models.ConnectorPort(standard_name="CCS", max_power_supported=50)
+            )
+            for i in range(n_assets)
+        ]
+        users = [_new_user(f"u{i}@mail.com") for i in range(n_users)]
+        s.add_all(assets + users)
+        s.commit()
+        return [a.asset_id for a in assets], [u.user_id for u in users]
+
+
+def _start(user_id, asset_id):
+    try:
+        return service.start_charging_session(user_id, asset_id)
+    except ValueError as e:
+        return str(e)
+
+
+def _ongoing_count():
+    with db.get_session() as s:
+        return s.exec(
+            select(func.count()).select_from(models.ChargingSession)
+            .where(models.ChargingSession.charging_status == models.ChargingStatus.ONGOING)
+        ).one()
+
+
+def test_reserve_station_asset_only_once(sqlite_engine):
+    (asset_id,), _ = _seed_assets()
+
+    assert repository.reserve_station_asset(asset_id) is True
+    assert repository.reserve_station_asset(asset_id) is False
+    assert repository.get_station_asset(asset_id).is_available is False
+
+
+def test_start_session_transaction_errors(sqlite_engine):
+    (asset_id, other_asset), (user_id, other_user) = _seed_assets(n_assets=2, n_users=2)
+
+    with pytest.raises(ValueError, match="Asset tidak ditemukan"):
+        repository.execute_start_session_transaction(user_id, 999, datetime.utcnow())
+
+    session = repository.execute_start_session_transaction(user_id, asset_id, datetime.utcnow())
+    assert session.charging_status == models.ChargingStatus.ONGOING
+
+    with pytest.raises(ValueError, match="tidak tersedia"):
+        repository.execute_start_session_transaction(other_user, asset_id, datetime.utcnow())
+
+    with pytest.raises(ValueError, match="sesi charging yang aktif"):
+        repository.execute_start_session_transaction(user_id, other_asset, datetime.utcnow())
+    # The failed start must not leave its asset reserved
+    assert repository.get_station_asset(other_asset).is_available is True
+
+
+def test_concurrent_starts_on_one_charger(sqlite_engine):
+    (asset_id,), user_ids = _seed_assets(n_assets=1, n_users=200)
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = list(pool.map(lambda u: _start(u, asset_id), user_ids))
+
+    started = [r for r in results if isinstance(r, models.ChargingSession)]
+    assert len(started) == 1
+    assert all("tidak tersedia" in r for r in results if isinstance(r, str))
+    assert _ongoing_count() == 1
+
+
+def test_concurrent_starts_by_one_user(sqlite_engine):
+    asset_ids, (user_id,) = _seed_assets(n_assets=50, n_users=1)
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = list(pool.map(lambda a: _start(user_id, a), asset_ids))
+
+    started = [r for r in results if isinstance(r, models.ChargingSession)]
+    assert len(started) == 1
+    assert _ongoing_count() == 1
+    reserved = [a for a in asset_ids if not repository.get_station_asset(a).is_available]
+    assert reserved == [started[0].asset_id]
+
+
+def test_stop_with_stale_unit_of_work_is_rejected(sqlite_engine):
+    (asset_id,), (user_id,) = _seed_assets()
+    session_id = service.start_charging_session(user_id, asset_id).session_id
+
+    real_resolve = service.resolve_tariff
+
+    def resolve_while_another_stop_commits(*args, **kwargs):
+        with patch("app.service.resolve_tariff", real_resolve):
+            service.stop_charging_session(session_id, manual_kwh=1)
+        return real_resolve(*args, **kwargs)
+
+    with db.UnitOfWork() as uow:
+        # This request already read the session as ONGOING when the other stop commits
+        with patch("app.service.resolve_tariff", side_effect=resolve_while_another_stop_commits), \
+                pytest.raises(ValueError, match="^Session sudah berakhir$"):
+            service.stop_charging_session(session_id, manual_kwh=2, db=uow.session)
+
+    with db.get_session() as s:
+        invoices = s.exec(select(models.Invoice).where(models.Invoice.session_id == session_id)).all()
+    assert [i.billing_total for i in invoices] == [repository.get_invoice_by_session(session_id).billing_total]
+    assert repository.get_charging_session(session_id).total_kwh == 1
+
+
+def test_concurrent_stops_bill_once(sqlite_engine):
+    (asset_id,), (user_id,) = _seed_assets()
+    session_id = service.start_charging_session(user_id, asset_id).session_id
+
+    def stop(_):
+        try:
+            return service.stop_charging_session(session_id, manual_kwh=1)
+        except ValueError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(stop, range(8)))
+
+    assert len([r for r in results if isinstance(r, models.ChargingSession)]) == 1
+    assert all("berakhir" in r for r in results if isinstance(r, str))
+    with db.get_session() as s:
+        assert s.exec(select(func.count()).select_from(models.Invoice)).one() == 1
+
+# =====================================================
+# INDEX AUDIT
+# =====================================================
+
+from app import index_audit
+
+
+def test_index_audit_finds_no_unexpected_scans(sqlite_engine):
+    results = index_audit.run_audit(sqlite_engine)
+
+    names = {r.name for r in results}
+    assert {"get_user_by_email", "get_active_session_by_user", "get_invoices_by_user"} <= names
+    assert [r.name for r in results if r.flagged] == []
+
+
+def test_index_audit_flags_missing_index(sqlite_engine):
+    with sqlite_engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_user_email")
+
+    results = index_audit.run_audit(sqlite_engine)
+
+    flagged = [r.name for r in results if r.flagged]
+    assert flagged == ["get_user_by_email"]
+
+
+def test_create_missing_indexes_upgrades_existing_tables(sqlite_engine):
+    with sqlite_engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_invoice_user_id_invoice_id")
+
+    db.create_missing_indexes(sqlite_engine)
+
+    results = index_audit.run_audit(sqlite_engine)
+    assert not any(r.flagged for r in results)
+
+
+# =====================================================
+# KEYSET PAGINATION (real SQLite)
+# =====================================================
+
+def _collect_pages(fetch, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        page = fetch(limit=limit, cursor=cursor)
+        assert len(page.items) <= limit
+        items.extend(page.items)
+        pages += 1
+        if page.next_cursor is None:
+            return items, pages
+        cursor = page.next_cursor
+
+
+def test_keyset_pagination_walks_all_rows(sqlite_engine):
+    _, user_ids = _seed_assets(n_users=7)
+
+    users, pages = _collect_pages(repository.list_users, limit=3)
+
+    assert [u.user_id for u in users] == sorted(user_ids)
+    assert pages == 3
+
+
+def test_keyset_pagination_exact_multiple_has_no_empty_page(sqlite_engine):
+    _seed_assets(n_users=6)
+
+    first = repository.list_users(limit=3)
+    second = repository.list_users(limit=3, cursor=first.next_cursor)
+
+    assert first.next_cursor is not None
+    assert len(second.items) == 3 and second.next_cursor is None
+
+
+def test_keyset_pagination_newest_first_for_user_history(sqlite_engine):
+    asset_ids, (user_id,) = _seed_assets(n_assets=5)
+    for asset_id in asset_ids:
+        session = repository.execute_start_session_transaction(user_id, asset_id, datetime.utcnow())
+        session.charging_status = models.ChargingStatus.STOPPED
+        repository.update_charging_session(session)
+
+    sessions, _ = _collect_pages(
+        lambda **page: repository.get_charging_sessions_by_user(user_id, **page), limit=2
+    )
+
+    ids = [s.session_id for s in sessions]
+    assert ids == sorted(ids, reverse=True) and len(ids) == 5
+
+
+def test_list_station_assets_filters(sqlite_engine):
+    asset_ids, _ = _seed_assets(n_assets=4)
+    repository.reserve_station_asset(asset_ids[0])
+
+    assert len(repository.list_station_assets().items) == 4
+    available = repository.list_station_assets(available_only=True, limit=2)
+    assert [a.asset_id for a in available.items] == asset_ids[1:3]
+    assert available.next_cursor == asset_ids[2]
+
+
+# =====================================================
+# AUTH — BCRYPT HASHING POOL
+# =====================================================
+
+import time
+from fastapi.testclient import TestClient
+
+
+def test_password_needs_rehash(monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 5)
+    assert not auth.password_needs_rehash(auth.get_password_hash("pw"))
+    assert auth.password_needs_rehash(auth.get_password_hash("pw", rounds=4))
+    assert auth.password_needs_rehash("not-a-bcrypt-hash")
+
+
+def test_hashing_pool_runs_in_worker_process():
+    pool = auth.HashingPool(size=1, queue_limit=4)
+    try:
+        async def scenario():
+            hashed = await pool.run(auth.get_password_hash, "secret", 4)
+            ok = await pool.run(auth.verify_password, "secret", hashed)
+            bad = await pool.run(auth.verify_password, "wrong", hashed)
+            return hashed, ok, bad
+
+        hashed, ok, bad = asyncio.run(scenario())
+        # Workers are not fork()ed from the threaded server process
+        assert pool._executor._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        pool.shutdown()
+
+    assert hashed.startswith("$2b$04$")
+    assert ok is True and bad is False
+    stats = pool.stats()
+    assert stats["queue_depth"] == 0 and stats["completed"] == 3
+
+
+def test_hashing_pool_rejects_when_queue_full():
+    pool = auth.HashingPool(size=0, queue_limit=2)
+
+    async def scenario():
+        return await asyncio.gather(
+            *(pool.run(time.sleep, 0.05) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 1 and rejected[0].status_code == 503
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["queue_depth"] == 0
+
+
+def test_login_rehashes_when_cost_changes(sqlite_engine, monkeypatch):
+    import main
+    monkeypatch.setattr(auth, "hashing_pool", auth.HashingPool(size=0))
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+    client = TestClient(main.app)
+
+    r = client.post("/auth/register", json={"name": "A", "email": "re@mail.com", "password": "pw"})
+    assert r.status_code == 200
+    assert repository.get_user_by_email("re@mail.com").password_hash.startswith("$2b$04$")
+
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 5)
+    r = client.post("/auth/login", json={"email": "re@mail.com", "password": "pw"})
+    assert r.status_code == 200
+    stored = repository.get_user_by_email("re@mail.com").password_hash
+    assert stored.startswith("$2b$05$") and auth.verify_password("pw", stored)
+
+    r = client.post("/auth/login", json={"email": "re@mail.com", "password": "wrong"})
+    assert r.status_code == 401
+
+
+# =====================================================
+# AUTH — VERIFIED TOKEN CACHE
+# =====================================================
+
+@pytest.fixture
+def fresh_token_cache(monkeypatch):
+    cache = auth.TokenCache(maxsize=2, ttl=300)
+    monkeypatch.setattr(auth, "token_cache", cache)
+    return cache
+
+
+def test_token_cache_skips_reverification(fresh_token_cache):
+    token = auth.create_access_token({"sub": "7", "email": "c@mail.com"})
+
+    with patch("app.auth.jwt.decode", wraps=auth.jwt.decode) as decode:
+        first = auth.decode_access_token(token)
+        second = auth.decode_access_token(token)
+
+    assert decode.call_count == 1
+    assert first == second and second["sub"] == "7"
+
+
+def test_token_cache_respects_exp(fresh_token_cache):
+    payload = {"sub": "1", "exp": time.time() - 1}
+    fresh_token_cache.put("expired-token", payload)
+    assert fresh_token_cache.get("expired-token") is None
+
+    fresh_token_cache.put("valid-token", {"sub": "1", "exp": time.time() + 60})
+    assert fresh_token_cache.get("valid-token")["sub"] == "1"
+
+
+def test_token_cache_is_bounded_lru(fresh_token_cache):
+    fresh_token_cache.put("a", {"sub": "a"})
+    fresh_token_cache.put("b", {"sub": "b"})
+    fresh_token_cache.get("a")          # a becomes most recently used
+    fresh_token_cache.put("c", {"sub": "c"})
+
+    assert len(fresh_token_cache) == 2
+    assert fresh_token_cache.get("b") is None
+    assert fresh_token_cache.get("a") is not None
+
+
+def test_token_cache_does_not_store_invalid_tokens(fresh_token_cache):
+    with pytest.raises(HTTPException):
+        auth.decode_access_token("invalid.token.here")
+    assert len(fresh_token_cache) == 0
+
+
+# =====================================================
+# ASYNC ENGINE / ASYNC REPOSITORY (real SQLite via aiosqlite)
+# =====================================================
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from app import async_repository, async_service
+
+
+@pytest.fixture
+def async_sqlite_engine(sqlite_engine, monkeypatch):
+    """Async engine on the same SQLite file as sqlite_engine."""
+    engine = create_async_engine(
+        str(sqlite_engine.url).replace("sqlite://", "sqlite+aiosqlite://"),
+        poolclass=NullPool,
+        json_serializer=db.dumps
+    )
+    monkeypatch.setattr(db, "async_engine", engine)
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+def test_async_url_mapping():
+    assert db._async_url("sqlite:///./ev.db") == "sqlite+aiosqlite:///./ev.db"
+    assert db._async_url("postgresql://u:p@h/db") == "postgresql+asyncpg://u:p@h/db"
+    assert db._async_url("postgresql+psycopg2://u:p@h/db") == "postgresql+asyncpg://u:p@h/db"
+
+
+def test_async_repository_reads_and_pages(async_sqlite_engine):
+    (asset_id,), (user_id,) = _seed_assets()
+    session_ids = []
+    for _ in range(5):
+        session_ids.append(service.start_charging_session(user_id, asset_id).session_id)
+        service.stop_charging_session(session_ids[-1], manual_kwh=1)
+
+    async def scenario():
+        async with db.AsyncUnitOfWork() as uow:
+            first = await async_repository.get_charging_sessions_by_user(user_id, limit=3, db=uow.session)
+            second = await async_repository.get_charging_sessions_by_user(user_id, limit=3, cursor=first.next_cursor, db=uow.session)
+            newest = await async_repository.get_charging_session(session_ids[-1], db=uow.session)
+            # Identity map: the primary-key lookup returns the already loaded instance
+            assert newest is first.items[0]
+            return [c.session_id for c in first.items + second.items], second.next_cursor
+
+    ids, next_cursor = asyncio.run(scenario())
+
+    assert ids == session_ids[::-1]
+    assert next_cursor is None
+
+
+def test_async_session_details_after_stop(async_sqlite_engine):
+    (asset_id,), (user_id, other_id) = _seed_assets(n_users=2)
+    started = service.start_charging_session(user_id, asset_id)
+    service.stop_charging_session(started.session_id, manual_kwh=3.0)
+
+    async def scenario():
+        details = await async_service.get_charging_session_details(started.session_id, user_id=user_id)
+        try:
+            await async_service.get_charging_session_details(started.session_id, user_id=other_id)
+        except ValueError as e:
+            return details, str(e)
+
+    details, error = asyncio.run(scenario())
+
+    assert details.charging_status == models.ChargingStatus.STOPPED
+    assert details.invoice.cost_total > 0
+    assert error == "Session tidak ditemukan"
+
+
+def test_active_session_endpoint_uses_async_path(async_sqlite_engine):
+    import main
+    (asset_id,), (user_id,) = _seed_assets()
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+
+    assert client.get("/charging-sessions/me/active", headers=headers).status_code == 404
+
+    started = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=headers)
+    assert started.status_code == 200
+
+    with patch("main.repository.get_active_session_by_user") as sync_lookup:
+        active = client.get("/charging-sessions/me/active", headers=headers)
+    sync_lookup.assert_not_called()
+    assert active.status_code == 200
+    assert active.json()["session_id"] == started.json()["session_id"]
+    assert active.json()["station_asset"]["is_available"] is False
+
+    history = client.get("/charging-sessions/me", headers=headers).json()
+    assert [s["session_id"] for s in history["items"]] == [started.json()["session_id"]]
+
+
+# =====================================================
+# SESSION DETAIL: ONE JOINED QUERY
+# =====================================================
+
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+@contextmanager
+def _count_statements(engine):
+    statements = []
+
+    def record(_conn, _cursor, statement, _parameters, _context, _executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_session_detail_loads_relations_in_one_query(sqlite_engine):
+    (asset_id,), (owner_id, other_id) = _seed_assets(n_users=2)
+    started = _start(owner_id, asset_id)
+    service.stop_charging_session(started.session_id, manual_kwh=2.0)
+
+    with db.UnitOfWork() as uow, _count_statements(sqlite_engine) as statements:
+        detail = repository.get_charging_session_detail(started.session_id, user_id=owner_id, db=uow.session)
+        loaded = (detail.user.user_id, detail.station_asset.asset_id, detail.invoice.session_id)
+
+    assert len(statements) == 1
+    assert loaded == (owner_id, asset_id, started.session_id)
+    assert repository.get_charging_session_detail(started.session_id, user_id=other_id) is None
+    assert repository.get_active_session_detail(owner_id) is None
+
+
+def test_session_detail_endpoints_single_round_trip(async_sqlite_engine):
+    import main
+    (asset_id,), (owner_id, other_id) = _seed_assets(n_users=2)
+    client = TestClient(main.app)
+    owner = {"Authorization": f"Bearer {auth.create_access_token({'sub': owner_id})}"}
+    other = {"Authorization": f"Bearer {auth.create_access_token({'sub': other_id})}"}
+    session_id = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=owner).json()["session_id"]
+
+    with _count_statements(async_sqlite_engine.sync_engine) as statements:
+        active = client.get("/charging-sessions/me/active", headers=owner)
+    assert active.status_code == 200
+    assert active.json()["user"]["user_id"] == owner_id
+    assert active.json()["invoice"] is None
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
+
+    with _count_statements(async_sqlite_engine.sync_engine) as statements:
+        detail = client.get(f"/charging-sessions/{session_id}", headers=owner)
+    assert detail.status_code == 200
+    assert detail.json()["station_asset"]["asset_id"] == asset_id
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
+
+    # Ownership is part of the query: someone else's session does not exist for them
+    assert client.get(f"/charging-sessions/{session_id}", headers=other).status_code == 404
+
+
+# =====================================================
+# STATION DETAIL READ MODEL / CHANGE EVENTS
+# =====================================================
+
+from app import events
+
+
+def _station_id_of(asset_id):
+    return repository.get_station_asset(asset_id).station_id
+
+
+def test_read_model_serves_warm_hits_without_db(sqlite_engine):
+    (asset_id,), _ = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    model = read_models.StationDetailReadModel()
+
+    body = model.get(station_id)
+    with _count_statements(sqlite_engine) as statements, \
+            patch("app.read_models.service.get_station_details") as build:
+        assert model.get(station_id) is body
+    build.assert_not_called()
+    assert statements == []
+    assert (model.hits, model.misses) == (1, 1)
+    assert json.loads(body) == json.loads(service.get_station_details(station_id).model_dump_json())
+
+
+def test_read_model_invalidated_on_commit_only(sqlite_engine):
+    (asset_id, other_asset), (user_id,) = _seed_assets(n_assets=2)
+    station_id = _station_id_of(asset_id)
+    model = read_models.StationDetailReadModel()
+    events.subscribe(model.invalidate)
+    try:
+        model.get(station_id)
+
+        # Rolled back reservation: nothing published, entry stays
+        with db.UnitOfWork() as uow:
+            assert repository.reserve_station_asset(asset_id, db=uow.session)
+        assert len(model) == 1
+
+        # Bulk UPDATE (reservation) only knows the asset id
+        _start(user_id, asset_id)
+        assert len(model) == 0
+        assets = json.loads(model.get(station_id))["station_assets"]
+        assert [a["is_available"] for a in assets] == [False, True]
+
+        # ORM flush (maintenance log)
+        service.add_maintenance_log(other_asset, "Kabel rusak")
+        assert len(model) == 0
+        assets = json.loads(model.get(station_id))["station_assets"]
+        assert assets[1]["maintenance_log"]["error_log"] == "Kabel rusak"
+    finally:
+        events.unsubscribe(model.invalidate)
+
+
+def test_read_model_ignores_changes_to_other_entities(sqlite_engine):
+    (asset_id,), _ = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    model = read_models.StationDetailReadModel()
+    model.get(station_id)
+
+    # A tariff row whose id equals a cached asset id must not evict that station
+    model.invalidate([
+        events.Change("tariff_plan", asset_id, None, "update", {"cost_per_kwh": 5.0}),
+        events.Change("tariff_band", asset_id, None, "insert", {})
+    ])
+    assert len(model) == 1
+    model.invalidate([events.Change("station_asset", asset_id, None, "update", {"is_available": False})])
+    assert len(model) == 0
+
+
+def test_read_model_does_not_store_build_that_raced_a_commit(sqlite_engine):
+    (asset_id,), _ = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    model = read_models.StationDetailReadModel()
+    real_build = service.get_station_details
+
+    def build_then_commit(*args, **kwargs):
+        detail = real_build(*args, **kwargs)
+        model.invalidate([events.Change("station_asset", asset_id, station_id, "update")])
+        return detail
+
+    with patch("app.read_models.service.get_station_details", side_effect=build_then_commit):
+        model.get(station_id)
+    assert len(model) == 0
+
+
+def test_read_model_coalesces_concurrent_misses(sqlite_engine):
+    (asset_id,), _ = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    model = read_models.StationDetailReadModel()
+    real_build = service.get_station_details
+    builds = []
+    release = threading.Event()
+
+    def slow_build(*args, **kwargs):
+        builds.append(1)
+        release.wait(1)
+        return real_build(*args, **kwargs)
+
+    results = []
+    with patch("app.read_models.service.get_station_details", side_effect=slow_build):
+        threads = [threading.Thread(target=lambda: results.append(model.lookup(station_id))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+    assert len(builds) == 1
+    assert len({body for body, _ in results}) == 1 and len(results) == 8
+    assert (model.misses, model.coalesced) == (1, 7)
+    assert len(model) == 1
+
+def test_station_endpoint_uses_read_model(sqlite_engine):
+    import main
+    (asset_id,), _ = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    client = TestClient(main.app)
+
+    with _count_statements(sqlite_engine) as cold:
+        first = client.get(f"/stations/{station_id}")
+    with _count_statements(sqlite_engine) as statements:
+        second = client.get(f"/stations/{station_id}")
+
+    assert first.status_code == 200
+    assert second.content == first.content
+    assert len(cold) == 1 and "LEFT OUTER JOIN station_asset" in cold[0]
+    assert statements == []
+    assert first.json()["station_assets"][0]["asset_id"] == asset_id
+    assert client.get("/stations/999").status_code == 404
+
+    empty_station, () = _add_station(1.0, 1.0, n_assets=0)
+    assert client.get(f"/stations/{empty_station}").json()["station_assets"] == []
+
+
+# =====================================================
+# NEARBY SEARCH (GEO INDEX)
+# =====================================================
+
+import random
+from types import SimpleNamespace
+from sqlalchemy import inspect, text
+
+
+def test_geo_index_matches_brute_force():
+    rng = random.Random(7)
+    index = geo.StationGeoIndex(cell_degrees=0.05)
+    points = {i: (rng.uniform(-6.4, -6.0), rng.uniform(106.6, 107.0)) for i in range(2000)}
+    index._loaded = True
+    index.apply([
+        events.Change("station", i, i, "insert", {"latitude": lat, "longitude": lon, "connector_list": ["CCS"]})
+        for i, (lat, lon) in points.items()
+    ])
+
+    center = (-6.2, 106.8)
+    expected = sorted(
+        (i, geo.haversine_km(*center, lat, lon))
+        for i, (lat, lon) in points.items()
+        if geo.haversine_km(*center, lat, lon) <= 7.5
+    )
+    found = index.nearby(*center, 7.5)
+
+    assert sorted(found) == expected
+    assert [d for _, d in found] == sorted(d for _, d in found)
+    assert index.nearby(*center, 7.5, connector="CHAdeMO") == []
+
+    index.apply([events.Change("station", found[0][0], None, "delete")])
+    assert found[0][0] not in [i for i, _ in index.nearby(*center, 7.5)]
+
+
+def _add_station(lat, lon, connectors=("CCS",), n_assets=1, asset_connector="CCS"):
+    with db.get_session() as s:
+        station = models.Station(
+            station_operator="PLN",
+            location=models.Location(latitude=lat, longitude=lon, address="A"),
+            connector_list=list(connectors)
+        )
+        s.add(station)
+        s.flush()
+        assets = [
+            models.StationAsset(
+                station_id=station.station_id, model="M",
+                connector_port=models.ConnectorPort(standard_name=asset_connector, max_power_supported=50)
+            )
+            for _ in range(n_assets)
+        ]
+        s.add_all(assets)
+        s.commit()
+        return station.station_id, [a.asset_id for a in assets]
+
+
+def test_geo_index_serves_lookups_and_replays_writes_during_a_load(sqlite_engine):
+    first, _ = _add_station(-6.2, 106.8)
+    index = geo.StationGeoIndex()
+    events.subscribe(index.apply)
+    added = []
+
+    class QueryThenWrite(Session):
+        def exec(self, statement, *args, **kwargs):
+            rows = super().exec(statement, *args, **kwargs).all()
+            # The table scan does not hold the index lock...
+            assert index._lock.acquire(timeout=1)
+            index._lock.release()
+            # ...and a station committed meanwhile is replayed onto the new grid
+            added.append(_add_station(-6.21, 106.81)[0])
+            return SimpleNamespace(all=lambda: rows)
+
+    try:
+        with patch("app.geo.get_session", lambda: QueryThenWrite(sqlite_engine)):
+            index.load()
+    finally:
+        events.unsubscribe(index.apply)
+    assert index.loaded
+    assert sorted(i for i, _ in index.nearby(-6.2, 106.8, 5)) == [first, added[0]]
+
+def test_station_coordinate_columns_follow_location(sqlite_engine):
+    station_id, _ = _add_station(-6.2, 106.8)
+    station = repository.get_station(station_id)
+    assert (station.latitude, station.longitude) == (-6.2, 106.8)
+
+    with db.get_session() as s:
+        station = s.get(models.Station, station_id)
+        station.location = models.Location(latitude=-7.0, longitude=110.4, address="B")
+        s.add(station)
+        s.commit()
+    assert repository.get_station(station_id).latitude == -7.0
+
+
+def test_nearby_endpoint(sqlite_engine):
+    import main
+    near, (near_asset,) = _add_station(-6.2000, 106.8000)
+    mid, _ = _add_station(-6.2100, 106.8100, connectors=("CHAdeMO",), asset_connector="CHAdeMO")
+    _add_station(-6.9000, 107.6000)  # ~100 km away
+    (_,), (user_id,) = _seed_assets()
+    client = TestClient(main.app)
+    params = {"lat": -6.2, "lon": 106.8, "radius": 5}
+
+    body = client.get("/stations/nearby", params=params).json()
+    assert [s["station_id"] for s in body] == [near, mid]
+    assert body[0]["distance_km"] == 0.0
+    assert body[0]["available_assets"] == 1
+
+    assert [s["station_id"] for s in client.get("/stations/nearby", params={**params, "connector": "CHAdeMO"}).json()] == [mid]
+
+    # Live availability: the nearest charger gets taken
+    service.start_charging_session(user_id, near_asset)
+    body = client.get("/stations/nearby", params={**params, "available_only": True}).json()
+    assert [s["station_id"] for s in body] == [mid]
+
+    # Stations created after the index was loaded are picked up via change events
+    newest, _ = _add_station(-6.2001, 106.8001)
+    assert newest in [s["station_id"] for s in client.get("/stations/nearby", params=params).json()]
+
+    assert client.get("/stations/nearby", params={"lat": 120, "lon": 0}).status_code == 422
+
+
+def test_create_missing_columns_upgrades_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE station (station_id INTEGER PRIMARY KEY, station_operator VARCHAR NOT NULL, "
+            "location JSON, connector_list JSON, created_at DATETIME NOT NULL)"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE station_asset (asset_id INTEGER PRIMARY KEY, station_id INTEGER NOT NULL, model VARCHAR NOT NULL, "
+            "connector_port JSON, maintenance_log JSON, is_available BOOLEAN NOT NULL, created_at DATETIME NOT NULL)"
+        )
+    db.create_missing_columns(engine)
+    db.create_missing_indexes(engine)
+
+    columns = {c["name"] for c in inspect(engine).get_columns("station")}
+    assert {"latitude", "longitude"} <= columns
+    assert "ix_station_asset_station_available" in {ix["name"] for ix in inspect(engine).get_indexes("station_asset")}
+    engine.dispose()
+
+
+# =====================================================
+# METER VALUES (TELEMETRY INGESTION)
+# =====================================================
+
+from app import telemetry
+
+
+def _ndjson(rows):
+    return "\n".join(json.dumps(r) for r in rows).encode()
+
+
+def test_parse_ndjson_and_pack_roundtrip():
+    body = _ndjson([
+        {"timestamp": 1000, "power_kw": 10.0},
+        {"timestamp": "1970-01-01T00:16:50Z", "energy_wh": 5000},
+    ]) + b"\n\n"
+    readings = telemetry.parse_ndjson(body)
+
+    assert readings == [
+        telemetry.MeterReading(1000.0, 10.0, None),
+        telemetry.MeterReading(1010.0, None, 5000.0),
+    ]
+    assert telemetry.unpack(telemetry.pack(readings)) == readings
+    assert len(telemetry.pack(readings)) == 2 * 3 * 8
+
+    with pytest.raises(ValueError, match="Baris 2"):
+        telemetry.parse_ndjson(_ndjson([{"timestamp": 1, "power_kw": 1}, {"timestamp": 2}]))
+    with pytest.raises(ValueError, match="Baris 1"):
+        telemetry.parse_ndjson(b'{"timestamp": 1, "power_kw": -5}')
+
+
+def test_fold_integrates_power_and_prefers_register():
+    # 60 kW constant for 30 minutes = 30 kWh, sent in two out-of-order batches
+    first = [telemetry.MeterReading(t, 60.0, None) for t in range(0, 901, 60)]
+    second = [telemetry.MeterReading(t, 60.0, None) for t in range(1800, 899, -60)]
+    state, accepted = telemetry.fold(telemetry.MeterState(), first)
+    state, accepted2 = telemetry.fold(state, second + first[:3])  # resent readings are ignored
+
+    assert state.seq == 2
+    assert len(accepted) + len(accepted2) == 31
+    assert state.total_kwh == pytest.approx(30.0)
+
+    registered, _ = telemetry.fold(state, [telemetry.MeterReading(1900, None, 1000.0), telemetry.MeterReading(2000, None, 3500.0)])
+    assert registered.total_kwh == 2.5
+
+    unchanged, none_accepted = telemetry.fold(registered, [telemetry.MeterReading(5, 1.0, None)])
+    assert none_accepted == [] and unchanged.seq == registered.seq
+
+
+def test_meter_values_endpoint_bills_from_metered_total(async_sqlite_engine):
+    import main
+    (asset_id,), (user_id, other_id) = _seed_assets(n_users=2)
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+    session_id = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=headers).json()["session_id"]
+    url = f"/charging-sessions/{session_id}/meter-values"
+
+    start = datetime.utcnow().timestamp()
+    batch1 = [{"timestamp": start + i, "energy_wh": 10_000 + i * 10} for i in range(0, 500)]
+    batch2 = [{"timestamp": start + i, "energy_wh": 10_000 + i * 10} for i in range(490, 1000)]
+
+    r1 = client.post(url, content=_ndjson(batch1), headers=headers)
+    r2 = client.post(url, content=_ndjson(batch2), headers=headers)
+    assert r1.json() == {"session_id": session_id, "accepted": 500, "ignored": 0, "metered_kwh": 4.99}
+    assert r2.json() == {"session_id": session_id, "accepted": 500, "ignored": 10, "metered_kwh": 9.99}
+
+    batches = []
+    with db.get_session() as s:
+        batches = s.exec(select(models.MeterBatch).where(models.MeterBatch.session_id == session_id)).all()
+    assert [(b.seq, b.reading_count) for b in batches] == [(1, 500), (2, 500)]
+    assert len(telemetry.unpack(batches[1].samples)) == 500
+
+    other = {"Authorization": f"Bearer {auth.create_access_token({'sub': other_id})}"}
+    assert client.post(url, content=_ndjson(batch1), headers=other).status_code == 400
+    assert client.post(url, content=b"not json", headers=headers).status_code == 422
+
+    # Stop runs on the sync engine and must not revisit individual readings
+    with _count_statements(db.engine) as statements:
+        stopped = client.post(f"/charging-sessions/{session_id}/stop", headers=headers)
+    assert stopped.json()["total_kwh"] == 9.99
+    assert not any("meter_batch" in s for s in statements)
+
+    assert client.post(url, content=_ndjson(batch2), headers=headers).status_code == 400
+
+
+# =====================================================
+# TELEMETRY ROLLUPS / POWER CURVE
+# =====================================================
+
+def _power_readings(start, seconds, kw=lambda t: 10.0 + (t % 120) / 10.0):
+    return [telemetry.MeterReading(float(start + t), kw(t), None) for t in range(seconds)]
+
+
+def test_rollups_split_across_batches_merge_to_single_batch_result():
+    readings = _power_readings(1_000_800, 1800)  # hour-aligned
+    whole = telemetry.rollup(telemetry.MeterState(), readings, 60)
+
+    state, parts = telemetry.MeterState(), []
+    for i in range(0, len(readings), 97):  # batch edges inside buckets
+        before = state
+        state, accepted = telemetry.fold(state, readings[i:i + 97])
+        parts.extend(telemetry.rollup_chunks(1, before, accepted))
+    minute_chunks = [c for c in parts if c.resolution == 60]
+
+    merged = telemetry.query_buckets(minute_chunks, None, None)
+    assert [(b.start, b.count, b.power_min, b.power_max) for b in merged] == \
+        [(b.start, b.count, b.power_min, b.power_max) for b in whole]
+    assert [b.avg_kw for b in merged] == pytest.approx([b.avg_kw for b in whole])
+    assert len(whole) == 30
+    assert whole[0].count == 60
+    assert whole[0].power_min == 10.0 and whole[0].power_max == pytest.approx(15.9)
+
+    compacted = telemetry.compact(1, 1, [c for c in parts if c.resolution == 1])
+    assert len(compacted) == 1 and compacted[0].bucket_count == 1800
+    assert telemetry.query_buckets(compacted, 1_000_900, 1_000_910) == \
+        telemetry.rollup(telemetry.MeterState(), readings[100:110], 1)
+
+
+def test_rollup_derives_power_from_register():
+    readings = [telemetry.MeterReading(float(t), None, 1000.0 + t * 5) for t in range(0, 120)]
+    buckets = telemetry.rollup(telemetry.MeterState(), readings, 60)
+    # 5 Wh per second = 18 kW; the very first reading has no previous register value
+    assert buckets[0].count == 59
+    assert buckets[0].avg_kw == pytest.approx(18.0)
+    assert buckets[1].energy_wh == 1000.0 + 119 * 5
+
+
+def test_power_curve_endpoint(async_sqlite_engine):
+    import main
+    (asset_id,), (user_id,) = _seed_assets()
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+    session_id = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=headers).json()["session_id"]
+
+    base = 900.0 * 1_888_889  # 15-minute boundary
+    start = base + 100
+    rows = [{"timestamp": start + t, "power_kw": 20.0 if t < 900 else 40.0} for t in range(1800)]
+    for i in range(0, 1800, 300):
+        client.post(f"/charging-sessions/{session_id}/meter-values", content=_ndjson(rows[i:i + 300]), headers=headers)
+
+    curve = client.get(f"/charging-sessions/{session_id}/power-curve", params={"resolution": "15m"}, headers=headers).json()
+    assert [p["timestamp"] for p in curve["points"]] == [base + 900 * i for i in range(3)]
+    assert [round(p["avg_kw"], 3) for p in curve["points"]] == [20.0, round((100 * 20 + 800 * 40) / 900, 3), 40.0]
+
+    window = client.get(
+        f"/charging-sessions/{session_id}/power-curve",
+        params={"resolution": "1s", "start": start + 10, "end": start + 20}, headers=headers
+    ).json()["points"]
+    assert [p["timestamp"] for p in window] == [start + t for t in range(10, 20)]
+
+    client.post(f"/charging-sessions/{session_id}/stop", headers=headers)
+    with db.get_session() as s:
+        per_resolution = {
+            r: s.exec(select(models.TelemetryChunk).where(
+                models.TelemetryChunk.session_id == session_id, models.TelemetryChunk.resolution == r
+            )).all()
+            for r in telemetry.RESOLUTIONS.values()
+        }
+    # Six per-batch chunks per resolution compacted into span-sized chunks
+    assert {r: len(c) for r, c in per_resolution.items()} == {1: 1, 60: 1, 900: 1}
+    after = client.get(f"/charging-sessions/{session_id}/power-curve", params={"resolution": "15m"}, headers=headers).json()
+    assert after == curve
+
+    assert client.get(f"/charging-sessions/{session_id}/power-curve", params={"resolution": "5m"}, headers=headers).status_code == 400
+    too_wide = {"resolution": "1s", "start": 0, "end": 10 ** 9}
+    assert client.get(f"/charging-sessions/{session_id}/power-curve", params=too_wide, headers=headers).status_code == 400
+
+
+def test_open_ended_power_curve_is_bounded_before_loading_chunks(async_sqlite_engine, monkeypatch):
+    import main
+    (asset_id,), (user_id,) = _seed_assets()
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+    session_id = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=headers).json()["session_id"]
+    start = 900.0 * 1_888_889
+    client.post(
+        f"/charging-sessions/{session_id}/meter-values",
+        content=_ndjson([{"timestamp": start + t, "power_kw": 10.0} for t in range(600)]), headers=headers
+    )
+    url = f"/charging-sessions/{session_id}/power-curve"
+    monkeypatch.setattr(telemetry, "MAX_CURVE_POINTS", 100)
+
+    with patch("app.async_service.async_repository.get_telemetry_chunks") as load:
+        assert client.get(url, params={"resolution": "1s"}, headers=headers).status_code == 400
+        assert client.get(url, params={"resolution": "1s", "start": start + 100}, headers=headers).status_code == 400
+    load.assert_not_called()
+
+    tail = client.get(url, params={"resolution": "1s", "start": start + 550}, headers=headers)
+    assert [p["timestamp"] for p in tail.json()["points"]] == [start + t for t in range(550, 600)]
+    assert client.get(url, params={"resolution": "15m"}, headers=headers).status_code == 200
+
+
+# =====================================================
+# TARIFF ENGINE
+# =====================================================
+
+def test_default_tariff_prices_like_flat_rate():
+    lines = service._calculate_billing(5, 30)
+    assert lines["total_cost"] == 5 * 2500.0 + 30 * 100.0
+    assert lines["billing_total"] == lines["total_cost"] + 2000.0
+    assert lines["tax"] == 0.0
+
+
+def test_time_of_use_idle_fee_and_tax():
+    tariff = tariffs.CompiledTariff(
+        cost_per_kwh=1000.0, cost_per_minute=0.0,
+        admin_fee=1000.0, idle_fee_per_minute=500.0, idle_grace_minutes=10.0, tax_rate=0.1,
+        utc_offset_minutes=420,
+        bands=[(22 * 60, 6 * 60, 500.0, 0.0)]  # night band over midnight
+    )
+    # 21:00-23:00 WIB = 14:00-16:00 UTC: half the time (and energy) in the night band
+    start = datetime(2026, 1, 1, 14, 0)
+    lines = tariff.price(kwh=10.0, minutes=120.0, start_time=start, max_kw=10.0)
+
+    assert lines["energy_cost"] == pytest.approx(5 * 1000.0 + 5 * 500.0)
+    # 10 kWh at 10 kW needs 60 minutes; 120 - 60 - 10 grace = 50 idle minutes
+    assert lines["idle_fee"] == pytest.approx(50 * 500.0)
+    assert lines["tax"] == pytest.approx((lines["total_cost"] + 1000.0) * 0.1)
+    assert lines["billing_total"] == pytest.approx(lines["total_cost"] + 1000.0 + lines["tax"])
+
+    with pytest.raises(ValueError, match="tumpang tindih"):
+        tariffs.CompiledTariff(1, 1, bands=[(60, 180, 1, 1), (120, 240, 1, 1)])
+
+
+def test_tariff_book_resolution_and_invalidation():
+    def plan(tariff_id, station_id=None, operator=None, rate=1.0):
+        return models.TariffPlan(
+            tariff_id=tariff_id, name=f"T{tariff_id}", station_id=station_id, station_operator=operator,
+            cost_per_kwh=rate, cost_per_minute=0.0
+        )
+
+    book = tariffs.TariffBook(tariffs.CompiledTariff(9.0, 0.0))
+    assert book.resolve(1) is book.default
+
+    book.load(tariffs.TariffCatalog(
+        [plan(1, rate=1.0), plan(2, operator="PLN", rate=2.0), plan(3, station_id=7, rate=3.0)],
+        [(7, "PLN"), (8, "pln"), (9, "Shell")]
+    ), book.epoch)
+    assert book.loaded
+    assert [book.resolve(sid).cost_per_kwh for sid in (7, 8, 9, None)] == [3.0, 2.0, 1.0, 1.0]
+
+    # New station of a known operator: picked up from the change event, no reload
+    book.apply([events.Change("station", 10, 10, "insert", {"station_operator": "PLN"})])
+    assert book.loaded and book.resolve(10).cost_per_kwh == 2.0
+
+    # A tariff change that races a load leaves the book stale
+    epoch = book.epoch
+    book.apply([events.Change("tariff_plan", 2, None, "update", {"cost_per_kwh": 5.0})])
+    assert not book.loaded
+    book.load(tariffs.TariffCatalog([], []), epoch)
+    assert not book.loaded
+
+
+def test_station_created_while_tariffs_load_gets_its_operator_plan(sqlite_engine):
+    with db.get_session() as s:
+        s.add(models.TariffPlan(name="Shell", station_operator="Shell", cost_per_kwh=4000.0, cost_per_minute=0.0))
+        s.commit()
+    real_catalog = repository.get_tariff_catalog
+    created = []
+
+    def catalog_then_new_station(*args, **kwargs):
+        catalog = real_catalog(*args, **kwargs)
+        with db.get_session() as s:
+            station = models.Station(
+                station_operator="Shell", location=models.Location(latitude=1, longitude=1, address="B"), connector_list=["CCS"]
+            )
+            s.add(station)
+            s.commit()
+            created.append(station.station_id)
+        return catalog
+
+    with patch("app.service.repository.get_tariff_catalog", side_effect=catalog_then_new_station):
+        service.resolve_tariff(None)
+    # The catalog missed the station, so the book is not trusted and compiles again
+    assert not tariffs.tariff_book.loaded
+    assert service.resolve_tariff(created[0]).cost_per_kwh == 4000.0
+    assert tariffs.tariff_book.loaded
+
+def test_stop_bills_with_station_tariff_and_snapshots_it(async_sqlite_engine):
+    import main
+    (asset_id,), (user_id,) = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+
+    body = {"name": "Global", "cost_per_kwh": 1000, "cost_per_minute": 0, "admin_fee": 500}
+    assert client.post("/tariffs", json=body, headers=headers).status_code == 200
+    station_plan = client.post("/tariffs", json={
+        "name": "Stasiun", "station_id": station_id, "cost_per_kwh": 3000, "cost_per_minute": 0,
+        "tax_rate": 0.11, "bands": [{"start_minute": 0, "end_minute": 1440, "cost_per_kwh": 2000, "cost_per_minute": 0}]
+    }, headers=headers).json()
+    assert station_plan["bands"][0]["cost_per_kwh"] == 2000
+    overlapping = {**body, "bands": [
+        {"start_minute": 0, "end_minute": 100, "cost_per_kwh": 1, "cost_per_minute": 0},
+        {"start_minute": 50, "end_minute": 200, "cost_per_kwh": 1, "cost_per_minute": 0},
+    ]}
+    assert client.post("/tariffs", json=overlapping, headers=headers).status_code == 400
+    empty_band = {**body, "bands": [{"start_minute": 600, "end_minute": 600, "cost_per_kwh": 1, "cost_per_minute": 0}]}
+    assert client.post("/tariffs", json=empty_band, headers=headers).status_code == 400
+
+    session_id = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=headers).json()["session_id"]
+    # Warm the book so the stop itself runs no tariff queries
+    service.resolve_tariff(station_id)
+    with _count_statements(db.engine) as statements:
+        stopped = client.post(f"/charging-sessions/{session_id}/stop", params={"kwh_consumed": 10}, headers=headers)
+    assert stopped.status_code == 200
+    assert not any("tariff_plan" in s or "tariff_band" in s for s in statements)
+
+    invoice = client.get("/invoices/me", headers=headers).json()["items"][0]
+    assert invoice["tariff"]["tariff_id"] == station_plan["tariff_id"]
+    assert invoice["tariff"]["time_of_use"][0]["cost_per_kwh"] == 2000
+    assert invoice["tariff"]["utc_offset_minutes"] == 420 and invoice["tariff"]["idle_grace_minutes"] == 0
+    assert invoice["cost_total"] == pytest.approx(20000, abs=0.01)
+    assert invoice["billing_total"] == pytest.approx(20000 * 1.11, abs=0.01)
+
+    # Deactivating the station plan falls back to the global plan
+    client.delete(f"/tariffs/{station_plan['tariff_id']}", headers=headers)
+    assert not tariffs.tariff_book.loaded
+    assert service.resolve_tariff(station_id).name == "Global"
+
+
+# =====================================================
+# BULK RE-BILLING
+# =====================================================
+
+import io
+
+import numpy as np
+
+from app import rebilling
+
+
+def test_price_arrays_matches_scalar_price():
+    tariff = tariffs.CompiledTariff(
+        cost_per_kwh=2500.0, cost_per_minute=100.0, admin_fee=2000.0,
+        idle_fee_per_minute=500.0, idle_grace_minutes=10.0, tax_rate=0.11, utc_offset_minutes=420,
+        bands=[(22 * 60, 6 * 60, 1500.0, 50.0), (17 * 60, 21 * 60, 4000.0, 150.0)]
+    )
+    rng = random.Random(7)
+    base = datetime(2026, 1, 1)
+    starts = [base + timedelta(seconds=rng.uniform(0, 30 * 86400)) for _ in range(300)]
+    minutes = [rng.choice([0.0, rng.uniform(1, 600), rng.uniform(1440, 4000)]) for _ in starts]
+    kwh = [rng.uniform(0, 80) for _ in starts]
+    max_kw = [rng.choice([0.0, 7.0, 50.0]) for _ in starts]
+
+    lines = rebilling.price_arrays(
+        tariff, np.array(kwh), np.array(minutes), np.array(starts, dtype="datetime64[us]"), np.array(max_kw)
+    )
+    for i in range(len(starts)):
+        expected = tariff.price(kwh[i], minutes[i], starts[i], max_kw[i])
+        for key in ("energy_cost", "time_cost", "idle_fee", "tax", "billing_total"):
+            assert lines[key][i] == pytest.approx(expected[key], rel=1e-9, abs=1e-6)
+
+
+def test_rebilling_dry_run_then_apply_corrects_pending_invoices(sqlite_engine):
+    (asset_id,), (user_id,) = _seed_assets()
+    session_ids = []
+    for kwh in (10, 20, 30):
+        session_ids.append(service.start_charging_session(user_id, asset_id).session_id)
+        service.stop_charging_session(session_ids[-1], manual_kwh=kwh)
+    with db.get_session() as s:
+        settled = repository.get_invoice_by_session(session_ids[-1], db=s)
+        settled.payment_status = models.PaymentStatus.COMPLETED
+        s.add(settled)
+        s.commit()
+
+    # Unchanged tariff: the vectorized pricing reproduces the stored invoices
+    assert rebilling.run(chunk_size=2).changed == 0
+
+    with db.get_session() as s:
+        repository.create_tariff_plan(models.TariffPlan(name="Koreksi", cost_per_kwh=3000, cost_per_minute=0, admin_fee=1000), db=s)
+        s.commit()
+
+    report = io.StringIO()
+    dry = rebilling.run(chunk_size=2, report=report)
+    assert (dry.scanned, dry.changed, dry.applied) == (2, 2, 0)
+    lines = report.getvalue().splitlines()
+    assert lines[0].startswith("session_id,invoice_id") and len(lines) == 3
+    assert repository.get_invoice_by_session(session_ids[0]).cost_total != 30000
+
+    applied = rebilling.run(chunk_size=2, apply=True)
+    assert applied.applied == 2
+    first = repository.get_invoice_by_session(session_ids[0])
+    assert first.cost_total == pytest.approx(30000, abs=0.01)
+    assert first.billing_total == pytest.approx(31000, abs=0.01)
+    assert first.tariff["name"] == "Koreksi"
+    # Settled invoices are left alone unless asked for
+    assert repository.get_invoice_by_session(session_ids[-1]).cost_total != pytest.approx(90000, abs=0.01)
+    assert rebilling.run().changed == 0
+    assert rebilling.run(include_settled=True).changed == 1
+
+
+# =====================================================
+# BULK IMPORT
+# =====================================================
+
+from sqlalchemy.exc import OperationalError
+from app import bulk_import
+
+
+def _import_client():
+    import main
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': 1})}"}
+    return client, headers
+
+
+def test_import_stations_ndjson_reports_bad_rows_and_keeps_the_rest(sqlite_engine, monkeypatch):
+    monkeypatch.setattr(bulk_import, "BATCH_SIZE", 2)
+    client, headers = _import_client()
+    station = {"station_operator": "PLN", "location": {"latitude": -6.2, "longitude": 106.8, "address": "A"}, "connector_list": ["CCS"]}
+    body = "\n".join([
+        json.dumps(station),
+        "{not json",
+        "",
+        json.dumps({**station, "location": {"latitude": "utara"}}),
+        json.dumps({**station, "station_operator": "Shell"}),
+    ])
+    geo.station_index.ensure_loaded()
+
+    with _count_statements(sqlite_engine) as statements:
+        response = client.post("/stations/import", content=body, headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["received"], result["inserted"], result["failed"]) == (4, 2, 2)
+    assert [e["line"] for e in result["errors"]] == [2, 4]
+    assert "location.latitude" in result["errors"][1]["message"]
+    assert result["rows_per_second"] > 0
+    # One multi-row INSERT per batch, not one per station
+    assert sum(s.startswith("INSERT INTO station ") for s in statements) <= 2
+
+    first, second = result["inserted_ids"]
+    assert client.get(f"/stations/{second}").json()["station_operator"] == "Shell"
+    # Coordinates are derived and change events published although no ORM flush ran
+    nearby = [sid for sid, _ in geo.station_index.nearby(-6.2, 106.8, 1)]
+    assert sorted(nearby) == [first, second]
+
+
+def test_import_station_assets_csv_rejects_unknown_station(sqlite_engine):
+    client, headers = _import_client()
+    stations_csv = (
+        "station_operator,location.latitude,location.longitude,location.address,connector_list\n"
+        "PLN,-6.2,106.8,\"Jl. Sudirman 1, Jakarta\",CCS;CHAdeMO\n"
+    )
+    result = client.post("/stations/import", content=stations_csv, headers={**headers, "Content-Type": "text/csv"}).json()
+    (station_id,) = result["inserted_ids"]
+    station = repository.get_station(station_id)
+    assert station.connector_list == ["CCS", "CHAdeMO"]
+    assert station.location["address"] == "Jl. Sudirman 1, Jakarta"
+    assert station.latitude == -6.2
+
+    assets_csv = "\r\n".join([
+        "station_id,model,connector_port.standard_name,connector_port.max_power_supported",
+        f"{station_id},ABB Terra 54,CCS,50",
+        f"{station_id + 100},ABB Terra 54,CCS,50",
+        f"{station_id},Delta,CHAdeMO",
+        f"{station_id},Delta,CHAdeMO,x",
+    ])
+    result = client.post("/station-assets/import", content=assets_csv, headers={**headers, "Content-Type": "text/csv"}).json()
+    assert (result["received"], result["inserted"], result["failed"]) == (4, 1, 3)
+    assert {e["line"]: e["message"] for e in result["errors"]}[3] == "Station tidak ditemukan"
+    assert [e["line"] for e in result["errors"]] == [3, 4, 5]
+    (asset,) = repository.get_station_assets_by_station(station_id)
+    assert asset.connector_port["max_power_supported"] == 50 and asset.is_available
+
+
+def test_import_csv_keeps_newlines_inside_quoted_fields(sqlite_engine, monkeypatch):
+    monkeypatch.setattr(bulk_import, "BATCH_SIZE", 2)
+    client, headers = _import_client()
+    body = (
+        "station_operator,location.latitude,location.longitude,location.address,connector_list\n"
+        "PLN,-6.2,106.8,\"Jl. Sudirman 1\nLantai 2\",CCS\n"
+        "PLN,utara,106.8,B,CCS\n"
+        "Shell,-6.3,106.9,\"Jl. Thamrin\",CCS\n"
+    )
+    result = client.post("/stations/import", content=body, headers={**headers, "Content-Type": "text/csv"}).json()
+    assert (result["received"], result["inserted"], result["failed"]) == (3, 2, 1)
+    # Line numbers count physical lines: the quoted record spans lines 2-3
+    assert [e["line"] for e in result["errors"]] == [4]
+    first, _ = result["inserted_ids"]
+    assert repository.get_station(first).location["address"] == "Jl. Sudirman 1\nLantai 2"
+
+
+def test_import_reports_oversized_lines_and_failed_batches(sqlite_engine, monkeypatch):
+    monkeypatch.setattr(bulk_import, "BATCH_SIZE", 2)
+    monkeypatch.setattr(bulk_import, "MAX_REPORTED_IDS", 1)
+    client, headers = _import_client()
+    station = {"station_operator": "PLN", "location": {"latitude": -6.2, "longitude": 106.8, "address": "A"}, "connector_list": ["CCS"]}
+    lines = [json.dumps(station)] * 2 + [json.dumps({**station, "station_operator": "x" * bulk_import.MAX_LINE_BYTES})]
+    lines += [json.dumps(station)] * 3
+    real_insert = repository.bulk_insert_stations
+    calls = []
+
+    def insert_failing_second_batch(rows, db=None):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return real_insert(rows, db=db)
+
+    monkeypatch.setattr(repository, "bulk_insert_stations", insert_failing_second_batch)
+    response = client.post("/stations/import", content="\n".join(lines), headers={**headers, "Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    result = response.json()
+    # Batches: lines 1-2 ok, 3 (oversized) + 4 -> line 4 fails with the batch, 5-6 ok
+    assert (result["received"], result["inserted"], result["failed"]) == (6, 4, 2)
+    assert [(e["line"], e["message"]) for e in result["errors"]] == [
+        (3, f"Baris lebih dari {bulk_import.MAX_LINE_BYTES} byte"),
+        (4, "Baris 4-4 gagal disimpan: OperationalError"),
+    ]
+    assert len(result["inserted_ids"]) == 1
+    assert len(repository.list_stations(limit=10).items) == 4
+
+
+# =====================================================
+# LIVE AVAILABILITY FEED (SSE)
+# =====================================================
+
+from app import live
+
+
+def test_availability_feed_pushes_committed_asset_changes(sqlite_engine):
+    (asset_id,), (user_id,) = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    (other_asset,), _ = _seed_assets(n_users=0)
+
+    async def scenario():
+        feed = live.AvailabilityFeed()
+        events.subscribe(feed.apply)
+        try:
+            subscription = feed.subscribe([station_id])
+            # Writers run in other threads, like sync endpoints in the threadpool
+            session = await asyncio.to_thread(service.start_charging_session, user_id, asset_id)
+            assert await subscription.next(1) == [
+                ("asset", {"asset_id": asset_id, "station_id": station_id, "is_available": False})
+            ]
+
+            await asyncio.to_thread(service.stop_charging_session, session.session_id, 5)
+            await asyncio.to_thread(service.add_maintenance_log, asset_id, "Konektor rusak")
+            await asyncio.to_thread(service.add_maintenance_log, other_asset, "Bukan stasiun ini")
+            await asyncio.sleep(0)
+            (update,) = await subscription.next(1)
+            # Stop and maintenance coalesced into the latest state of the asset
+            assert update[0] == "asset" and update[1]["is_available"] is False
+            assert update[1]["maintenance_log"].error_log == "Konektor rusak"
+
+            # Nothing is pushed for rolled back work
+            with db.UnitOfWork() as uow:
+                repository.reserve_station_asset(asset_id, db=uow.session)
+            assert await subscription.next(0.05) == []
+
+            feed.unsubscribe(subscription)
+            assert len(feed) == 0
+        finally:
+            events.unsubscribe(feed.apply)
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_keeps_latest_state_then_resyncs(monkeypatch):
+    monkeypatch.setattr(live, "MAX_PENDING", 3)
+
+    async def scenario():
+        subscription = live.AvailabilityFeed().subscribe()
+        for available in (False, True, False):
+            subscription.offer(1, {"asset_id": 1, "is_available": available})
+        subscription.offer(2, {"asset_id": 2, "deleted": True})
+        assert await subscription.next(1) == [
+            ("asset", {"asset_id": 1, "is_available": False}),
+            ("removed", {"asset_id": 2, "deleted": True}),
+        ]
+        for asset_id in range(5):
+            subscription.offer(asset_id, {"asset_id": asset_id, "is_available": True})
+        updates = await subscription.next(1)
+        assert updates[0][0] == "resync" and subscription.dropped == 3
+        assert [data["asset_id"] for _, data in updates[1:]] == [3, 4]
+
+    asyncio.run(scenario())
+
+
+def test_event_stream_sends_snapshot_updates_and_heartbeats():
+    async def scenario():
+        feed = live.AvailabilityFeed()
+        subscription = feed.subscribe([7])
+        polls = iter([False, False, True])
+
+        async def is_disconnected():
+            return next(polls)
+
+        stream = live.event_stream(feed, subscription, is_disconnected, snapshot=[{"asset_id": 1}], heartbeat=0.01)
+        chunks = [await stream.__anext__(), await stream.__anext__(), await stream.__anext__()]
+        feed.apply([events.Change("station_asset", 1, 7, "update", {"is_available": True})])
+        chunks += [chunk async for chunk in stream]
+        assert len(feed) == 0
+        return chunks
+
+    chunks = asyncio.run(scenario())
+    assert chunks[0].startswith(b"retry:")
+    assert chunks[1] == b'event: snapshot\ndata: [{"asset_id": 1}]\n\n'
+    assert chunks[2] == b": ping\n\n"
+    assert chunks[3] == b'event: asset\ndata: {"asset_id": 1, "station_id": 7, "is_available": true}\n\n'
+
+
+def test_stream_endpoint_limits_stations(sqlite_engine):
+    import main
+    client = TestClient(main.app)
+    too_many = [("station_id", i) for i in range(live.MAX_STATIONS_PER_STREAM + 1)]
+    assert client.get("/station-assets/stream", params=too_many).status_code == 400
+
+
+# =====================================================
+# AVAILABILITY INDEX
+# =====================================================
+
+def test_availability_index_follows_write_paths_without_queries(sqlite_engine):
+    station_id, (ccs,) = _add_station(-6.2, 106.8)
+    with db.get_session() as s:
+        chademo = models.StationAsset(
+            station_id=station_id, model="M",
+            connector_port=models.ConnectorPort(standard_name="CHAdeMO", max_power_supported=50)
+        )
+        s.add(chademo)
+        user = _new_user()
+        s.add(user)
+        s.commit()
+        chademo_id, user_id = chademo.asset_id, user.user_id
+    index = availability.asset_index
+    index.ensure_loaded()
+
+    with _count_statements(sqlite_engine) as statements:
+        assert index.free_assets(station_id) == {ccs, chademo_id}
+        assert index.free_assets(station_id, "CCS") == {ccs}
+        assert index.counts([station_id, station_id + 1], "CHAdeMO") == {station_id: 1}
+    assert statements == []
+
+    session = service.start_charging_session(user_id, ccs)
+    assert index.free_assets(station_id, "CCS") == frozenset()
+    service.stop_charging_session(session.session_id, manual_kwh=1)
+    assert index.free_assets(station_id, "CCS") == {ccs}
+    service.add_maintenance_log(chademo_id, "Kabel rusak")
+    assert index.free_assets(station_id) == {ccs}
+
+    asset = repository.get_station_asset(chademo_id)
+    asset.is_available = True
+    repository.update_station_asset(asset)
+    assert index.free_assets(station_id, "CHAdeMO") == {chademo_id}
+    assert index.check() == []
+
+    import main
+    body = TestClient(main.app).get(f"/stations/{station_id}/availability", params={"connector": "CCS"}).json()
+    assert body == {"station_id": station_id, "connector": "CCS", "available": 1, "available_asset_ids": [ccs]}
+
+
+def test_available_only_asset_list_is_served_from_the_index(sqlite_engine):
+    import main
+    client = TestClient(main.app)
+    asset_ids, (user_id,) = _seed_assets(3, 1)
+    station_id = _station_id_of(asset_ids[0])
+    availability.asset_index.ensure_loaded()
+
+    with _count_statements(sqlite_engine) as statements:
+        first = client.get("/station-assets", params={"available_only": True, "limit": 2})
+    assert first.status_code == 200
+    assert [a["asset_id"] for a in first.json()["items"]] == sorted(asset_ids)[:2]
+    # Only the primary-key fetch of the page rows; no is_available filter in SQL
+    assert len(statements) == 1 and "is_available" not in statements[0].split("WHERE")[-1]
+
+    service.start_charging_session(user_id, sorted(asset_ids)[0])
+    body = client.get("/station-assets", params={"available_only": True, "station_id": station_id, "limit": 1}).json()
+    assert [a["asset_id"] for a in body["items"]] == [sorted(asset_ids)[1]]
+    rest = client.get("/station-assets", params={"available_only": True, "station_id": station_id, "cursor": body["next_cursor"]}).json()
+    assert [a["asset_id"] for a in rest["items"]] == sorted(asset_ids)[2:] and rest["next_cursor"] is None
+
+def test_availability_load_replays_writes_committed_while_querying(sqlite_engine):
+    import main
+    client = TestClient(main.app)
+    (asset_id, other_asset), _ = _seed_assets(n_assets=2)
+    station_id = _station_id_of(asset_id)
+    index = availability.asset_index
+    real_rows = repository.get_asset_availability
+
+    def rows_then_write(*args, **kwargs):
+        rows = real_rows(*args, **kwargs)
+        service.add_maintenance_log(asset_id, "Kabel rusak")
+        return rows
+
+    with patch("app.availability.repository.get_asset_availability", side_effect=rows_then_write) as scan:
+        first = client.get(f"/stations/{station_id}/availability").json()
+        second = client.get(f"/stations/{station_id}/availability").json()
+    # The write is replayed onto the fresh sets, so the index stays loaded
+    assert scan.call_count == 1 and index.loaded
+    assert first["available_asset_ids"] == second["available_asset_ids"] == [other_asset]
+    assert index.check() == []
+
+def test_availability_check_repairs_drift(sqlite_engine):
+    station_id, (asset_id,) = _add_station(-6.2, 106.8)
+    index = availability.AvailabilityIndex()
+    index.load()
+
+    # A write that bypasses the ORM and app.events
+    with sqlite_engine.begin() as conn:
+        conn.execute(text("UPDATE station_asset SET is_available = 0 WHERE asset_id = :id"), {"id": asset_id})
+    assert index.free_assets(station_id) == {asset_id}
+    (difference,) = index.check()
+    assert f"asset {asset_id}" in difference
+    assert index.free_assets(station_id) == frozenset()
+    assert index.check() == []
+
+    # An update for an asset the index has never seen forces a rebuild
+    index.apply([events.Change("station_asset", 999, None, "update", {"is_available": True})])
+    assert not index.loaded
+
+
+# =====================================================
+# RESPONSE CACHE
+# =====================================================
+
+import threading
+
+
+def test_public_station_reads_are_cached_until_a_write(sqlite_engine):
+    import main
+    client = TestClient(main.app)
+    (asset_id,), (user_id,) = _seed_assets()
+    station_id = _station_id_of(asset_id)
+
+    assert client.get("/stations").headers["X-Cache"] == "MISS"
+    with _count_statements(sqlite_engine) as statements:
+        hit = client.get("/stations")
+    assert statements == []
+    assert hit.headers["X-Cache"] == "HIT" and hit.json()["items"][0]["station_id"] == station_id
+    assert client.get(f"/stations/{station_id}").status_code == 200
+    assert client.get(f"/stations/{station_id}").headers["X-Cache"] == "HIT"
+    assert client.get("/stations/search", params={"operator": "pln"}).json()["items"][0]["station_id"] == station_id
+
+    # A new station invalidates the lists but not other stations' details
+    _add_station(-6.2, 106.8)
+    listed = client.get("/stations")
+    assert listed.headers["X-Cache"] == "MISS" and len(listed.json()["items"]) == 2
+    assert client.get("/stations/search", params={"operator": "pln"}).headers["X-Cache"] == "MISS"
+    assert client.get(f"/stations/{station_id}").headers["X-Cache"] == "HIT"
+
+    # Starting a session flips the asset: that station's detail is rebuilt
+    service.start_charging_session(user_id, asset_id)
+    detail = client.get(f"/stations/{station_id}")
+    assert detail.headers["X-Cache"] == "MISS"
+    assert detail.json()["station_assets"][0]["is_available"] is False
+    # Errors are not cached
+    assert client.get("/stations/999999").status_code == 404
+    assert client.get("/stations/999999").status_code == 404
+
+
+def test_response_cache_coalesces_concurrent_misses():
+    response_cache = cache.ResponseCache(cache.LRUBackend())
+    builds = []
+    release = threading.Event()
+
+    def build():
+        builds.append(1)
+        release.wait(1)
+        return b"[]"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(response_cache.get_or_build("stations.list", "k", ["stations"], build)))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(builds) == 1
+    assert [body for body, _ in results] == [b"[]"] * 8
+    assert response_cache.stats()["misses"] == 1 and response_cache.stats()["coalesced"] == 7
+
+
+def test_shared_backend_shares_entries_and_invalidations_between_workers():
+    now = [0.0]
+    client = cache.InMemorySharedClient(clock=lambda: now[0])
+    worker_a = cache.ResponseCache(cache.SharedBackend(client), {"stations.list": 10})
+    worker_b = cache.ResponseCache(cache.SharedBackend(client), {"stations.list": 10})
+    tags = cache.station_list_tags()
+
+    assert worker_a.get_or_build("stations.list", "1", tags, lambda: b"v1") == (b"v1", False)
+    assert worker_b.get_or_build("stations.list", "1", tags, lambda: b"other") == (b"v1", True)
+
+    # Asset changes leave the lists alone; station changes reach every worker
+    worker_a.apply([events.Change("station_asset", 5, 1, "update", {"is_available": False})])
+    assert worker_b.get_or_build("stations.list", "1", tags, lambda: b"other") == (b"v1", True)
+    worker_a.apply([events.Change("station", 1, 1, "update", {"station_operator": "PLN"})])
+    assert worker_b.get_or_build("stations.list", "1", tags, lambda: b"v2") == (b"v2", False)
+
+    now[0] = 11.0  # past the route TTL
+    assert worker_a.get_or_build("stations.list", "1", tags, lambda: b"v3") == (b"v3", False)
+
+
+def test_lru_backend_evicts_and_expires():
+    now = [0.0]
+    backend = cache.LRUBackend(max_entries=2, clock=lambda: now[0])
+    backend.set("a", b"1", 5)
+    backend.set("b", b"2", 5)
+    backend.get("a")
+    backend.set("c", b"3", 5)
+    assert backend.get("b") is None and backend.get("a") == b"1"
+    now[0] = 5.0
+    assert backend.get("a") is None and len(backend) == 1
+
+    assert isinstance(cache.backend_from_url(None), cache.LRUBackend)
+    with pytest.raises(ValueError):
+        cache.backend_from_url("memcached://localhost")
+
+
+# =====================================================
+# CONDITIONAL GET
+# =====================================================
+
+from fastapi import Request
+from app import conditional
+
+
+def _conditional_request(**headers):
+    return Request({"type": "http", "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_not_modified_matches_etags_then_dates():
+    validator = conditional.make_validator("invoices", 1, 20, None, last_modified=datetime(2024, 5, 1, 8, 30, 15, 500))
+    assert validator == conditional.make_validator("invoices", 1, 20, None, last_modified=validator.last_modified)
+    assert validator.etag != conditional.make_validator("invoices", 1, 20, 7).etag
+
+    opaque = validator.etag[2:]
+    assert conditional.not_modified(_conditional_request(if_none_match=f'"x", {opaque}'), validator)
+    assert conditional.not_modified(_conditional_request(if_none_match="*"), validator)
+    assert not conditional.not_modified(_conditional_request(if_none_match='"x"'), validator)
+    # If-None-Match wins over a matching If-Modified-Since
+    assert not conditional.not_modified(
+        _conditional_request(if_none_match='"x"', if_modified_since="Wed, 01 May 2024 08:30:15 GMT"), validator
+    )
+    assert conditional.not_modified(_conditional_request(if_modified_since="Wed, 01 May 2024 08:30:15 GMT"), validator)
+    assert not conditional.not_modified(_conditional_request(if_modified_since="Wed, 01 May 2024 08:30:14 GMT"), validator)
+    assert not conditional.not_modified(_conditional_request(if_modified_since="kemarin"), validator)
+    assert conditional.headers(validator)["Last-Modified"] == "Wed, 01 May 2024 08:30:15 GMT"
+
+
+def test_my_sessions_and_invoices_answer_304_until_a_row_changes(async_sqlite_engine):
+    import main
+    (asset_id,), (user_id,) = _seed_assets()
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+    session_id = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=headers).json()["session_id"]
+
+    first = client.get("/charging-sessions/me", headers=headers)
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache" and first.headers["Last-Modified"]
+    cached = client.get("/charging-sessions/me", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b"" and cached.headers["ETag"] == etag
+    # Another page is another representation
+    assert client.get("/charging-sessions/me", params={"limit": 5}, headers={**headers, "If-None-Match": etag}).status_code == 200
+
+    # Meter values move metered_kwh through a bulk UPDATE
+    start = datetime.utcnow().timestamp()
+    client.post(f"/charging-sessions/{session_id}/meter-values", content=_ndjson([{"timestamp": start, "energy_wh": 1000}]), headers=headers)
+    metered = client.get("/charging-sessions/me", headers={**headers, "If-None-Match": etag})
+    assert metered.status_code == 200 and metered.headers["ETag"] != etag
+    etag = metered.headers["ETag"]
+
+    assert client.get("/invoices/me", headers=headers).json()["items"] == []
+    client.post(f"/charging-sessions/{session_id}/stop", headers=headers)
+    assert client.get("/charging-sessions/me", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+    invoices = client.get("/invoices/me", headers=headers)
+    invoice_etag = invoices.headers["ETag"]
+    assert len(invoices.json()["items"]) == 1
+    with _count_statements(db.engine) as statements:
+        cached = client.get("/invoices/me", headers={**headers, "If-None-Match": invoice_etag})
+    assert cached.status_code == 304
+    # Only the aggregate version query, no list query
+    assert len([s for s in statements if "FROM invoice" in s]) == 1 and "count(" in statements[-1].lower()
+
+    # Re-billing corrections go through a bulk UPDATE as well
+    invoice_id = invoices.json()["items"][0]["invoice_id"]
+    repository.update_invoice_totals([{"invoice_id": invoice_id, "cost_total": 1.0, "billing_total": 1.11}])
+    assert client.get("/invoices/me", headers={**headers, "If-None-Match": invoice_etag}).status_code == 200
+
+
+def test_unchanged_rows_keep_their_version(sqlite_engine):
+    (asset_id,), (user_id,) = _seed_assets()
+    service.start_charging_session(user_id, asset_id)
+    version = repository.get_charging_sessions_version(user_id)
+    assert version.count == 1 and version.last_modified is not None
+    with db.UnitOfWork() as uow:
+        session = repository.get_charging_sessions_by_user(user_id, db=uow.session).items[0]
+        session.total_kwh = session.total_kwh  # dirty, no net change
+        uow.session.add(session)
+        uow.commit()
+    assert repository.get_charging_sessions_version(user_id) == version
+
+
+def test_cached_station_reads_answer_304(sqlite_engine):
+    import main
+    client = TestClient(main.app)
+    (asset_id,), (user_id,) = _seed_assets()
+    station_id = _station_id_of(asset_id)
+
+    detail = client.get(f"/stations/{station_id}")
+    cached = client.get(f"/stations/{station_id}", headers={"If-None-Match": detail.headers["ETag"]})
+    assert cached.status_code == 304 and cached.headers["X-Cache"] == "HIT"
+    listed = client.get("/stations")
+    assert client.get("/stations", headers={"If-None-Match": listed.headers["ETag"]}).status_code == 304
+
+    service.start_charging_session(user_id, asset_id)
+    changed = client.get(f"/stations/{station_id}", headers={"If-None-Match": detail.headers["ETag"]})
+    assert changed.status_code == 200 and changed.headers["ETag"] != detail.headers["ETag"]
+
+
+# =====================================================
+# FAST SERIALIZATION
+# =====================================================
+
+from app import schemas, serialization
+
+
+def test_trusted_serialization_matches_validated_output(sqlite_engine):
+    (asset_id,), (user_id,) = _seed_assets()
+    session = service.start_charging_session(user_id, asset_id)
+    service.stop_charging_session(session.session_id, user_id)
+    _add_station(-6.2, 106.8)
+    with db.UnitOfWork() as uow:
+        # Rows written before the create schemas existed
+        uow.session.add(models.Station(station_operator="Lama", location=None, connector_list=[]))
+        uow.session.add(models.Station(station_operator="Lama", location={"address": "x"}, connector_list=["CCS"]))
+        invoice = repository.get_invoices_by_user(user_id, db=uow.session).items[0]
+        invoice.tariff = {"cost_per_kwh": 2500, "cost_per_minute": 0, "name": "legacy", "extra": 1}
+        uow.session.add(invoice)
+        uow.commit()
+
+    with db.UnitOfWork() as uow:
+        pages = [
+            (schemas.StationRead, repository.list_stations(db=uow.session)),
+            (schemas.ChargingSessionRead, repository.get_charging_sessions_by_user(user_id, db=uow.session)),
+            (schemas.InvoiceRead, repository.get_invoices_by_user(user_id, db=uow.session)),
+        ]
+        for schema, page in pages:
+            trusted = serialization.page_json(schema, page, serialization.TRUSTED)
+            assert trusted == serialization.page_json(schema, page, serialization.VALIDATED), schema.__name__
+
+        stations = json.loads(serialization.page_json(*pages[0], serialization.TRUSTED))["items"]
+        invoices = json.loads(serialization.page_json(*pages[2], serialization.TRUSTED))["items"]
+    assert [s["location"]["address"] for s in stations][-2:] == ["Unknown", "Unknown"]
+    assert invoices[0]["tariff"]["cost_per_kwh"] == 2500.0 and "extra" not in invoices[0]["tariff"]
+
+
+def test_list_endpoints_return_preserialized_pages(async_sqlite_engine):
+    import main
+    client = TestClient(main.app)
+    (asset_id,), (user_id,) = _seed_assets()
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+    service.start_charging_session(user_id, asset_id)
+
+    sessions = client.get("/charging-sessions/me", headers=headers)
+    assert sessions.headers["content-type"] == "application/json" and sessions.headers["ETag"]
+    assert sessions.json()["items"][0]["charging_status"] == models.ChargingStatus.ONGOING.value
+    assert client.get("/stations", params={"limit": 1}).json()["next_cursor"] is None
+
+
+# =====================================================
+# ENGINE PROFILES
+# =====================================================
+
+def test_engine_options_per_url_and_profile():
+    balanced = db.get_profile("balanced")
+    assert db.engine_options("postgresql://u:p@h/db", balanced) == {
+        "pool_size": 10, "max_overflow": 10, "pool_recycle": 1800, "pool_timeout": 30, "pool_pre_ping": True
+    }
+    assert db.engine_options("sqlite://", balanced) == {}
+    assert db.engine_options("sqlite:///./ev.db", db.get_profile("default")) == {}
+    with pytest.raises(ValueError):
+        db.get_profile("turbo")
+
+
+def test_sqlite_profile_sets_pragmas_on_every_connection(tmp_path):
+    profile = db.get_profile("throughput")
+    engine = db.make_engine(f"sqlite:///{tmp_path / 'profile.db'}", profile)
+    with engine.connect() as first, engine.connect() as second:
+        for conn in (first, second):
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 15000
+        assert db.pool_stats(engine)["checkedout"] == 2
+    stats = db.pool_stats(engine)
+    assert stats["pool"] == "QueuePool" and stats["size"] == 20 and stats["checkedin"] == 2
+    engine.dispose()
+
+
+def test_database_health_reports_pool(sqlite_engine):
+    import main
+    body = TestClient(main.app).get("/health/db").json()
+    assert body["profile"] == db.DB_PROFILE and body["pool"]["pool"] == "QueuePool"
+
+
+# =====================================================
+# READ REPLICAS
+# =====================================================
+
+@pytest.fixture
+def replica_engine(async_sqlite_engine, tmp_path, monkeypatch):
+    """Second SQLite file as read replica of sqlite_engine. Nothing replicates: tests write each side directly."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}", connect_args={"check_same_thread": False}, json_serializer=db.dumps)
+    SQLModel.metadata.create_all(engine)
+    async_replica = create_async_engine(str(engine.url).replace("sqlite://", "sqlite+aiosqlite://"), poolclass=NullPool)
+    monkeypatch.setattr(db, "replica_engines", [engine])
+    monkeypatch.setattr(db, "async_replica_engines", [async_replica])
+    db.sticky_writes.clear()
+    yield engine
+    db.sticky_writes.clear()
+    asyncio.run(async_replica.dispose())
+    engine.dispose()
+
+
+def _diverge_user(replica_engine, email="replica@mail.com"):
+    """Same user row on both sides, with a different email on the replica."""
+    _, (user_id,) = _seed_assets()
+    with Session(replica_engine) as s:
+        s.add(models.User(user_id=user_id, name="UoW", email=email, password_hash="x"))
+        s.commit()
+    return user_id
+
+
+def test_reads_go_to_replica_until_the_session_writes(replica_engine):
+    user_id = _diverge_user(replica_engine)
+    with db.UnitOfWork() as uow:
+        assert repository.get_user(user_id, db=uow.session).email == "replica@mail.com"
+    with db.UnitOfWork() as uow, db.on_primary():
+        assert repository.get_user(user_id, db=uow.session).email == "u0@mail.com"
+    with db.UnitOfWork(primary_only=True) as uow:
+        assert repository.get_user_by_email("u0@mail.com", db=uow.session) is not None
+
+    with db.UnitOfWork() as uow:
+        repository.create_user(_new_user("new@mail.com"), db=uow.session)
+        # Written in this transaction: only the primary has it
+        assert repository.get_user_by_email("new@mail.com", db=uow.session) is not None
+        assert repository.list_users(db=uow.session).items[0].email == "u0@mail.com"
+
+
+def test_user_reads_own_writes_from_primary_for_a_while(replica_engine, monkeypatch):
+    user_id = _diverge_user(replica_engine)
+    with db.UnitOfWork(sticky_key=user_id) as uow:
+        user = repository.get_user(user_id, db=uow.session)
+        assert user.email == "replica@mail.com"
+    with db.UnitOfWork(sticky_key=user_id) as uow:
+        repository.create_vehicle(models.Vehicle(
+            user_id=user_id, nomor_plat="B1", battery_capacity=60,
+            connector_port=models.ConnectorPort(standard_name="CCS", max_power_supported=50)
+        ), db=uow.session)
+        uow.commit()
+
+    with db.UnitOfWork(sticky_key=user_id) as uow:
+        assert repository.get_user(user_id, db=uow.session).email == "u0@mail.com"
+    with db.UnitOfWork(sticky_key=user_id + 1) as uow:
+        assert repository.get_user(user_id, db=uow.session).email == "replica@mail.com"
+    monkeypatch.setattr(db.sticky_writes, "window", 0)
+    with db.UnitOfWork(sticky_key=user_id) as uow:
+        assert repository.get_user(user_id, db=uow.session).email == "replica@mail.com"
+
+
+def test_endpoints_route_by_method_and_user(replica_engine):
+    import main
+    user_id = _diverge_user(replica_engine)
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+
+    assert client.get("/auth/me", headers=headers).json()["email"] == "replica@mail.com"
+    created = client.post("/vehicles", headers=headers, json={
+        "nomor_plat": "B2", "battery_capacity": 60, "connector_port": {"standard_name": "CCS", "max_power_supported": 50}
+    })
+    assert created.status_code == 200
+    # Own write just committed: GETs are pinned to the primary (sync and async handlers)
+    assert client.get("/auth/me", headers=headers).json()["email"] == "u0@mail.com"
+    assert client.get("/vehicles/me", headers=headers).json()["items"][0]["nomor_plat"] == "B2"
+
+    other = _new_user("other@mail.com")
+    with db.get_session() as s:
+        s.add(other)
+        s.commit()
+        other_id = other.user_id
+    other_headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': other_id})}"}
+    # Other users still read the replica, which has no such user
+    assert client.get("/auth/me", headers=other_headers).status_code == 404
+
+
+def test_async_sessions_route_reads_to_replica(replica_engine):
+    user_id = _diverge_user(replica_engine)
+
+    @db.reads
+    async def get_user(user_id, db):
+        return await db.get(models.User, user_id)
+
+    async def scenario():
+        async with db.AsyncUnitOfWork() as uow:
+            replica_email = (await get_user(user_id, db=uow.session)).email
+        async with db.AsyncUnitOfWork(primary_only=True) as uow:
+            primary_email = (await get_user(user_id, db=uow.session)).email
+        return replica_email, primary_email
+
+    assert asyncio.run(scenario()) == ("replica@mail.com", "u0@mail.com")
+
+
+# =====================================================
+# LIFECYCLE LOAD TEST
+# =====================================================
+
+import httpx
+from benchmarks import bench_lifecycle
+
+
+def test_lifecycle_load_test_reports_every_endpoint(async_sqlite_engine, monkeypatch):
+    import main
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await bench_lifecycle.run(client, users=3, concurrency=2, cycles=2)
+
+    report = asyncio.run(scenario())
+    assert list(report["endpoints"]) == bench_lifecycle.ENDPOINTS
+    assert report["endpoints"]["PATCH /invoices/{id}/payment"]["requests"] == 6
+    assert report["total"]["errors"] == 0 and report["total"]["failed_flows"] == 0
+    stats = report["endpoints"]["GET /invoices/me"]
+    assert 0 < stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+
+    slower = json.loads(json.dumps(report))
+    slower["endpoints"]["GET /invoices/me"]["p95_ms"] *= 2
+    assert bench_lifecycle.compare(slower, report, threshold=0.1) == ["GET /invoices/me"]
+    assert bench_lifecycle.compare(report, report, threshold=0.1) == []
+
+
+def test_percentile_is_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert [bench_lifecycle.percentile(values, q) for q in (50, 95, 99, 100)] == [50.0, 95.0, 99.0, 100.0]
+    assert bench_lifecycle.percentile([], 95) == 0.0
+
+
+# =====================================================
+# REQUEST PROFILING
+# =====================================================
+
+import re
+from app import profiling
+
+
+def _server_timing(response) -> dict:
+    entries = {}
+    for entry in response.headers["server-timing"].split(", "):
+        name, *params = entry.split(";")
+        entries[name] = dict(p.split("=", 1) for p in params)
+    return entries
+
+
+def test_server_timing_counts_request_queries(sqlite_engine):
+    import main
+    _seed_assets(n_assets=3)
+    client = TestClient(main.app)
+
+    with _count_statements(sqlite_engine) as statements:
+        response = client.get("/stations")
+    timing = _server_timing(response)
+    assert set(timing) == {"app", "handler", "db", "serialize"}
+    assert timing["db"]["desc"] == f'"{len(statements)} queries"'
+    assert len(statements) > 0
+    assert float(timing["handler"]["dur"]) <= float(timing["app"]["dur"])
+
+    # Cached response: no SQL at all
+    assert _server_timing(client.get("/stations"))["db"]["desc"] == '"0 queries"'
+
+
+def test_metrics_exposes_route_histograms(sqlite_engine):
+    import main
+    for h in profiling.HISTOGRAMS:
+        h.clear()
+    client = TestClient(main.app)
+    client.get("/stations")
+    client.get("/stations/999999")
+
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/stations"} 1' in body
+    assert 'http_request_db_queries_count{method="GET",route="/stations/{station_id}"} 1' in body
+    assert re.search(r'http_request_db_queries_bucket\{method="GET",route="/stations",le="\+Inf"\} 1', body)
+    assert 'response_cache{stat="misses"}' in body
+    assert 'password_hashing_pool{stat="queue_depth"}' in body
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = profiling.Histogram("h", "test", (1, 5))
+    for value in (0, 1, 3, 9):
+        histogram.observe(value, route="/x")
+    lines = histogram.render()
+    assert 'h_bucket{route="/x",le="1"} 2' in lines
+    assert 'h_bucket{route="/x",le="5"} 3' in lines
+    assert 'h_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 'h_sum{route="/x"} 13.0' in lines
+
+
+def test_slow_requests_dump_collapsed_stacks(tmp_path):
+    from fastapi import FastAPI
+
+    app = FastAPI()
+    app.router.route_class = profiling.TimedRoute
+    app.add_middleware(profiling.ProfilingMiddleware, slow_ms=1, profile_dir=str(tmp_path))
+
+    @app.get("/slow")
+    def slow():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+        return {}
+
+    @app.get("/fast")
+    def fast():
+        return {}
+
+    real_dump = profiling.dump_profile
+    on_event_loop = []
+
+    def dump(*args):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return real_dump(*args)
+
+    client = TestClient(app)
+    with patch("app.profiling.dump_profile", side_effect=dump):
+        assert client.get("/slow").status_code == 200
+    # Written from a worker thread, not on the event loop
+    assert on_event_loop == [False]
+    (dump,) = tmp_path.iterdir()
+    assert dump.name.endswith("-GET-slow.folded")
+    stacks = dump.read_text().splitlines()
+    assert stacks and all(re.fullmatch(r"\S.* \d+", line) for line in stacks)
+    assert any(";test_charging_service.py:slow" in line for line in stacks)
+
+
+# =====================================================
+# QUERY BUDGETS (N+1 DETECTOR)
+# =====================================================
+
+# Maximum SQL statements per request, by (method, route template). Counted by
+# app.profiling on every engine, cold caches included; raise a budget only
+# together with the change that needs the extra query.
+QUERY_BUDGETS = {
+    ("GET", "/stations"): 1,
+    ("GET", "/stations/{station_id}"): 1,  # cold read model: station LEFT JOIN assets; warm hits run none
+    ("GET", "/stations/{station_id}/availability"): 1,
+    ("GET", "/stations/nearby"): 2,  # cold: lazy geo index load + station rows (availability index already warm); warm runs one
+    ("GET", "/station-assets/{asset_id}"): 1,
+    ("GET", "/auth/me"): 1,
+    ("GET", "/vehicles/me"): 1,
+    ("POST", "/charging-sessions/start"): 3,
+    ("GET", "/charging-sessions/{session_id}"): 1,
+    ("GET", "/charging-sessions/me/active"): 1,
+    ("GET", "/charging-sessions/me"): 2,  # row version + page
+    ("POST", "/charging-sessions/{session_id}/stop"): 7,
+    ("GET", "/invoices/me"): 2,  # row version + page
+    ("GET", "/invoices/{invoice_id}"): 1,
+    ("PATCH", "/invoices/{invoice_id}/payment"): 2,
+}
+
+
+class QueryBudget:
+    """Collects the statement count of every request made while the fixture is active."""
+    def __init__(self, budgets):
+        self.budgets = dict(budgets)
+        self.requests = []
+
+    def record(self, method, route, stats):
+        self.requests.append((method, route, stats.queries))
+
+    def over_budget(self):
+        return [
+            (method, route, queries, self.budgets[(method, route)])
+            for method, route, queries in self.requests
+            if (method, route) in self.budgets and queries > self.budgets[(method, route)]
+        ]
+
+
+@pytest.fixture
+def query_budget(monkeypatch):
+    """Fails the test if any request ran more statements than QUERY_BUDGETS allows."""
+    budget = QueryBudget(QUERY_BUDGETS)
+    monkeypatch.setattr(profiling, "observers", [*profiling.observers, budget.record])
+    yield budget
+    exceeded = budget.over_budget()
+    if exceeded:
+        pytest.fail("query budget exceeded:\n" + "\n".join(
+            f"  {method} {route}: {queries} queries (budget {limit})" for method, route, queries, limit in exceeded
+        ))
+
+
+def test_charging_flow_stays_within_query_budgets(async_sqlite_engine, query_budget):
+    import main
+    (asset_id,), (user_id,) = _seed_assets()
+    station_id = _station_id_of(asset_id)
+    headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': user_id})}"}
+    client = TestClient(main.app)
+
+    for _ in range(2):  # cold, then warm caches
+        assert client.get("/stations").status_code == 200
+        assert client.get(f"/stations/{station_id}").status_code == 200
+        assert client.get(f"/stations/{station_id}/availability").status_code == 200
+        assert client.get("/stations/nearby", params={"lat": 0, "lon": 0, "radius": 200}).status_code == 200
+        assert client.get(f"/station-assets/{asset_id}").status_code == 200
+        assert client.get("/auth/me", headers=headers).status_code == 200
+        assert client.get("/vehicles/me", headers=headers).status_code == 200
+
+    session_id = client.post("/charging-sessions/start", json={"asset_id": asset_id}, headers=headers).json()["session_id"]
+    assert client.get(f"/charging-sessions/{session_id}", headers=headers).status_code == 200
+    assert client.get("/charging-sessions/me/active", headers=headers).status_code == 200
+    assert client.get("/charging-sessions/me", headers=headers).status_code == 200
+    assert client.post(f"/charging-sessions/{session_id}/stop", headers=headers).status_code == 200
+    invoice_id = client.get("/invoices/me", headers=headers).json()["items"][0]["invoice_id"]
+    assert client.get(f"/invoices/{invoice_id}", headers=headers).status_code == 200
+    paid = client.patch(f"/invoices/{invoice_id}/payment", headers=headers, json={"payment_status": "Completed", "payment_method": "Cash"})
+    assert paid.status_code == 200
+
+    # Every budgeted endpoint was exercised; the fixture checks the counts
+    assert {(method, route) for method, route, _ in query_budget.requests} == set(QUERY_BUDGETS)
+
+
+def test_query_budget_reports_requests_over_budget(sqlite_engine, monkeypatch):
+    import main
+    _seed_assets(n_assets=2)
+    budget = QueryBudget({("GET", "/stations"): 0})
+    monkeypatch.setattr(profiling, "observers", [budget.record])
+    client = TestClient(main.app)
+
+    client.get("/stations")  # cold: one SELECT
+    client.get("/stations")  # served from the response cache
+    assert budget.over_budget() == [("GET", "/stations", 1, 0)]
@@ -2,7 +2,7 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 from main import app
-from app import schemas, models
+from app import schemas, models, repository
 
 client = TestClient(app)
 
@@ -21,9 +21,9 @@ def test_search_stations_by_operator_found(mock_db_session: MagicMock):
             connector_list=[]
         )
     ]
-    mock_db_session.search_stations_by_operator.return_value = mock_station_data
+    mock_db_session.search_stations_by_operator.return_value = repository.Page(mock_station_data)
     response = client.get("/stations/search?operator=Operator A")
     assert response.status_code == 200
-    response_data = response.json()
+    response_data = response.json()["items"]
     assert len(response_data) == 1
     assert response_data[0]["station_operator"] == "Operator A"
\ No newline at end of file